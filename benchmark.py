@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for Farcaster Prediction Market
+Generates synthetic markets in a scratch database and measures settlement,
+listing and profile aggregation.
+
+Usage:
+    python benchmark.py                              # 1k, 100k and 1M bets
+    python benchmark.py --sizes 1000 100000 --output bench.json
+    python benchmark.py --baseline bench.json        # flag regressions
+
+Each result reports wall time, peak Python memory and SQL statement count.
+The JSON output can be diffed between releases with --baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from project import app, settlement_engine, settle_market_record, calculate_payout
+from database import db, init_db, Bet, MarketEvent, Transaction, UserProfile
+from utils import BettingCalculator, ResponseCache
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+INSERT_CHUNK = 50000
+LISTING_MARKETS = 2000
+MAX_BETTORS = 1000
+PAYOUT_CALLS = 100000
+RESULT_VALUE = 3
+
+
+# ==================== MEASUREMENT ====================
+
+class StatementCounter:
+    """Count SQL statements sent to the engine"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def measure(counter, fn, setup=None):
+    """Run fn twice: once for wall time and statement count, once under
+    tracemalloc for peak memory, so tracing overhead does not skew timings
+
+    setup, if given, runs before each run outside the timing, statement
+    count and memory trace, to put the database back in its starting state.
+    """
+    if setup:
+        setup()
+    start_statements = counter.count
+    start = time.perf_counter()
+    fn()
+    wall = time.perf_counter() - start
+    statements = counter.count - start_statements
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'wall_s': round(wall, 4),
+        'peak_mem_kb': round(peak / 1024, 1),
+        'sql_statements': statements
+    }
+
+
+# ==================== SYNTHETIC DATA ====================
+
+def seed(bet_count, rng):
+    """Create bettors, listing markets and one market holding bet_count bets"""
+    now = datetime.utcnow()
+    bettors = min(MAX_BETTORS, bet_count)
+
+    db.session.execute(UserProfile.__table__.insert(), [
+        {'fid': fid, 'username': f'user{fid}', 'created_at': now, 'updated_at': now}
+        for fid in range(1, bettors + 1)
+    ])
+    db.session.execute(MarketEvent.__table__.insert(), [
+        {
+            'user_fid': rng.randint(1, bettors),
+            'market_type': rng.choice(['casts_count', 'likes_total', 'engagement_score']),
+            'threshold': 5,
+            'direction': 'over',
+            'status': 'active',
+            'created_at': now,
+            'end_time': now + timedelta(minutes=rng.randint(60, 60 * 24 * 7)),
+            'total_pool': 0,
+            'bets_count': 0,
+            'over_pool': 0,
+            'under_pool': 0
+        }
+        for _ in range(LISTING_MARKETS)
+    ])
+
+    market = MarketEvent(
+        user_fid=1,
+        market_type='casts_count',
+        threshold=5,
+        direction='under',
+        end_time=now + timedelta(days=8),
+        status='active'
+    )
+    db.session.add(market)
+    db.session.commit()
+
+    over_pool = under_pool = 0.0
+    over_bets = 0
+    for offset in range(0, bet_count, INSERT_CHUNK):
+        rows = []
+        for _ in range(min(INSERT_CHUNK, bet_count - offset)):
+            prediction = rng.choice(['over', 'under'])
+            amount = round(rng.uniform(1, 100), 2)
+            if prediction == 'over':
+                over_pool += amount
+                over_bets += 1
+            else:
+                under_pool += amount
+            rows.append({
+                'market_id': market.id,
+                'user_fid': rng.randint(1, bettors),
+                'user_wallet': '0x' + '0' * 40,
+                'prediction': prediction,
+                'amount': amount,
+                'base_fee': 0.2,
+                'status': 'active',
+                'placed_at': now
+            })
+        db.session.execute(Bet.__table__.insert(), rows)
+
+    MarketEvent.query.filter_by(id=market.id).update({
+        'bets_count': bet_count,
+        'total_pool': over_pool + under_pool,
+        'over_pool': over_pool,
+        'under_pool': under_pool,
+        'over_bets': over_bets,
+        'under_bets': bet_count - over_bets
+    })
+    db.session.commit()
+    return market.id
+
+
+def reset_settlement(market_id):
+    """Return a settled market and its bets to their pre-settlement state
+
+    The market's win-fee intent is deleted too, so the next settlement sends
+    its fee sweep instead of finding the previous run's transfer.
+    """
+    Transaction.query.filter_by(idempotency_key=f"market:{market_id}:win_fees").delete()
+    Bet.query.filter_by(market_id=market_id).update({
+        'status': 'active', 'payout': None, 'fee_on_win': None, 'settled_at': None
+    })
+    MarketEvent.query.filter_by(id=market_id).update({
+        'status': 'active', 'result_value': None, 'win_fee_total': None, 'settled_at': None
+    })
+    db.session.commit()
+
+
+# ==================== SCENARIOS ====================
+
+def run_size(bet_count, counter, rng):
+    """Seed a fresh scratch database and run every scenario against it"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_start = time.perf_counter()
+        market_id = seed(bet_count, rng)
+        print(f"  seeded {bet_count:,} bets in {time.perf_counter() - seed_start:.1f}s")
+
+        client = app.test_client()
+        results = {}
+
+        def unsettle():
+            reset_settlement(market_id)
+            db.session.expire_all()
+
+        def settle():
+            settle_market_record(db.session.get(MarketEvent, market_id), RESULT_VALUE)
+
+        def dry_run():
+            settlement_engine.plan(db.session.get(MarketEvent, market_id), RESULT_VALUE)
+
+        def list_first_page():
+            assert client.get('/api/markets?limit=50').status_code == 200
+
+        def list_deep_page():
+            cursor = None
+            for _ in range(10):
+                params = {'limit': 50}
+                if cursor:
+                    params['cursor'] = cursor
+                cursor = client.get('/api/markets', query_string=params).get_json()['next_cursor']
+
+        def profile():
+            assert client.get('/api/users/1').status_code == 200
+
+        # Before settle, which leaves the market settled with no active bets to plan
+        results['settle_dry_run'] = measure(counter, dry_run)
+        results['settle_market'] = measure(counter, settle, setup=unsettle)
+        results['list_markets_first_page'] = measure(counter, list_first_page, setup=ResponseCache.clear)
+        results['list_markets_10_pages'] = measure(counter, list_deep_page, setup=ResponseCache.clear)
+        results['user_profile'] = measure(counter, profile, setup=ResponseCache.clear)
+
+        db.session.remove()
+
+    return results
+
+
+def run_payout_calculations():
+    """Time the per-bet payout helpers, which do not depend on database size"""
+    counter = type('NoStatements', (), {'count': 0})()
+
+    def project_payout():
+        for i in range(PAYOUT_CALLS):
+            calculate_payout(bet_amount=10.0, total_pool=10000.0, winner_count=i % 500 + 1)
+
+    def utils_payout():
+        for i in range(PAYOUT_CALLS):
+            BettingCalculator.calculate_payout(bet_amount=10.0, total_pool=10000.0, winner_count=i % 500 + 1)
+
+    return {
+        'project.calculate_payout': measure(counter, project_payout),
+        'utils.BettingCalculator.calculate_payout': measure(counter, utils_payout)
+    }
+
+
+# ==================== REPORTING ====================
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print deltas against a baseline run; returns the regressed entries"""
+    previous = {(r['scenario'], r['size']): r for r in baseline['results']}
+    regressions = []
+
+    print(f"\n{'scenario':<45} {'size':>9} {'wall_s':>10} {'delta':>8} {'sql':>6} {'base sql':>8}")
+    for result in results:
+        before = previous.get((result['scenario'], result['size']))
+        if not before:
+            continue
+
+        delta = (result['wall_s'] - before['wall_s']) / before['wall_s'] if before['wall_s'] else 0
+        regressed = delta > threshold or result['sql_statements'] > before['sql_statements']
+        if regressed:
+            regressions.append(result)
+
+        marker = '  <-- regression' if regressed else ''
+        print(f"{result['scenario']:<45} {str(result['size']):>9} {result['wall_s']:>10.4f} "
+              f"{delta:>+8.0%} {result['sql_statements']:>6} {before['sql_statements']:>8}{marker}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark settlement, listing and profile aggregation')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Bet counts for the synthetic market (default: 1000 100000 1000000)')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write JSON results')
+    parser.add_argument('--baseline', help='Earlier JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Wall time increase counted as a regression (default: 0.2 = 20%%)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for synthetic data')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+
+    for name, metrics in run_payout_calculations().items():
+        results.append({'scenario': name, 'size': PAYOUT_CALLS, **metrics})
+
+    scratch_dir = tempfile.mkdtemp(prefix='fpm_bench_')
+    try:
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(scratch_dir, 'bench.db')}"
+        init_db(app)
+        with app.app_context():
+            counter = StatementCounter(db.engine)
+
+        for size in args.sizes:
+            print(f"Benchmarking market with {size:,} bets")
+            for name, metrics in run_size(size, counter, rng).items():
+                results.append({'scenario': name, 'size': size, **metrics})
+                print(f"  {name:<30} {metrics['wall_s']:>9.4f}s {metrics['peak_mem_kb']:>10.1f} KB "
+                      f"{metrics['sql_statements']:>5} statements")
+    finally:
+        with app.app_context():
+            db.engine.dispose()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,12 @@ NOTE: Stubbed for development mode without web3 dependencies
 """
 
 import os
+import hashlib
 from dotenv import load_dotenv
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
 from database import db, Transaction
 
 load_dotenv()
@@ -19,6 +22,8 @@ PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
 TREASURE_WALLET = "0xf2B6664bF4d507C8889f07174A6A6dE53CEFD7fC"
 USDC_CONTRACT = os.getenv("USDC_CONTRACT", "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48")
 CHAIN_ID = int(os.getenv("CHAIN_ID", "1"))  # Ethereum mainnet
+PLATFORM_WALLET = os.getenv("PLATFORM_WALLET", "platform")  # Hot wallet that pays out
+TRANSFER_CLAIM_TIMEOUT_SECONDS = int(os.getenv("TRANSFER_CLAIM_TIMEOUT_SECONDS", "300"))  # Claim age treated as abandoned
 
 
 class WalletManager:
@@ -83,8 +88,13 @@ class TransactionHandler:
     def __init__(self):
         self.web3 = None
     
-    def send_transaction(self, to_address, amount, description='', tx_type='payment', amount_usd=None):
-        """Send a transaction (development stub)"""
+    def send_transaction(self, to_address, amount, description='', tx_type='payment', amount_usd=None,
+                         idempotency_key=None):
+        """Send a transaction (development stub)
+        
+        With an idempotency_key, resubmitting the same transfer yields the same
+        transaction instead of a second one.
+        """
         try:
             # Support both 'amount' and 'amount_usd' parameters for compatibility
             actual_amount = amount if amount is not None else amount_usd
@@ -92,7 +102,10 @@ class TransactionHandler:
             # Log transaction in development mode
             print(f"[DEV MODE] Transaction: {to_address} <- ${actual_amount} ({description or tx_type})")
             
-            tx_hash = f'0xdev_{int(datetime.now().timestamp())}_{to_address[-8:]}'
+            if idempotency_key:
+                tx_hash = '0x' + hashlib.sha256(idempotency_key.encode()).hexdigest()
+            else:
+                tx_hash = f'0xdev_{int(datetime.now().timestamp())}_{to_address[-8:]}'
             
             return {
                 'success': True,
@@ -112,6 +125,84 @@ class TransactionHandler:
                 'hash': None
             }
     
+    def send_transaction_once(self, idempotency_key, to_address, amount, description='',
+                              tx_type='payment', related_id=None):
+        """Send a transfer at most once per idempotency key
+        
+        The intent is committed to the transactions table, then claimed with a
+        conditional status update (pending or failed -> sending) before
+        submitting, so only one process ever submits it. A caller that finds the
+        intent claimed elsewhere gets an in-progress failure and retries later.
+        A claim older than TRANSFER_CLAIM_TIMEOUT_SECONDS is treated as
+        abandoned by a crashed sender and may be taken over. Commits the
+        current session.
+        """
+        record = Transaction.query.filter_by(idempotency_key=idempotency_key).first()
+        if record and record.tx_hash:
+            return self._recorded_result(record)
+        
+        if not record:
+            db.session.add(Transaction(
+                idempotency_key=idempotency_key,
+                from_address=PLATFORM_WALLET,
+                to_address=to_address,
+                amount=amount,
+                tx_type=tx_type,
+                related_id=related_id,
+                status='pending'
+            ))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                # Only a concurrent caller recording the same intent first is
+                # expected; the claim below then decides who sends
+                if not Transaction.query.filter_by(idempotency_key=idempotency_key).count():
+                    raise
+        
+        now = datetime.utcnow()
+        abandoned = now - timedelta(seconds=TRANSFER_CLAIM_TIMEOUT_SECONDS)
+        claimed = Transaction.query.filter(
+            Transaction.idempotency_key == idempotency_key,
+            Transaction.tx_hash.is_(None),
+            or_(
+                Transaction.status.in_(('pending', 'failed')),
+                and_(Transaction.status == 'sending', Transaction.claimed_at < abandoned)
+            )
+        ).update({'status': 'sending', 'claimed_at': now}, synchronize_session=False)
+        db.session.commit()
+        
+        record = Transaction.query.filter_by(idempotency_key=idempotency_key).one()
+        if not claimed:
+            if record.tx_hash:
+                return self._recorded_result(record)
+            return {'success': False, 'status': record.status, 'hash': None, 'in_progress': True,
+                    'error': 'Transfer is already being sent by another process'}
+        
+        result = self.send_transaction(
+            to_address=record.to_address,
+            amount=record.amount,
+            description=description,
+            tx_type=tx_type,
+            idempotency_key=idempotency_key
+        )
+        
+        if result['success']:
+            record.tx_hash = result['hash']
+            record.status = 'pending'
+            record.error_message = None
+        else:
+            record.status = 'failed'
+            record.error_message = result['error']
+        db.session.commit()
+        
+        return result
+    
+    @staticmethod
+    def _recorded_result(record):
+        return {'success': True, 'hash': record.tx_hash, 'tx_hash': record.tx_hash,
+                'status': record.status, 'error': None, 'duplicate': True}
+    
     def send_usdc(self, to_address, amount, wallet_private_key=None):
         """Send USDC tokens (development stub)"""
         try:
@@ -0,0 +1,161 @@
+"""
+Cast index for Farcaster Prediction Market
+Keeps each fid's cast timestamps locally so casts_count metrics cost a binary search
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from config import CastIndexConfig
+
+
+def parse_cast_time(value):
+    """Epoch seconds of a cast's ISO 8601 created_at; naive times are UTC, None if unparseable"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def to_epoch(moment):
+    """Epoch seconds of a naive UTC datetime"""
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+class FidCasts:
+    """Indexed cast timestamps of one fid"""
+
+    def __init__(self, complete_from):
+        self.times = []  # Sorted epoch seconds
+        self.high_water = float('-inf')  # Newest indexed cast time
+        self.high_water_ids = set()  # Casts indexed at exactly high_water
+        self.complete_from = complete_from  # Every cast at or after this is indexed
+        self.synced_until = float('-inf')  # Wall clock of the last sync
+
+    def is_indexed(self, cast_time, cast_id):
+        """Whether a cast is at or below the high-water mark, i.e. already indexed"""
+        return cast_time < self.high_water or (cast_time == self.high_water and cast_id in self.high_water_ids)
+
+    def add(self, cast_time, cast_id):
+        if cast_time > self.high_water:
+            self.high_water = cast_time
+            self.high_water_ids = set()
+        if cast_time == self.high_water:
+            self.high_water_ids.add(cast_id)
+        insort(self.times, cast_time)
+
+    def count(self, start, end):
+        return bisect_left(self.times, end) - bisect_left(self.times, start)
+
+
+class CastIndex:
+    """Per-fid cast timestamps, fetched incrementally
+
+    ``fetch_page(fid, cursor)`` returns one page of casts, newest first, and
+    the cursor of the next page (None on the last). A fid's first lookup
+    pages back until it passes the window start; later lookups only page
+    until they reach the newest cast already indexed, usually one request.
+    Counting casts in any window already covered is then two binary searches
+    with no request at all. Timestamps older than RETENTION_DAYS are dropped,
+    and at most MAX_FIDS fids are kept, least recently used evicted first.
+    """
+
+    def __init__(self, fetch_page, config=CastIndexConfig):
+        self.fetch_page = fetch_page
+        self.config = config
+        self._entries = OrderedDict()
+        self._fid_locks = {}
+        self._lock = threading.Lock()
+
+    def count(self, fid, start, end, exact=False):
+        """Number of casts by fid created in [start, end), both naive UTC datetimes
+
+        A window ending after the fid's last sync is answered from that sync
+        if it is under REFRESH_SECONDS old; with exact, as settlement needs,
+        it is always synced first.
+        """
+        start, end = to_epoch(start), to_epoch(end)
+        with self._fid_lock(fid):
+            entry = self._sync(fid, start, end, exact)
+            return entry.count(start, end)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._fid_locks.clear()
+
+    def _fid_lock(self, fid):
+        with self._lock:
+            return self._fid_locks.setdefault(fid, threading.Lock())
+
+    def _sync(self, fid, start, end, exact=False):
+        """Bring a fid's index up to date enough to answer [start, end)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(fid)
+            if entry is not None:
+                self._entries.move_to_end(fid)
+
+        backfill = entry is None or start < entry.complete_from
+        if not backfill:
+            fresh = not exact and now - entry.synced_until < self.config.REFRESH_SECONDS
+            if entry.synced_until >= end or fresh:
+                return entry
+
+        if backfill:
+            entry = FidCasts(complete_from=start)
+        # Collected first and indexed only once every page was read, so a failed
+        # fetch leaves the high-water mark where the next sync can resume from
+        new_casts = []
+        cursor = None
+        for _ in range(self.config.MAX_PAGES):
+            casts, cursor = self.fetch_page(fid, cursor)
+            oldest = float('inf')
+            for cast in casts:
+                cast_time = parse_cast_time(cast.get('created_at'))
+                if cast_time is None:
+                    continue
+                oldest = min(oldest, cast_time)
+                cast_id = cast.get('hash') or cast.get('created_at')
+                if cast_time >= start if backfill else not entry.is_indexed(cast_time, cast_id):
+                    new_casts.append((cast_time, cast_id))
+
+            # Stop once this page reaches casts indexed before, or older than needed
+            reached = oldest < start if backfill else oldest <= max(entry.high_water, entry.complete_from)
+            if reached or not casts:
+                break
+            if not cursor:
+                if backfill:
+                    entry.complete_from = float('-inf')  # The fid's whole history
+                break
+        else:
+            if backfill:
+                # Page limit hit before the window start; only what was read is complete
+                entry.complete_from = max(start, oldest)
+            else:
+                # More new casts than the page limit; rebuild from scratch next time
+                entry.complete_from = float('inf')
+
+        for cast_time, cast_id in set(new_casts):
+            entry.add(cast_time, cast_id)
+
+        # Keep what this lookup needs even when it reaches back past retention
+        cutoff = min(now - self.config.RETENTION_DAYS * 86400, start)
+        if entry.times and entry.times[0] < cutoff:
+            del entry.times[:bisect_left(entry.times, cutoff)]
+        entry.complete_from = max(entry.complete_from, cutoff)
+        entry.synced_until = now
+
+        with self._lock:
+            self._entries[fid] = entry
+            self._entries.move_to_end(fid)
+            while len(self._entries) > self.config.MAX_FIDS:
+                evicted, _ = self._entries.popitem(last=False)
+                self._fid_locks.pop(evicted, None)
+        return entry
@@ -2,8 +2,14 @@
 Configuration settings for Farcaster Prediction Market
 """
 
+import logging
 import os
 from datetime import timedelta
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Flask Configuration
 class Config:
@@ -15,9 +21,17 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.getenv(
         'DATABASE_URL',
-        'sqlite:///prediction_market.db'
+        f"sqlite:///{os.path.join(BASE_DIR, 'prediction_market.db')}"
     )
     
+    # Connection pool, per gunicorn worker process
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # Reconnect before server-side idle timeouts
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true'
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))  # PostgreSQL only; 0 disables
+    
     # Session configuration
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
     SESSION_COOKIE_SECURE = True
@@ -53,6 +67,12 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     SESSION_COOKIE_SECURE = True
+    
+    # One connection per gunicorn thread plus the background threads; with 4
+    # workers this stays under PostgreSQL's default 100 connections
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 16))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 4))
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
 
 
 class TestingConfig(Config):
@@ -63,6 +83,46 @@ class TestingConfig(Config):
     WTF_CSRF_ENABLED = False
 
 
+# Read Replica Configuration
+class ReplicaConfig:
+    """Optional read replica for GET endpoints and frame renders"""
+    # Unset keeps every read on the primary
+    DATABASE_URL = os.getenv('DATABASE_REPLICA_URL')
+    
+    # After a write, the client's reads stay on the primary this long; keep it
+    # above the replica's worst expected lag
+    READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+    READ_YOUR_WRITES_COOKIE = 'fpm_recent_write'
+
+
+# SQLite Configuration
+class SQLiteConfig:
+    """Connection pragmas for single-node SQLite deployments"""
+    # 'production' applies the pragmas below to every pooled connection;
+    # 'default' keeps SQLite's rollback journal and defaults
+    PROFILE = os.getenv(
+        'SQLITE_PROFILE',
+        'production' if os.getenv('FLASK_ENV', 'development').lower() == 'production' else 'default'
+    )
+    
+    # WAL lets readers proceed while one worker writes
+    JOURNAL_MODE = 'WAL'
+    
+    # How long a connection waits for the write lock before 'database is locked'
+    BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    
+    # NORMAL is durable across application crashes in WAL mode
+    SYNCHRONOUS = 'NORMAL'
+    
+    # Page cache per connection, in KiB
+    CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+    
+    # Bytes of the database file read through mmap
+    MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    
+    TEMP_STORE = 'MEMORY'
+
+
 # Get configuration from environment
 def get_config():
     """Get appropriate configuration based on environment"""
@@ -88,6 +148,9 @@ class BettingConfig:
     MAX_BET_AMOUNT = 1000.0
     MIN_POOL_AMOUNT = 10.0
     
+    # Maximum bets accepted by one POST /api/bets/batch
+    MAX_BATCH_BETS = int(os.getenv('MAX_BATCH_BETS', 100))
+    
     # Durations
     MIN_MARKET_DURATION_HOURS = 1
     MAX_MARKET_DURATION_HOURS = 7 * 24  # 7 days
@@ -212,6 +275,235 @@ class CacheConfig:
         'user_balance': 60,   # 1 minute
         'farcaster_data': 300  # 5 minutes
     }
+    
+    # Seconds between polls for invalidations recorded by other workers
+    INVALIDATION_POLL_SECONDS = float(os.getenv('CACHE_INVALIDATION_POLL_SECONDS', 1))
+    
+    # Seconds each poll reads back, so invalidations committed out of order
+    # by concurrent transactions are not missed
+    INVALIDATION_OVERLAP_SECONDS = int(os.getenv('CACHE_INVALIDATION_OVERLAP_SECONDS', 10))
+
+
+# Streaming Configuration
+class StreamConfig:
+    """Server-Sent Events stream configuration"""
+    # Events buffered per subscriber before it is dropped as too slow
+    SUBSCRIBER_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 100))
+    
+    # Seconds between keep-alive comments on an idle stream
+    HEARTBEAT_SECONDS = int(os.getenv('STREAM_HEARTBEAT_SECONDS', 15))
+    
+    # Reconnect delay suggested to clients (milliseconds)
+    RETRY_MS = 3000
+    
+    # Open streams per worker process; each holds a request thread, so keep
+    # this below gunicorn's --threads to leave threads for the API
+    MAX_STREAMS_PER_WORKER = int(os.getenv('STREAM_MAX_PER_WORKER', 8))
+    
+    # Seconds between polls for events published by any worker
+    POLL_SECONDS = float(os.getenv('STREAM_POLL_SECONDS', 1))
+    
+    # Seconds each poll reads back, so events committed out of order are not missed
+    POLL_OVERLAP_SECONDS = 10
+    
+    # Seconds published events are kept before being pruned
+    EVENT_RETENTION_SECONDS = 300
+
+
+# Settlement Configuration
+class SettlementConfig:
+    """Market settlement configuration"""
+    # Concurrent Farcaster metric fetches when settling many markets
+    METRIC_FETCH_WORKERS = int(os.getenv('SETTLEMENT_FETCH_WORKERS', 8))
+    
+    # Maximum markets accepted by one settle-batch request
+    MAX_BATCH_MARKETS = int(os.getenv('SETTLEMENT_MAX_BATCH', 100))
+    
+    # Lookback window for casts_count markets
+    METRIC_WINDOW_HOURS = 24
+
+
+# Cast Index Configuration
+class CastIndexConfig:
+    """Per-fid cast timestamps kept for casts_count metrics"""
+    # Casts requested per hub page
+    PAGE_SIZE = int(os.getenv('CAST_INDEX_PAGE_SIZE', 100))
+
+    # Most pages read by one sync; a fid with more new casts is rebuilt on its next lookup
+    MAX_PAGES = int(os.getenv('CAST_INDEX_MAX_PAGES', 50))
+
+    # Seconds a fid's index answers windows ending after its last sync without refetching
+    REFRESH_SECONDS = int(os.getenv('CAST_INDEX_REFRESH_SECONDS', 30))
+
+    # Timestamps older than this are dropped
+    RETENTION_DAYS = int(os.getenv('CAST_INDEX_RETENTION_DAYS', 30))
+
+    # Fids indexed per process, least recently used evicted first
+    MAX_FIDS = int(os.getenv('CAST_INDEX_MAX_FIDS', 10000))
+
+
+def parse_host_pool_sizes(value):
+    """Parse "host=size,host=size" into a dict, skipping malformed entries"""
+    sizes = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        host, _, size = entry.partition('=')
+        try:
+            size = int(size)
+        except ValueError:
+            size = 0
+        if not host.strip() or size < 1:
+            logger.warning(f"Ignoring malformed HTTP_HOST_POOL_SIZES entry {entry.strip()!r}")
+            continue
+        sizes[host.strip()] = size
+    return sizes
+
+
+# HTTP Client Configuration
+class HTTPClientConfig:
+    """Pooled, retrying client for hub and Neynar requests"""
+    # Seconds to establish a connection, and to wait for response data
+    CONNECT_TIMEOUT_SECONDS = float(os.getenv('HTTP_CONNECT_TIMEOUT_SECONDS', 3.05))
+    READ_TIMEOUT_SECONDS = float(os.getenv('HTTP_READ_TIMEOUT_SECONDS', 10))
+    
+    # Hosts with a connection pool, and open connections kept per host
+    POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))
+    POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 10))
+    
+    # Per-host pool sizes, e.g. "api.neynar.com=20,hub.farcaster.builders=16";
+    # the hub defaults to one connection per settlement fetch worker
+    HOST_POOL_SIZES = {
+        urlparse(FarcasterConfig.HUB_URL).netloc: max(POOL_MAXSIZE, SettlementConfig.METRIC_FETCH_WORKERS),
+        **parse_host_pool_sizes(os.getenv('HTTP_HOST_POOL_SIZES', ''))
+    }
+    
+    # Retries of idempotent requests after connection errors, timeouts and these statuses
+    MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    
+    # Retry n waits a random time up to min(BACKOFF_MAX, BACKOFF_BASE * 2**n) seconds
+    BACKOFF_BASE_SECONDS = float(os.getenv('HTTP_BACKOFF_BASE_SECONDS', 0.5))
+    BACKOFF_MAX_SECONDS = float(os.getenv('HTTP_BACKOFF_MAX_SECONDS', 8))
+    
+    # Longest Retry-After waited out; a longer one returns the response instead
+    MAX_RETRY_AFTER_SECONDS = float(os.getenv('HTTP_MAX_RETRY_AFTER_SECONDS', 30))
+    
+    # Most seconds one call may take, retries and waits included; kept well
+    # under gunicorn's 120s worker timeout
+    TOTAL_TIMEOUT_SECONDS = float(os.getenv('HTTP_TOTAL_TIMEOUT_SECONDS', 30))
+
+
+# Scheduler Configuration
+class SchedulerConfig:
+    """Auto-settlement scheduler configuration"""
+    # Seconds between scheduler ticks
+    POLL_INTERVAL_SECONDS = float(os.getenv('SCHEDULER_POLL_SECONDS', 5))
+    
+    # How far ahead of now expiring markets are loaded into the queue
+    LOOKAHEAD_SECONDS = int(os.getenv('SCHEDULER_LOOKAHEAD_SECONDS', 300))
+    
+    # Maximum markets held in the in-memory queue
+    QUEUE_LIMIT = int(os.getenv('SCHEDULER_QUEUE_LIMIT', 1000))
+    
+    # Maximum markets settled per tick
+    BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', 20))
+    
+    # Leader lease shared by all workers; renewed every tick
+    LEASE_SECONDS = int(os.getenv('SCHEDULER_LEASE_SECONDS', 30))
+    
+    # Failed settlements are retried after RETRY_BASE_SECONDS, doubling per
+    # consecutive failure up to RETRY_MAX_SECONDS
+    RETRY_BASE_SECONDS = int(os.getenv('SCHEDULER_RETRY_BASE_SECONDS', 30))
+    RETRY_MAX_SECONDS = int(os.getenv('SCHEDULER_RETRY_MAX_SECONDS', 900))
+
+
+# Payment Pipeline Configuration
+class PaymentPipelineConfig:
+    """Background bet payment pipeline configuration"""
+    # Seconds between pipeline ticks
+    POLL_INTERVAL_SECONDS = float(os.getenv('PAYMENT_POLL_SECONDS', 1))
+    
+    # Maximum bets submitted and maximum bets checked for confirmation per tick
+    BATCH_SIZE = int(os.getenv('PAYMENT_BATCH_SIZE', 50))
+    
+    # Bets whose payment is still unconfirmed after this long are failed
+    CONFIRMATION_TIMEOUT_SECONDS = int(os.getenv('PAYMENT_CONFIRMATION_TIMEOUT_SECONDS', 600))
+    
+    # Leader lease shared by all workers; renewed every tick
+    LEASE_SECONDS = int(os.getenv('PAYMENT_LEASE_SECONDS', 30))
+    
+    # Suggested client polling interval for bets awaiting confirmation
+    STATUS_RETRY_AFTER_SECONDS = 2
+
+
+# Withdrawal Processor Configuration
+class WithdrawalProcessorConfig:
+    """Background batched withdrawal payouts"""
+    # Seconds between processor ticks
+    POLL_INTERVAL_SECONDS = float(os.getenv('WITHDRAWAL_POLL_SECONDS', 10))
+    
+    # Maximum pending withdrawals claimed per tick
+    BATCH_SIZE = int(os.getenv('WITHDRAWAL_BATCH_SIZE', 500))
+    
+    # Transfers in flight at once
+    MAX_CONCURRENT_TRANSFERS = int(os.getenv('WITHDRAWAL_MAX_CONCURRENT_TRANSFERS', 8))
+    
+    # Claimed withdrawals still unpaid after this long were abandoned by a
+    # crashed tick and are paid again under the same transfer key
+    STALE_CLAIM_SECONDS = int(os.getenv('WITHDRAWAL_STALE_CLAIM_SECONDS', 300))
+    
+    # Leader lease shared by all workers; renewed every tick
+    LEASE_SECONDS = int(os.getenv('WITHDRAWAL_LEASE_SECONDS', 60))
+
+
+# Group Commit Configuration
+class GroupCommitConfig:
+    """Write batching for bet inserts under concurrent load"""
+    # Coalesce bet inserts from concurrent requests into shared commits
+    ENABLED = os.getenv('GROUP_COMMIT_ENABLED', 'False').lower() == 'true'
+    
+    # Most requests committed together
+    MAX_BATCH_SIZE = int(os.getenv('GROUP_COMMIT_MAX_BATCH_SIZE', 64))
+    
+    # Longest the writer waits for more requests after the first (milliseconds)
+    MAX_WAIT_MS = float(os.getenv('GROUP_COMMIT_MAX_WAIT_MS', 5))
+
+
+# Idempotency Configuration
+class IdempotencyConfig:
+    """Idempotency-Key handling for write endpoints"""
+    # How long a completed response is replayed for its key
+    TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+    
+    # How long an unfinished request holds its key before a retry may run again
+    IN_PROGRESS_SECONDS = int(os.getenv('IDEMPOTENCY_IN_PROGRESS_SECONDS', 60))
+    
+    # Completed responses kept in the per-process memory front
+    MEMORY_ENTRIES = int(os.getenv('IDEMPOTENCY_MEMORY_ENTRIES', 10000))
+    
+    # Seconds between sweeps of expired keys from the database
+    PURGE_INTERVAL_SECONDS = 3600
+    
+    MAX_KEY_LENGTH = 255
+
+
+# Leaderboard Configuration
+class LeaderboardConfig:
+    """Ranked user boards served from memory"""
+    # Board windows in UTC days, today included; None is all time
+    WINDOWS = {'1d': 1, '7d': 7, '30d': 30, 'all': None}
+    DEFAULT_WINDOW = '7d'
+    
+    # Seconds a worker serves its boards before loading changed daily totals
+    REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', 5))
+    
+    # Totals updated this long before the last load are reloaded too, covering
+    # transactions that committed late and replica lag
+    REFRESH_OVERLAP_SECONDS = 60
+    
+    # Settled bets a user needs in the window to be ranked by win rate
+    MIN_SETTLED_BETS_FOR_WIN_RATE = int(os.getenv('LEADERBOARD_MIN_SETTLED_BETS', 5))
 
 
 # Feature Flags
@@ -221,6 +513,8 @@ class FeatureFlags:
     ENABLE_WITHDRAWALS = os.getenv('ENABLE_WITHDRAWALS', 'True').lower() == 'true'
     ENABLE_FRAMES = os.getenv('ENABLE_FRAMES', 'True').lower() == 'true'
     ENABLE_AUTO_SETTLEMENT = os.getenv('ENABLE_AUTO_SETTLEMENT', 'True').lower() == 'true'
+    ENABLE_PAYMENT_PIPELINE = os.getenv('ENABLE_PAYMENT_PIPELINE', 'True').lower() == 'true'
+    ENABLE_WITHDRAWAL_PROCESSOR = os.getenv('ENABLE_WITHDRAWAL_PROCESSOR', 'False').lower() == 'true'
     ENABLE_NOTIFICATIONS = os.getenv('ENABLE_NOTIFICATIONS', 'False').lower() == 'true'
     
     # Beta features
@@ -3,21 +3,223 @@ Database models and initialization for Farcaster Prediction Market
 """
 
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-import os
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, event, inspect, literal, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import logging
 
-db = SQLAlchemy()
+from config import ReplicaConfig, SQLiteConfig, get_config
+from replica import REPLICA_BIND, reads_from_replica
 
+logger = logging.getLogger(__name__)
 
-def init_db(app):
-    """Initialize database"""
-    db_path = os.path.join(os.path.dirname(__file__), 'prediction_market.db')
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+
+class RoutingSession(Session):
+    """Session that sends ORM reads to the replica when the request allows it
+    
+    Flushes, bulk UPDATE/DELETE statements and everything outside a request
+    (scheduler, payment pipeline) use the primary.
+    """
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, Select)
+                and reads_from_replica() and REPLICA_BIND in self._db.engines):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# PRAGMA synchronous reports a number
+SYNCHRONOUS_LEVELS = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+
+# Bets whose stake joined their market's pool
+POOLED_BET_STATUSES = ('active', 'won', 'lost')
+
+
+def init_db(app, config=None):
+    """Initialize database
+    
+    Uses the database URL and pool settings of the environment's configuration
+    (config.get_config()) unless the app already sets them, as tests do. Safe to
+    call more than once on the same app.
+    """
+    config = config or get_config()
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', config.SQLALCHEMY_DATABASE_URI)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI'], config))
+    if ReplicaConfig.DATABASE_URL:
+        app.config.setdefault('SQLALCHEMY_BINDS', {
+            REPLICA_BIND: {'url': ReplicaConfig.DATABASE_URL, **engine_options(ReplicaConfig.DATABASE_URL, config)}
+        })
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
-    db.init_app(app)
+    if 'sqlalchemy' not in app.extensions:
+        db.init_app(app)
+        with app.app_context():
+            if db.engine.dialect.name == 'sqlite' and SQLiteConfig.PROFILE == 'production':
+                event.listen(db.engine, 'connect', apply_sqlite_pragmas)
+                db.engine.dispose()  # Connections opened before the listener lack the pragmas
+    
     with app.app_context():
-        db.create_all()
+        created = set(db.metadata.tables) - set(inspect(db.engine).get_table_names())
+        db.create_all(bind_key=None)  # A replica gets its schema from the primary
+        upgrade_schema(created)
+        if db.engine.dialect.name == 'sqlite':
+            check_sqlite_pragmas()
+
+
+def upgrade_schema(created=()):
+    """Bring tables created by an older version up to the current models
+    
+    db.create_all only creates missing tables, so columns and indexes added
+    to existing tables since are created here. Columns added with a default
+    are NOT NULL only when the model says so; others stay nullable. Existing
+    NOT NULL columns the model now allows to be null are relaxed. Derived
+    columns that were just added, and derived tables in created (the names
+    db.create_all just created), are then backfilled. Returns the added
+    (table, column) pairs.
+    """
+    dialect = db.engine.dialect
+    # Inspect through the session so a rebuilt table's copied rows are not
+    # rolled back when an inspector connection is returned to the pool
+    inspector = inspect(db.session.connection())
+    added = set()
+    for table in db.metadata.sorted_tables:
+        existing = {column['name']: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"{column.name} {column.type.compile(dialect=dialect)}"
+            if column.default is not None and column.default.is_scalar:
+                default = literal(column.default.arg).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+                ddl += f" DEFAULT {default}" + ('' if column.nullable else ' NOT NULL')
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            added.add((table.name, column.name))
+            logger.warning(f"Added column {table.name}.{column.name}")
+        relaxed = [
+            column.name for column in table.columns
+            if column.name in existing and column.nullable and not column.primary_key
+            and not existing[column.name]['nullable']
+        ]
+        if relaxed:
+            drop_not_null(table, relaxed, [index['name'] for index in inspector.get_indexes(table.name)])
+        for index in table.indexes:
+            index.create(db.session.connection(), checkfirst=True)
+    
+    if any(column in MarketEvent.POOL_COUNTERS for table, column in added if table == MarketEvent.__tablename__):
+        backfill_market_counters()
+    db.session.commit()
+    
+    if UserBalance.__tablename__ in created:
+        # Deployments from before the ledger start with their winnings in it
+        from ledger import reconcile_balances
+        reconcile_balances(fix=True)
+    return added
+
+
+def drop_not_null(table, columns, index_names):
+    """Let existing columns hold NULL, as their model now allows
+    
+    SQLite cannot alter a column, so there the table is rebuilt from the model
+    and its rows copied over; index_names are the table's current indexes,
+    dropped so the rebuilt table can recreate them.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        old_name = f"_{table.name}_old"
+        names = ', '.join(column.name for column in table.columns)
+        for index_name in index_names:
+            db.session.execute(text(f"DROP INDEX {index_name}"))
+        db.session.execute(text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+        table.create(db.session.connection())
+        db.session.execute(text(f"INSERT INTO {table.name} ({names}) SELECT {names} FROM {old_name}"))
+        db.session.execute(text(f"DROP TABLE {old_name}"))
+    else:
+        for column in columns:
+            db.session.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column} DROP NOT NULL"))
+    logger.warning(f"Made {table.name}.{', '.join(columns)} nullable")
+
+
+def backfill_market_counters():
+    """Recompute every market's pool counters from its pooled bets"""
+    totals = db.session.query(
+        Bet.market_id,
+        db.func.count(Bet.id),
+        db.func.sum(Bet.amount),
+        db.func.sum(db.case((Bet.prediction == 'over', Bet.amount), else_=0)),
+        db.func.sum(db.case((Bet.prediction == 'under', Bet.amount), else_=0)),
+        db.func.sum(db.case((Bet.prediction == 'over', 1), else_=0)),
+        db.func.sum(db.case((Bet.prediction == 'under', 1), else_=0))
+    ).filter(Bet.status.in_(POOLED_BET_STATUSES)).group_by(Bet.market_id).all()
+    
+    columns = ('bets_count', 'total_pool', 'over_pool', 'under_pool', 'over_bets', 'under_bets')
+    db.session.execute(update(MarketEvent).values(dict.fromkeys(columns, 0)))
+    if totals:
+        db.session.execute(update(MarketEvent), [
+            {'id': market_id, **dict(zip(columns, values))} for market_id, *values in totals
+        ])
+    logger.warning(f"Backfilled pool counters for {len(totals)} markets")
+
+
+def engine_options(database_uri, config):
+    """SQLAlchemy engine options for a database URL"""
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}  # In-memory SQLite shares one static connection; pool settings do not apply
+    
+    options = {
+        'pool_size': config.DB_POOL_SIZE,
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'pool_timeout': config.DB_POOL_TIMEOUT,
+        'pool_recycle': config.DB_POOL_RECYCLE,
+        'pool_pre_ping': config.DB_POOL_PRE_PING
+    }
+    if url.get_backend_name() == 'postgresql' and config.DB_STATEMENT_TIMEOUT_MS:
+        options['connect_args'] = {'options': f"-c statement_timeout={config.DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the production SQLite profile to a new pooled connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLiteConfig.JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLiteConfig.BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={SQLiteConfig.SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLiteConfig.CACHE_SIZE_KB}")  # Negative means KiB
+    cursor.execute(f"PRAGMA mmap_size={SQLiteConfig.MMAP_SIZE}")
+    cursor.execute(f"PRAGMA temp_store={SQLiteConfig.TEMP_STORE}")
+    cursor.close()
+
+
+def check_sqlite_pragmas():
+    """Log the pragmas in effect on a pooled connection and warn about any
+    that differ from the configured profile; returns them"""
+    with db.engine.connect() as connection:
+        pragma = lambda name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        effective = {
+            'journal_mode': pragma('journal_mode').upper(),
+            'busy_timeout': pragma('busy_timeout'),
+            'synchronous': SYNCHRONOUS_LEVELS.get(pragma('synchronous')),
+            'cache_size': pragma('cache_size'),
+            'mmap_size': pragma('mmap_size')
+        }
+    
+    logger.info(f"SQLite profile '{SQLiteConfig.PROFILE}' pragmas: {effective}")
+    if SQLiteConfig.PROFILE == 'production':
+        expected = {
+            'journal_mode': SQLiteConfig.JOURNAL_MODE,
+            'busy_timeout': SQLiteConfig.BUSY_TIMEOUT_MS,
+            'synchronous': SQLiteConfig.SYNCHRONOUS,
+            'cache_size': -SQLiteConfig.CACHE_SIZE_KB,
+            'mmap_size': SQLiteConfig.MMAP_SIZE
+        }
+        for name, value in expected.items():
+            if effective[name] != value:
+                # e.g. in-memory databases cannot use WAL, builds may cap mmap_size
+                logger.warning(f"SQLite pragma {name} is {effective[name]}, expected {value}")
+    return effective
 
 
 class UserProfile(db.Model):
@@ -57,22 +259,62 @@ class UserProfile(db.Model):
 class MarketEvent(db.Model):
     """Prediction market event"""
     __tablename__ = 'market_events'
+    __table_args__ = (
+        # Keyset pagination indexes for GET /api/markets: (end_time, id) ordering
+        # within a status, optionally narrowed by market type or target user
+        db.Index('ix_market_events_status_end_time_id', 'status', 'end_time', 'id'),
+        db.Index('ix_market_events_status_type_end_time_id', 'status', 'market_type', 'end_time', 'id'),
+        db.Index('ix_market_events_status_fid_end_time_id', 'status', 'user_fid', 'end_time', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_fid = db.Column(db.Integer, db.ForeignKey('user_profiles.fid'), nullable=False, index=True)
     market_type = db.Column(db.String(50), nullable=False)  # 'casts_count', 'likes_total', 'engagement_score'
     threshold = db.Column(db.Float, nullable=False)
     direction = db.Column(db.String(10), default='over')  # 'over' or 'under'
-    status = db.Column(db.String(20), default='active', index=True)  # 'active', 'settled', 'cancelled'
+    # 'active', 'closed', then settlement steps 'settling', 'payouts_computed',
+    # 'fees_swept' and finally 'settled'; or 'cancelled'
+    status = db.Column(db.String(20), default='active', index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     end_time = db.Column(db.DateTime, nullable=False, index=True)
     settled_at = db.Column(db.DateTime, nullable=True)
     result_value = db.Column(db.Float, nullable=True)
+    win_fee_total = db.Column(db.Float, nullable=True)  # Checkpointed once payouts are computed
     total_pool = db.Column(db.Float, default=0)
+    # Denormalized counters, maintained by record_bet as bets join the pool
+    bets_count = db.Column(db.Integer, default=0, nullable=False)
+    over_pool = db.Column(db.Float, default=0, nullable=False)
+    under_pool = db.Column(db.Float, default=0, nullable=False)
+    over_bets = db.Column(db.Integer, default=0, nullable=False)
+    under_bets = db.Column(db.Integer, default=0, nullable=False)
     description = db.Column(db.Text, nullable=True)
     
     bets = db.relationship('Bet', backref='market', lazy=True, cascade='all, delete-orphan')
     
+    # Counters recomputed from bets when a schema upgrade adds them
+    POOL_COUNTERS = ('bets_count', 'over_pool', 'under_pool', 'over_bets', 'under_bets')
+    
+    def record_bet(self, prediction, amount):
+        """Increment pool counters for a confirmed bet as a single atomic UPDATE
+        
+        Returns False when the market has already started settling, so the bet
+        can no longer join its pool.
+        """
+        if prediction not in ('over', 'under'):
+            raise ValueError(f'Invalid prediction: {prediction!r}')
+        side_pool = getattr(MarketEvent, f'{prediction}_pool')
+        side_bets = getattr(MarketEvent, f'{prediction}_bets')
+        recorded = MarketEvent.query.filter(
+            MarketEvent.id == self.id,
+            MarketEvent.status.in_(('active', 'closed'))
+        ).update({
+            MarketEvent.bets_count: MarketEvent.bets_count + 1,
+            MarketEvent.total_pool: MarketEvent.total_pool + amount,
+            side_pool: side_pool + amount,
+            side_bets: side_bets + 1
+        }, synchronize_session=False)
+        return recorded == 1
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -86,7 +328,11 @@ class MarketEvent(db.Model):
             'settled_at': self.settled_at.isoformat() if self.settled_at else None,
             'result_value': self.result_value,
             'total_pool': self.total_pool,
-            'bets_count': len(self.bets),
+            'over_pool': self.over_pool,
+            'under_pool': self.under_pool,
+            'bets_count': self.bets_count,
+            'over_bets': self.over_bets,
+            'under_bets': self.under_bets,
             'description': self.description
         }
 
@@ -94,6 +340,10 @@ class MarketEvent(db.Model):
 class Bet(db.Model):
     """Individual bet placed on a market"""
     __tablename__ = 'bets'
+    __table_args__ = (
+        # Settlement aggregates and bulk updates select a market's bets by status
+        db.Index('ix_bets_market_id_status', 'market_id', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     market_id = db.Column(db.Integer, db.ForeignKey('market_events.id'), nullable=False, index=True)
@@ -104,8 +354,12 @@ class Bet(db.Model):
     base_fee = db.Column(db.Float, default=0.2)  # Base fee charged at bet time
     payout = db.Column(db.Float, nullable=True)  # Payout if won
     fee_on_win = db.Column(db.Float, nullable=True)  # 1.5% fee on winnings
-    status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'active', 'won', 'lost', 'cancelled'
+    # 'pending' (accepted), 'confirming' (payment submitted), 'paid' (payment confirmed),
+    # 'active', 'failed', 'won', 'lost', 'cancelled'
+    status = db.Column(db.String(20), default='pending', index=True)
     transaction_hash = db.Column(db.String(255), nullable=True)
+    failure_reason = db.Column(db.String(255), nullable=True)
+    batch_id = db.Column(db.String(32), nullable=True, index=True)  # Set for bets placed via /api/bets/batch
     placed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     settled_at = db.Column(db.DateTime, nullable=True)
     
@@ -122,6 +376,8 @@ class Bet(db.Model):
             'fee_on_win': self.fee_on_win,
             'status': self.status,
             'transaction_hash': self.transaction_hash,
+            'failure_reason': self.failure_reason,
+            'batch_id': self.batch_id,
             'placed_at': self.placed_at.isoformat(),
             'settled_at': self.settled_at.isoformat() if self.settled_at else None
         }
@@ -138,7 +394,10 @@ class Withdrawal(db.Model):
     status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'processing', 'completed', 'failed'
     transaction_hash = db.Column(db.String(255), nullable=True)
     error_message = db.Column(db.Text, nullable=True)
+    # Set when claimed for processing; withdrawals paid by one transfer share it
+    transfer_key = db.Column(db.String(255), nullable=True, index=True)
     requested_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
     processed_at = db.Column(db.DateTime, nullable=True)
     
     def to_dict(self):
@@ -155,19 +414,159 @@ class Withdrawal(db.Model):
         }
 
 
+def upsert(model):
+    """INSERT for model supporting ON CONFLICT clauses on the primary's dialect"""
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+
+class UserBalance(db.Model):
+    """Running balance ledger for a user's winnings
+    
+    Updated in the same transaction as the settlement or withdrawal that moves
+    the money, so the available balance is one primary key lookup instead of
+    sums over bets and withdrawals. ledger.reconcile_balances rebuilds it from
+    that history.
+    """
+    __tablename__ = 'user_balances'
+    
+    user_fid = db.Column(db.Integer, db.ForeignKey('user_profiles.fid'), primary_key=True)
+    credited = db.Column(db.Float, nullable=False, default=0)  # Payouts from won bets
+    debited = db.Column(db.Float, nullable=False, default=0)  # Completed withdrawals
+    held = db.Column(db.Float, nullable=False, default=0)  # Pending and processing withdrawals
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @property
+    def available(self):
+        return self.credited - self.debited - self.held
+    
+    @classmethod
+    def available_for(cls, fid):
+        """Available balance of a user; 0 if they have no ledger row yet"""
+        balance = db.session.get(cls, fid)
+        return balance.available if balance else 0.0
+    
+    @classmethod
+    def open_accounts(cls, fids):
+        """Create missing ledger rows for a list of fids or a SELECT of fids
+        
+        Uses INSERT ... ON CONFLICT DO NOTHING, so concurrent writers creating
+        the same row do not fail. The caller commits.
+        """
+        if isinstance(fids, Select):
+            insert = upsert(cls).from_select(['user_fid'], fids)
+        else:
+            insert = upsert(cls).values([{'user_fid': fid} for fid in set(fids)])
+        db.session.execute(insert.on_conflict_do_nothing(index_elements=['user_fid']))
+    
+    @classmethod
+    def credit(cls, amounts):
+        """Add to users' credited balances from a SELECT of (user_fid, amount, updated_at)
+        
+        One INSERT ... ON CONFLICT DO UPDATE, which also opens missing ledger
+        rows. amounts must have at most one row per user. The caller commits.
+        """
+        insert = upsert(cls).from_select(['user_fid', 'credited', 'updated_at'], amounts)
+        db.session.execute(insert.on_conflict_do_update(
+            index_elements=['user_fid'],
+            set_={'credited': cls.credited + insert.excluded.credited, 'updated_at': insert.excluded.updated_at}
+        ))
+    
+    @classmethod
+    def adjust(cls, fid, credited=0, debited=0, held=0):
+        """Add to a user's ledger columns with an atomic UPDATE; the caller commits"""
+        cls.open_accounts([fid])
+        cls.query.filter_by(user_fid=fid).update({
+            cls.credited: cls.credited + credited,
+            cls.debited: cls.debited + debited,
+            cls.held: cls.held + held,
+            cls.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+    
+    @classmethod
+    def hold(cls, fid, amount):
+        """Reserve amount of a user's available balance; returns False if it is not there
+        
+        The balance check is part of the UPDATE, so it is evaluated against the
+        row as locked for the write: concurrent holds for one user serialize on
+        that row and can never overdraw it, while holds for different users
+        touch different rows and proceed in parallel. The caller commits.
+        """
+        held = cls.query.filter(
+            cls.user_fid == fid,
+            cls.credited - cls.debited - cls.held >= amount
+        ).update({
+            cls.held: cls.held + amount,
+            cls.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        return held == 1
+    
+    def to_dict(self):
+        return {
+            'user_fid': self.user_fid,
+            'credited': self.credited,
+            'debited': self.debited,
+            'held': self.held,
+            'available': self.available,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class LeaderboardBucket(db.Model):
+    """A user's betting totals for one UTC day, the persisted leaderboard state
+    
+    Written in the same transactions that activate and settle bets; workers
+    load these rows into their in-memory boards, never the bets table.
+    """
+    __tablename__ = 'leaderboard_buckets'
+    
+    COUNTERS = ('wagered', 'bets_count', 'settled_count', 'won_count', 'winnings')
+    
+    user_fid = db.Column(db.Integer, db.ForeignKey('user_profiles.fid'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    wagered = db.Column(db.Float, nullable=False, default=0)  # Amount of bets activated
+    bets_count = db.Column(db.Integer, nullable=False, default=0)
+    settled_count = db.Column(db.Integer, nullable=False, default=0)  # Bets won or lost
+    won_count = db.Column(db.Integer, nullable=False, default=0)
+    winnings = db.Column(db.Float, nullable=False, default=0)  # Payouts after win fees
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    @classmethod
+    def add(cls, rows):
+        """Add to users' daily totals; the caller commits
+        
+        rows is a list of dicts or a SELECT of user_fid, day, the COUNTERS and
+        updated_at, with at most one row per (user_fid, day).
+        """
+        columns = ['user_fid', 'day', *cls.COUNTERS, 'updated_at']
+        if isinstance(rows, Select):
+            insert = upsert(cls).from_select(columns, rows)
+        else:
+            insert = upsert(cls).values([{'updated_at': datetime.utcnow(), **row} for row in rows])
+        db.session.execute(insert.on_conflict_do_update(
+            index_elements=['user_fid', 'day'],
+            set_={
+                **{column: getattr(cls, column) + insert.excluded[column] for column in cls.COUNTERS},
+                'updated_at': insert.excluded.updated_at
+            }
+        ))
+
+
 class Transaction(db.Model):
     """Transaction history for auditing"""
     __tablename__ = 'transactions'
     
     id = db.Column(db.Integer, primary_key=True)
-    tx_hash = db.Column(db.String(255), unique=True, nullable=False, index=True)
+    tx_hash = db.Column(db.String(255), unique=True, nullable=True, index=True)  # Null until submitted
+    idempotency_key = db.Column(db.String(255), unique=True, nullable=True, index=True)
     from_address = db.Column(db.String(255), nullable=False)
     to_address = db.Column(db.String(255), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     tx_type = db.Column(db.String(50), nullable=False)  # 'bet_payment', 'base_fee', 'win_fee', 'payout', 'withdrawal'
     related_id = db.Column(db.Integer, nullable=True)  # bet_id, withdrawal_id, etc.
-    status = db.Column(db.String(20), default='pending')  # 'pending', 'confirmed', 'failed'
+    status = db.Column(db.String(20), default='pending')  # 'pending', 'sending', 'confirmed', 'failed'
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)  # When a sender took the intent
     confirmed_at = db.Column(db.DateTime, nullable=True)
     error_message = db.Column(db.Text, nullable=True)
     
@@ -175,6 +574,7 @@ class Transaction(db.Model):
         return {
             'id': self.id,
             'tx_hash': self.tx_hash,
+            'idempotency_key': self.idempotency_key,
             'from_address': self.from_address,
             'to_address': self.to_address,
             'amount': self.amount,
@@ -182,4 +582,73 @@ class Transaction(db.Model):
             'status': self.status,
             'created_at': self.created_at.isoformat(),
             'confirmed_at': self.confirmed_at.isoformat() if self.confirmed_at else None
-        }
\ No newline at end of file
+        }
+
+
+class IdempotencyRecord(db.Model):
+    """Response recorded for an Idempotency-Key on a write endpoint"""
+    __tablename__ = 'idempotency_records'
+    
+    key = db.Column(db.String(300), primary_key=True)  # '<scope>:<Idempotency-Key header>'
+    request_hash = db.Column(db.String(64), nullable=False)  # sha256 of the request body
+    status_code = db.Column(db.Integer, nullable=True)  # None while the request is in progress
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class SchedulerLease(db.Model):
+    """Lease held by the one process allowed to run a background job"""
+    __tablename__ = 'scheduler_leases'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(255), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    @classmethod
+    def acquire(cls, name, owner, now, seconds):
+        """Take or renew a lease; returns True when owner holds it afterwards"""
+        expires_at = now + timedelta(seconds=seconds)
+        try:
+            renewed = cls.query.filter(
+                cls.name == name,
+                db.or_(cls.owner == owner, cls.expires_at < now)
+            ).update({'owner': owner, 'expires_at': expires_at}, synchronize_session=False)
+            
+            if not renewed:
+                if db.session.get(cls, name) is not None:
+                    db.session.rollback()
+                    return False
+                db.session.add(cls(name=name, owner=owner, expires_at=expires_at))
+            
+            db.session.commit()
+            return True
+        except IntegrityError:
+            # Another worker created the lease first
+            db.session.rollback()
+            return False
+
+
+class CacheInvalidation(db.Model):
+    """Response cache tag invalidated by a write, polled by every worker
+    
+    Each process caches responses in memory, so a write appends its tags here
+    and the other processes drop the same entries on their next poll. Rows are
+    pruned once they are older than any cache TTL.
+    """
+    __tablename__ = 'cache_invalidations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tag = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class MarketStreamEvent(db.Model):
+    """Market event published for stream subscribers, polled by every worker"""
+    __tablename__ = 'market_stream_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    market_id = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.Text, nullable=False)  # JSON payload
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -0,0 +1,165 @@
+"""
+Publish/subscribe for market updates across worker processes
+Fans out pool, odds and status changes to Server-Sent Events subscribers
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from config import StreamConfig
+from database import db, MarketStreamEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A single stream consumer with a bounded event queue"""
+
+    def __init__(self, market_ids=None, max_queue_size=StreamConfig.SUBSCRIBER_QUEUE_SIZE):
+        self.market_ids = set(market_ids) if market_ids else None
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = False
+
+    def wants(self, market_id):
+        """Check whether this subscriber follows the given market"""
+        return self.market_ids is None or market_id in self.market_ids
+
+    def get(self, timeout):
+        """Wait for the next event, returning None on timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class MarketEventBus:
+    """Fan-out of market events to subscribers in every worker process
+
+    Events are appended to the market_stream_events table. Each process with
+    open streams polls it, at most every POLL_SECONDS, and delivers new rows
+    to its own subscribers, so an event published by any worker, the
+    scheduler or the payment pipeline reaches every stream.
+
+    Delivery never blocks: a subscriber whose queue is full is marked dropped
+    and removed, so one slow consumer cannot stall the others. Each process
+    serves at most max_subscribers streams so they cannot take every request
+    thread.
+    """
+
+    def __init__(self, max_subscribers=StreamConfig.MAX_STREAMS_PER_WORKER):
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._delivered = {}  # Event id -> created_at, delivered here
+        self._polled_at = 0.0  # Monotonic time of the last poll
+        self._poll_from = None  # Wall-clock lower bound of the next poll
+
+    def subscribe(self, market_ids=None):
+        """Register a new subscriber, optionally filtered to market ids
+
+        Returns None when this process already serves max_subscribers streams.
+        """
+        subscription = Subscription(market_ids)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            if not self._subscribers:
+                # Nobody was following; deliver only events published from now on
+                self._poll_from = datetime.utcnow()
+                self._delivered.clear()
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscriber"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event_type, market_id, data):
+        """Append an event to the shared log; commits the session, so call it after the write"""
+        now = datetime.utcnow()
+        db.session.add(MarketStreamEvent(
+            event_type=event_type,
+            market_id=market_id,
+            data=json.dumps(data),
+            created_at=now
+        ))
+        MarketStreamEvent.query.filter(
+            MarketStreamEvent.created_at < now - timedelta(seconds=StreamConfig.EVENT_RETENTION_SECONDS)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    def poll(self):
+        """Deliver events logged by any process since the last poll
+
+        Reads back POLL_OVERLAP_SECONDS before the previous poll, since events
+        from concurrent transactions can commit out of order; ids already
+        delivered are skipped. Needs an app context.
+        """
+        with self._lock:
+            polled = time.monotonic()
+            if not self._subscribers or polled - self._polled_at < StreamConfig.POLL_SECONDS:
+                return
+            self._polled_at = polled
+            since = self._poll_from
+
+        now = datetime.utcnow()
+        rows = db.session.execute(
+            select(MarketStreamEvent)
+            .where(MarketStreamEvent.created_at >= since)
+            .order_by(MarketStreamEvent.id),
+            bind_arguments={'bind': db.engine}
+        ).scalars().all()
+        events = []
+        with self._lock:
+            for row in rows:
+                if row.id not in self._delivered:
+                    self._delivered[row.id] = row.created_at
+                    events.append({
+                        'id': row.id,
+                        'type': row.event_type,
+                        'market_id': row.market_id,
+                        'data': json.loads(row.data)
+                    })
+            self._poll_from = max(self._poll_from, now - timedelta(seconds=StreamConfig.POLL_OVERLAP_SECONDS))
+            for event_id, created_at in list(self._delivered.items()):
+                if created_at < self._poll_from:
+                    del self._delivered[event_id]
+        # End the read so an idle stream does not hold a pooled connection
+        db.session.rollback()
+
+        for event in events:
+            self.deliver(event)
+
+    def deliver(self, event):
+        """Hand an event to every subscriber in this process following its market"""
+        with self._lock:
+            subscribers = [s for s in self._subscribers if s.wants(event['market_id'])]
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                logger.warning("Dropping slow market stream subscriber")
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+
+def format_sse(event):
+    """Serialize an event in text/event-stream format"""
+    payload = json.dumps(dict(event['data'], market_id=event['market_id']))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+# Bus for this process's streams
+market_event_bus = MarketEventBus()
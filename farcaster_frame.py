@@ -8,12 +8,15 @@ from datetime import datetime, timedelta
 import json
 import os
 
+from replica import use_replica
+
 frame_bp = Blueprint('frame', __name__, url_prefix='/frame')
 
 
 # ==================== FRAME ROUTES ====================
 
 @frame_bp.route('/markets', methods=['POST'])
+@use_replica
 def markets_frame():
     """Display active prediction markets"""
     try:
@@ -39,7 +42,7 @@ def markets_frame():
             market_text += f"{i}. **{market.market_type.replace('_', ' ').title()}**\n"
             market_text += f"   Target: {market.threshold} ({market.direction.upper()})\n"
             market_text += f"   Pool: ${market.total_pool:.2f}\n"
-            market_text += f"   Bets: {len(market.bets)}\n\n"
+            market_text += f"   Bets: {market.bets_count}\n\n"
         
         return create_frame({
             'title': 'Prediction Markets',
@@ -102,6 +105,8 @@ def create_market_frame():
         # Create market
         from project import db
         from database import MarketEvent, UserProfile
+        from utils import ResponseCache
+        from events import market_event_bus
         
         # Get target user's FID
         target_user = UserProfile.query.filter_by(username=username).first()
@@ -119,6 +124,8 @@ def create_market_frame():
         
         db.session.add(market)
         db.session.commit()
+        ResponseCache.invalidate('markets')
+        market_event_bus.publish('market_created', market.id, market.to_dict())
         
         return create_frame({
             'title': 'Market Created!',
@@ -199,14 +206,14 @@ def place_bet_frame():
         
         return create_frame({
             'title': 'Bet Placed Successfully!',
-            'content': f'Bet confirmed:\n\n' +
+            'content': f'Bet accepted, confirming payment:\n\n' +
                       f'**Market ID:** {market_id}\n' +
                       f'**Prediction:** {prediction.upper()}\n' +
                       f'**Amount:** ${amount:.2f}\n' +
                       f'**Base Fee:** $0.20\n' +
                       f'**Total Cost:** ${amount + 0.20:.2f}\n\n' +
                       f'Bet ID: {bet_data.get("bet_id")}\n' +
-                      f'TX: {bet_data.get("transaction", "...")[:16]}...',
+                      f'Status: {bet_data.get("status")}',
             'image': 'https://via.placeholder.com/1200x630?text=Bet+Placed',
             'buttons': [
                 {'label': 'View My Bets', 'action': 'post', 'target': '/frame/my-bets'},
@@ -250,7 +257,7 @@ def my_bets_frame():
         # Build bets list
         bets_text = "**Your Bets**\n\n"
         for i, bet in enumerate(bets[:5], 1):
-            status_emoji = {'active': '🟡', 'won': '✅', 'lost': '❌', 'pending': '⏳'}
+            status_emoji = {'active': '🟡', 'won': '✅', 'lost': '❌', 'pending': '⏳', 'confirming': '⏳', 'failed': '⚠️'}
             status = status_emoji.get(bet['status'], '❓')
             
             bets_text += f"{i}. {status} Market #{bet['market_id']}\n"
@@ -350,6 +357,7 @@ def withdraw_frame():
 
 
 @frame_bp.route('/profile', methods=['POST'])
+@use_replica
 def profile_frame():
     """Display user profile and statistics"""
     try:
@@ -359,15 +367,14 @@ def profile_frame():
         if not user_fid:
             return create_error_frame('User not authenticated')
         
-        import requests
-        
-        response = requests.get(f'http://localhost:5000/api/users/{user_fid}')
+        # Same cached snapshot as GET /api/users/<fid>, without the HTTP hop
+        from project import load_user_profile
         
-        if response.status_code != 200:
+        user_data = load_user_profile(int(user_fid))
+        if not user_data:
             return create_error_frame('Failed to fetch profile')
         
-        user_data = response.json().get('user', {})
-        stats = user_data.get('stats', {})
+        stats = user_data['stats']
         
         profile_text = f"**@{user_data.get('username', 'Unknown')}**\n\n"
         profile_text += f"📊 **Statistics**\n"
@@ -0,0 +1,131 @@
+"""
+Outbound HTTP client for Farcaster Prediction Market
+One pooled, retrying session shared by every hub and Neynar call
+"""
+
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import HTTPClientConfig
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), None if absent or invalid"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class HTTPClient:
+    """Keep-alive HTTP client with retries, safe to share between threads
+
+    Requests go through one requests.Session whose adapters keep a pool of
+    open connections per host: POOL_MAXSIZE by default, or the size given for
+    that host in HOST_POOL_SIZES. urllib3's pools are thread-safe, the session
+    is never reconfigured after construction and it keeps no cookies, so
+    request threads and settlement workers share it freely.
+
+    Connection errors, timeouts and RETRY_STATUSES responses are retried up
+    to MAX_RETRIES times for idempotent methods. The wait before retry n is
+    drawn uniformly from [0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**n)],
+    unless the response sent Retry-After, which is honored as given. A
+    Retry-After beyond MAX_RETRY_AFTER_SECONDS is not waited out; that
+    response is returned instead. A call never takes much more than
+    TOTAL_TIMEOUT_SECONDS, so retries cannot outlast a gunicorn worker's
+    timeout while a caller holds a lock.
+    """
+
+    def __init__(self, config=HTTPClientConfig, sleep=time.sleep, clock=time.monotonic):
+        self.config = config
+        self.sleep = sleep
+        self.clock = clock
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        default = HTTPAdapter(pool_connections=config.POOL_CONNECTIONS, pool_maxsize=config.POOL_MAXSIZE)
+        self.session.mount('https://', default)
+        self.session.mount('http://', default)
+        for host, size in config.HOST_POOL_SIZES.items():
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+            self.session.mount(f'https://{host}/', adapter)
+            self.session.mount(f'http://{host}/', adapter)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, timeout=None, retries=None, budget=None, **kwargs):
+        """Send a request, retrying transient failures; returns the last response
+
+        timeout is a (connect, read) pair in seconds, defaulting to
+        CONNECT_TIMEOUT_SECONDS and READ_TIMEOUT_SECONDS. retries defaults to
+        MAX_RETRIES for idempotent methods and 0 otherwise. budget bounds the
+        whole call, waits included, defaulting to TOTAL_TIMEOUT_SECONDS: each
+        attempt's timeouts are cut to the time left, and a retry whose wait
+        would run past the budget is not made. Raises the last connection
+        error or timeout once retries or the budget run out.
+        """
+        if timeout is None:
+            timeout = (self.config.CONNECT_TIMEOUT_SECONDS, self.config.READ_TIMEOUT_SECONDS)
+        elif not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        if retries is None:
+            retries = self.config.MAX_RETRIES if method.upper() in IDEMPOTENT_METHODS else 0
+        deadline = self.clock() + (self.config.TOTAL_TIMEOUT_SECONDS if budget is None else budget)
+
+        attempt = 0
+        while True:
+            remaining = max(deadline - self.clock(), 0.001)
+            error = response = retry_after = None
+            try:
+                response = self.session.request(
+                    method, url, timeout=tuple(min(limit, remaining) for limit in timeout), **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code not in self.config.RETRY_STATUSES:
+                    return response
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+            if retry_after is None:
+                ceiling = min(self.config.BACKOFF_MAX_SECONDS, self.config.BACKOFF_BASE_SECONDS * 2 ** attempt)
+                delay = random.uniform(0, ceiling)
+            else:
+                delay = retry_after
+            out_of_time = self.clock() + delay >= deadline
+            if attempt >= retries or out_of_time or delay > self.config.MAX_RETRY_AFTER_SECONDS:
+                if error is not None:
+                    raise error
+                return response
+
+            reason = str(error) if error is not None else f"HTTP {response.status_code}"
+            if response is not None:
+                response.close()
+            attempt += 1
+            logger.warning(f"{method} {url} failed ({reason}); retry {attempt}/{retries} in {delay:.2f}s")
+            self.sleep(delay)
+
+
+# Shared client for this process
+http_client = HTTPClient()
@@ -0,0 +1,178 @@
+"""
+Idempotency keys for Farcaster Prediction Market write endpoints
+Replays the recorded response when a client retries with the same Idempotency-Key
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import jsonify, make_response, request
+from sqlalchemy.exc import IntegrityError
+
+from config import IdempotencyConfig
+from database import db, IdempotencyRecord
+
+StoredResponse = namedtuple('StoredResponse', ['request_hash', 'status_code', 'body', 'expires_at'])
+
+
+class IdempotencyStore:
+    """Recently seen idempotency keys
+
+    Completed responses live in a bounded in-memory LRU in front of the
+    idempotency_records table, so a retry hitting the same worker is answered
+    from a dict lookup and one hitting another worker costs one primary key
+    read. A key is claimed with an INSERT before the request runs; the primary
+    key makes concurrent first attempts race on the database, not in memory.
+    """
+
+    def __init__(self, config=IdempotencyConfig):
+        self.config = config
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = datetime.min
+
+    def get(self, key, now):
+        """Return the stored response for a live key, or None"""
+        with self._lock:
+            stored = self._recent.get(key)
+            if stored is not None:
+                if stored.expires_at > now:
+                    self._recent.move_to_end(key)
+                    return stored
+                del self._recent[key]
+
+        record = db.session.get(IdempotencyRecord, key)
+        if record is None or record.expires_at <= now:
+            return None
+
+        stored = StoredResponse(record.request_hash, record.status_code, record.response_body, record.expires_at)
+        if stored.status_code is not None:
+            self._remember(key, stored)
+        return stored
+
+    def claim(self, key, request_hash, now):
+        """Reserve a key for a first attempt; returns False if it is taken"""
+        self.purge_expired(now)
+
+        # An expired key, finished or abandoned mid-request, may be reused
+        IdempotencyRecord.query.filter(
+            IdempotencyRecord.key == key,
+            IdempotencyRecord.expires_at <= now
+        ).delete(synchronize_session=False)
+        db.session.add(IdempotencyRecord(
+            key=key,
+            request_hash=request_hash,
+            created_at=now,
+            expires_at=now + timedelta(seconds=self.config.IN_PROGRESS_SECONDS)
+        ))
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    def complete(self, key, request_hash, status_code, body, now):
+        """Record the response of a claimed key"""
+        expires_at = now + timedelta(seconds=self.config.TTL_SECONDS)
+        IdempotencyRecord.query.filter_by(key=key).update({
+            'status_code': status_code,
+            'response_body': body,
+            'expires_at': expires_at
+        }, synchronize_session=False)
+        db.session.commit()
+        self._remember(key, StoredResponse(request_hash, status_code, body, expires_at))
+
+    def release(self, key):
+        """Drop a claimed key so the request can be retried"""
+        db.session.rollback()
+        IdempotencyRecord.query.filter_by(key=key).delete(synchronize_session=False)
+        db.session.commit()
+
+    def purge_expired(self, now):
+        """Delete expired keys from the database, at most once per interval"""
+        if now - self._last_purge < timedelta(seconds=self.config.PURGE_INTERVAL_SECONDS):
+            return
+        self._last_purge = now
+        IdempotencyRecord.query.filter(IdempotencyRecord.expires_at <= now).delete(synchronize_session=False)
+        db.session.commit()
+
+    def clear(self):
+        """Forget the in-memory front; the database records remain"""
+        with self._lock:
+            self._recent.clear()
+
+    def _remember(self, key, stored):
+        with self._lock:
+            self._recent[key] = stored
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.config.MEMORY_ENTRIES:
+                self._recent.popitem(last=False)
+
+
+# Shared store for this process
+idempotency_store = IdempotencyStore()
+
+
+def idempotent(scope):
+    """Decorator honoring an Idempotency-Key header on a write endpoint
+
+    The first request with a key runs the view and records its response;
+    retries with the same key and body get that response back without running
+    the view. Server errors are not recorded, so the client can retry them.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            header = request.headers.get('Idempotency-Key')
+            if header is None:
+                return f(*args, **kwargs)
+            if not header or len(header) > IdempotencyConfig.MAX_KEY_LENGTH:
+                return jsonify({'success': False, 'error': 'Invalid Idempotency-Key header'}), 400
+
+            key = f"{scope}:{header}"
+            request_hash = hashlib.sha256(request.get_data()).hexdigest()
+            now = datetime.utcnow()
+
+            stored = idempotency_store.get(key, now)
+            if stored is None and not idempotency_store.claim(key, request_hash, now):
+                # Another attempt claimed the key first
+                stored = idempotency_store.get(key, now) or StoredResponse(request_hash, None, None, now)
+
+            if stored is not None:
+                if stored.request_hash != request_hash:
+                    return jsonify({
+                        'success': False,
+                        'error': 'Idempotency-Key was already used with a different request'
+                    }), 422
+                if stored.status_code is None:
+                    return jsonify({
+                        'success': False,
+                        'error': 'A request with this Idempotency-Key is still in progress'
+                    }), 409
+
+                response = make_response(stored.body, stored.status_code)
+                response.mimetype = 'application/json'
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            try:
+                response = make_response(f(*args, **kwargs))
+            except Exception:
+                idempotency_store.release(key)
+                raise
+
+            if response.status_code >= 500:
+                idempotency_store.release(key)
+            else:
+                idempotency_store.complete(
+                    key, request_hash, response.status_code, response.get_data(as_text=True), datetime.utcnow()
+                )
+            return response
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,146 @@
+"""
+Leaderboards for Farcaster Prediction Market
+Ranks users by winnings, win rate and volume over time windows, from memory
+"""
+
+import logging
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from config import LeaderboardConfig
+from database import LeaderboardBucket
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('winnings', 'win_rate', 'volume')
+
+
+class RankedView:
+    """Users ordered by one score, highest first, ties by fid"""
+
+    def __init__(self):
+        self.scores = {}
+        self._order = []  # (-score, fid), ascending
+
+    def set(self, fid, score):
+        """Move a user to a new score; None removes them from the board"""
+        old = self.scores.pop(fid, None)
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, fid))]
+        if score is not None:
+            self.scores[fid] = score
+            insort(self._order, (-score, fid))
+
+    def page(self, offset, limit):
+        """Return [(rank, fid, score)] for one page of the board"""
+        return [
+            (offset + index + 1, fid, -negative_score)
+            for index, (negative_score, fid) in enumerate(self._order[offset:offset + limit])
+        ]
+
+    def __len__(self):
+        return len(self._order)
+
+
+class Leaderboard:
+    """Per-process ranked boards for every metric and window
+
+    The persisted state is leaderboard_buckets: one row of totals per user and
+    UTC day, incremented in the same transactions that activate and settle
+    bets. Each worker keeps those rows in memory with a RankedView per
+    (metric, window), and every REFRESH_SECONDS loads only the rows updated
+    since its last load, re-ranking just those users. A cold worker, or one
+    crossing midnight UTC as windows slide, loads all rows once.
+    """
+
+    def __init__(self, config=LeaderboardConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Forget all loaded totals; the next read loads every row"""
+        self._days = {}  # fid -> {day: {counter: value}}
+        self._totals = {window: {} for window in self.config.WINDOWS}
+        self._views = {(metric, window): RankedView() for metric in METRICS for window in self.config.WINDOWS}
+        self._loaded_at = None
+        self._today = None
+        self._stale = True
+
+    def mark_stale(self):
+        """Load changes on the next read, e.g. after this worker wrote totals"""
+        self._stale = True
+
+    def refresh(self, now=None):
+        """Load daily totals changed since the last load, if due"""
+        now = now or datetime.utcnow()
+        with self._lock:
+            due = self._loaded_at is None or now - self._loaded_at >= timedelta(seconds=self.config.REFRESH_SECONDS)
+            if not (self._stale or due):
+                return
+
+            query = LeaderboardBucket.query
+            if self._today == now.date():
+                since = self._loaded_at - timedelta(seconds=self.config.REFRESH_OVERLAP_SECONDS)
+                query = query.filter(LeaderboardBucket.updated_at >= since)
+            else:
+                self.clear()
+
+            changed = set()
+            for bucket in query.all():
+                self._days.setdefault(bucket.user_fid, {})[bucket.day] = {
+                    counter: getattr(bucket, counter) for counter in LeaderboardBucket.COUNTERS
+                }
+                changed.add(bucket.user_fid)
+
+            self._today = now.date()
+            self._loaded_at = now
+            self._stale = False
+            for fid in changed:
+                self._rank(fid)
+
+    def _rank(self, fid):
+        """Recompute a user's window totals and scores"""
+        for window, days in self.config.WINDOWS.items():
+            first_day = self._today - timedelta(days=days - 1) if days else None
+            totals = dict.fromkeys(LeaderboardBucket.COUNTERS, 0)
+            for day, counters in self._days.get(fid, {}).items():
+                if first_day is None or day >= first_day:
+                    for counter, value in counters.items():
+                        totals[counter] += value
+
+            settled = totals['settled_count']
+            totals['win_rate'] = totals['won_count'] / settled * 100 if settled else 0
+            self._totals[window][fid] = totals
+
+            eligible = settled >= self.config.MIN_SETTLED_BETS_FOR_WIN_RATE
+            self._views[('winnings', window)].set(fid, totals['winnings'] if totals['winnings'] > 0 else None)
+            self._views[('volume', window)].set(fid, totals['wagered'] if totals['bets_count'] else None)
+            self._views[('win_rate', window)].set(fid, totals['win_rate'] if eligible else None)
+
+    def page(self, metric, window, offset, limit):
+        """Return (entries, total) for one page of a board"""
+        self.refresh()
+        with self._lock:
+            view = self._views[(metric, window)]
+            totals = self._totals[window]
+            entries = [
+                {
+                    'rank': rank,
+                    'fid': fid,
+                    'score': score,
+                    'volume': totals[fid]['wagered'],
+                    'bets_count': totals[fid]['bets_count'],
+                    'settled_count': totals[fid]['settled_count'],
+                    'won_count': totals[fid]['won_count'],
+                    'winnings': totals[fid]['winnings'],
+                    'win_rate': totals[fid]['win_rate']
+                }
+                for rank, fid, score in view.page(offset, limit)
+            ]
+            return entries, len(view)
+
+
+# Shared boards for this process
+leaderboard = Leaderboard()
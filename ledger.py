@@ -0,0 +1,72 @@
+"""
+Balance ledger reconciliation for Farcaster Prediction Market
+Rebuilds and verifies user_balances from bet and withdrawal history
+"""
+
+import logging
+
+from database import db, Bet, UserBalance, Withdrawal
+
+logger = logging.getLogger(__name__)
+
+# Withdrawals whose amount is reserved but not yet paid out
+HELD_WITHDRAWAL_STATUSES = ('pending', 'processing')
+
+# Ledger differences below this are float rounding, not drift
+TOLERANCE = 1e-6
+
+
+def balances_from_history():
+    """Compute every user's ledger columns from bets and withdrawals
+
+    Returns {fid: {'credited': ..., 'debited': ..., 'held': ...}} for users
+    with any winnings or withdrawals.
+    """
+    expected = {}
+
+    def add(rows, column):
+        for fid, amount in rows:
+            expected.setdefault(fid, {'credited': 0.0, 'debited': 0.0, 'held': 0.0})[column] = float(amount or 0)
+
+    add(db.session.query(Bet.user_fid, db.func.sum(Bet.payout)).filter(
+        Bet.status == 'won'
+    ).group_by(Bet.user_fid), 'credited')
+    add(db.session.query(Withdrawal.user_fid, db.func.sum(Withdrawal.amount)).filter(
+        Withdrawal.status == 'completed'
+    ).group_by(Withdrawal.user_fid), 'debited')
+    add(db.session.query(Withdrawal.user_fid, db.func.sum(Withdrawal.amount)).filter(
+        Withdrawal.status.in_(HELD_WITHDRAWAL_STATUSES)
+    ).group_by(Withdrawal.user_fid), 'held')
+    return expected
+
+
+def reconcile_balances(fix=False):
+    """Compare the ledger with history; with fix=True, rewrite drifted rows
+
+    Returns a list of mismatches, each {'user_fid', 'column', 'ledger',
+    'expected'}. Run it while settlements and withdrawals are quiet: money
+    moving between the two reads shows up as drift.
+    """
+    expected = balances_from_history()
+    ledger = {balance.user_fid: balance for balance in UserBalance.query.all()}
+    zero = {'credited': 0.0, 'debited': 0.0, 'held': 0.0}
+
+    mismatches = []
+    for fid in sorted(expected.keys() | ledger.keys()):
+        balance = ledger.get(fid)
+        for column, amount in expected.get(fid, zero).items():
+            recorded = getattr(balance, column) if balance else 0.0
+            if abs(recorded - amount) > TOLERANCE:
+                mismatches.append({'user_fid': fid, 'column': column, 'ledger': recorded, 'expected': amount})
+
+    if fix and mismatches:
+        drifted = {mismatch['user_fid'] for mismatch in mismatches}
+        UserBalance.open_accounts(drifted)
+        for fid in drifted:
+            UserBalance.query.filter_by(user_fid=fid).update(
+                expected.get(fid, zero), synchronize_session=False
+            )
+        db.session.commit()
+        logger.warning(f"Rewrote ledger rows for {len(drifted)} users")
+
+    return mismatches
@@ -12,9 +12,11 @@ from flask_cors import CORS
 load_dotenv()
 
 # Import main application
-from project import app as main_app
+from project import app as main_app, payment_pipeline, withdrawal_processor
 from farcaster_frame import register_frame_routes
 from database import db, init_db
+from scheduler import SettlementScheduler
+from config import FeatureFlags
 
 
 def create_app():
@@ -41,6 +43,19 @@ def create_app():
     with main_app.app_context():
         init_db(main_app)
     
+    # Every worker runs a scheduler; a database lease lets only one act
+    if FeatureFlags.ENABLE_AUTO_SETTLEMENT:
+        SettlementScheduler(main_app).start()
+    
+    # Bets stay 'pending' until the payment pipeline confirms their payment;
+    # without it, bets are paid for and activated on the request thread
+    if FeatureFlags.ENABLE_PAYMENT_PIPELINE:
+        payment_pipeline.start()
+    
+    # Off by default: withdrawals wait for an admin to process them
+    if FeatureFlags.ENABLE_WITHDRAWAL_PROCESSOR:
+        withdrawal_processor.start()
+    
     return main_app
 
 
@@ -0,0 +1,256 @@
+"""
+Bet payment pipeline for Farcaster Prediction Market
+Submits bet payments and base fees off the request path and confirms bets
+"""
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from config import PaymentPipelineConfig
+from database import db, Bet, LeaderboardBucket, MarketEvent, SchedulerLease
+from leaderboard import leaderboard
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'payment_pipeline'
+
+# Bets accepted by the API that have not joined their market's pool yet
+UNCONFIRMED_BET_STATUSES = ('pending', 'confirming', 'paid')
+
+
+class PaymentPipeline:
+    """Moves bets from 'pending' to 'active' or 'failed'
+
+    Each tick submits the payment of pending bets ('pending' -> 'confirming'),
+    polls the chain for submitted payments ('confirming' -> 'paid'), then sends
+    base fees to the treasury and adds paid bets to their market pools
+    ('paid' -> 'active'). A rejected or timed out payment fails the bet; a bet
+    whose market closed while it was being paid for is refunded, then failed.
+    As with the settlement scheduler, only the process holding the
+    'payment_pipeline' lease does any work.
+    """
+
+    def __init__(self, app, config=PaymentPipelineConfig):
+        self.app = app
+        self.config = config
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire_lease(self, now):
+        """Take or renew the pipeline lease; returns True when this process leads"""
+        return SchedulerLease.acquire(LEASE_NAME, self.owner, now, self.config.LEASE_SECONDS)
+
+    def load(self, status, bet_ids=None):
+        """Bets in status, oldest first: up to BATCH_SIZE, or all of bet_ids that are"""
+        query = Bet.query.filter_by(status=status)
+        if bet_ids is not None:
+            return query.filter(Bet.id.in_(bet_ids)).order_by(Bet.id).all()
+        return query.order_by(Bet.id).limit(self.config.BATCH_SIZE).all()
+
+    def submit_payments(self, bet_ids=None):
+        """Submit payments for pending bets; returns the number submitted"""
+        from project import wallet_manager
+
+        bets = self.load('pending', bet_ids)
+        submitted = 0
+        for bet in bets:
+            # Keyed by bet id, so a resubmission after a crash is the same payment
+            result = wallet_manager.process_bet_payment(
+                from_wallet=bet.user_wallet,
+                amount=bet.amount + bet.base_fee,
+                bet_id=bet.id,
+                market_id=bet.market_id
+            )
+            if result['success']:
+                bet.transaction_hash = result['hash']
+                bet.status = 'confirming'
+                submitted += 1
+            else:
+                self.fail(bet, f"Transaction failed: {result['error']}")
+            # Commit per bet so a crash resubmits at most one payment
+            db.session.commit()
+        return submitted
+
+    def confirm_payments(self, now, bet_ids=None):
+        """Resolve submitted payments to 'paid' or 'failed'"""
+        from project import tx_handler
+
+        bets = self.load('confirming', bet_ids)
+        deadline = now - timedelta(seconds=self.config.CONFIRMATION_TIMEOUT_SECONDS)
+        for bet in bets:
+            status = tx_handler.get_transaction_status(bet.transaction_hash).get('status')
+            if status == 'confirmed':
+                bet.status = 'paid'
+            elif status == 'failed':
+                self.fail(bet, 'Payment transaction failed')
+            elif bet.placed_at < deadline:
+                self.fail(bet, 'Payment was not confirmed in time')
+            db.session.commit()
+
+    def activate_paid(self, bet_ids=None):
+        """Charge base fees and add paid bets to their markets' pools
+
+        A bet placed on its own pays its base fee alone. Bets from one
+        /api/bets/batch request wait until the whole batch has confirmed or
+        failed, then pay their base fees as a single transfer. Returns the
+        number of bets activated.
+        """
+        bets = self.load('paid', bet_ids)
+
+        batch_ids = {bet.batch_id for bet in bets if bet.batch_id}
+        unresolved_batches = {batch_id for (batch_id,) in db.session.query(Bet.batch_id).filter(
+            Bet.batch_id.in_(batch_ids),
+            Bet.status.in_(('pending', 'confirming'))
+        ).distinct()}
+
+        groups = {f"bet:{bet.id}:base_fee": [bet] for bet in bets if not bet.batch_id}
+        for batch_id in batch_ids - unresolved_batches:
+            # The whole batch, including paid bets beyond this tick's limit
+            groups[f"batch:{batch_id}:base_fee"] = Bet.query.filter_by(
+                batch_id=batch_id, status='paid'
+            ).order_by(Bet.id).all()
+
+        return sum(self.activate(fee_key, group) for fee_key, group in groups.items())
+
+    def activate(self, fee_key, bets):
+        """Send the base fees of a group of paid bets, then activate each bet"""
+        from project import tx_handler, TREASURE_WALLET, publish_pool_update
+        from utils import ResponseCache
+
+        # A batch's paid set is final once no bet in it is unresolved, so a
+        # retry under the same key always covers the same bets
+        fee_tx = tx_handler.send_transaction_once(
+            idempotency_key=fee_key,
+            to_address=TREASURE_WALLET,
+            amount=sum(bet.base_fee for bet in bets),
+            description=f"Market prediction base fees for bets {', '.join(str(bet.id) for bet in bets)}",
+            tx_type='base_fee',
+            related_id=bets[0].id
+        )
+        if not fee_tx['success']:
+            # Left 'paid'; the next tick retries under the same key
+            logger.error(f"Base fee transfer failed for {fee_key}: {fee_tx['error']}")
+            return 0
+
+        activated = []
+        closed = []
+        volume = {}
+        for bet in bets:
+            # Only one processor may add a bet to its pool; inline processing
+            # and a settler re-polling the market can both hold it
+            if not Bet.query.filter_by(id=bet.id, status='paid').update(
+                    {'status': 'active'}, synchronize_session='evaluate'):
+                continue
+            market = db.session.get(MarketEvent, bet.market_id)
+            # Settlement may have begun while the payment was confirming
+            if market.record_bet(bet.prediction, bet.amount):
+                activated.append(market)
+                wagered, count = volume.get(bet.user_fid, (0.0, 0))
+                volume[bet.user_fid] = (wagered + bet.amount, count + 1)
+            else:
+                bet.status = 'paid'
+                closed.append(bet)
+        if volume:
+            today = datetime.utcnow().date()
+            LeaderboardBucket.add([
+                {'user_fid': fid, 'day': today, 'wagered': wagered, 'bets_count': count,
+                 'settled_count': 0, 'won_count': 0, 'winnings': 0.0}
+                for fid, (wagered, count) in volume.items()
+            ])
+        db.session.commit()
+        leaderboard.mark_stale()
+
+        for bet in closed:
+            if self.refund(bet):
+                self.fail(bet, 'Market closed before payment was confirmed; payment refunded')
+                db.session.commit()
+
+        ResponseCache.invalidate(*{f'market:{bet.market_id}' for bet in bets}, *{f'user:{bet.user_fid}' for bet in bets})
+        for market in {market.id: market for market in activated}.values():
+            publish_pool_update(market)
+        return len(activated)
+
+    def refund(self, bet):
+        """Return a paid bet's stake to its wallet; returns False if the transfer failed
+
+        Only called once the base fee transfer has gone to the treasury, so the
+        fee is not refunded. Keyed by bet id, so the refund is sent once however
+        often it is retried. A bet whose refund failed stays 'paid' and is
+        retried on the next tick.
+        """
+        from project import tx_handler
+
+        refund_tx = tx_handler.send_transaction_once(
+            idempotency_key=f"bet:{bet.id}:refund",
+            to_address=bet.user_wallet,
+            amount=bet.amount,
+            description=f"Refund for bet {bet.id} on closed market {bet.market_id}",
+            tx_type='refund',
+            related_id=bet.id
+        )
+        if not refund_tx['success']:
+            logger.error(f"Refund failed for bet {bet.id}: {refund_tx['error']}")
+        return refund_tx['success']
+
+    def process(self, bet_ids, now=None):
+        """Take the given bets from 'pending' to 'active' on the caller's thread
+
+        Used instead of the background loop when ENABLE_PAYMENT_PIPELINE is
+        off. Only the caller's own bets are touched, so concurrent requests
+        never process the same bet. Returns the number of bets activated.
+        """
+        now = now or datetime.utcnow()
+        self.submit_payments(bet_ids)
+        self.confirm_payments(now, bet_ids)
+        return self.activate_paid(bet_ids)
+
+    def fail(self, bet, reason):
+        """Mark a bet failed and commit, with any other pending changes"""
+        from utils import ResponseCache
+
+        bet.status = 'failed'
+        bet.failure_reason = reason
+        db.session.commit()
+        ResponseCache.invalidate(f'user:{bet.user_fid}')
+        logger.warning(f"Bet {bet.id} failed: {reason}")
+
+    def run_once(self, now=None):
+        """Run one pipeline tick; returns the number of bets activated"""
+        now = now or datetime.utcnow()
+
+        if not self.acquire_lease(now):
+            return 0
+
+        self.submit_payments()
+        self.confirm_payments(now)
+        return self.activate_paid()
+
+    def start(self):
+        """Start the pipeline loop in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='payment-pipeline', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Payment pipeline tick failed: {e}", exc_info=True)
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.config.POLL_INTERVAL_SECONDS)
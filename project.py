@@ -3,15 +3,17 @@ Farcaster Prediction Market - Main Application
 A prediction market platform built on Farcaster for betting on user activity metrics
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
+import math
 import os
 from dotenv import load_dotenv
-import requests
 import hmac
 import hashlib
+import base64
+import click
 # eth_keys and eth_utils imports removed for development mode
 
 load_dotenv()
@@ -25,33 +27,136 @@ NEYNAR_API_KEY = os.getenv("NEYNAR_API_KEY", "")
 TREASURE_WALLET = "0xf2B6664bF4d507C8889f07174A6A6dE53CEFD7fC"
 BASE_FEE = 0.2  # $0.2
 WIN_FEE_PERCENTAGE = 1.5  # 1.5%
+WINNER_POOL_SHARE = 0.7  # 70% of pool goes to winners
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+BET_REQUIRED_FIELDS = ('market_id', 'user_fid', 'prediction', 'amount', 'user_wallet')
 
 # Import database and models
-from database import db, Bet, MarketEvent, UserProfile, Withdrawal
+from database import db, init_db, upsert, Bet, MarketEvent, UserBalance, UserProfile, Withdrawal
 from blockchain import WalletManager, TransactionHandler
+from utils import ResponseCache, Validator, cached_response, tag_response
+from events import market_event_bus, format_sse
+from idempotency import idempotent
+from group_commit import GroupCommitter
+from replica import init_replica_routing, switch_to_primary, use_primary
+from settlement import SettlementEngine, UNSETTLED_STATUSES, winning_side
+from payments import PaymentPipeline, UNCONFIRMED_BET_STATUSES
+from withdrawals import WithdrawalProcessor
+from ledger import reconcile_balances
+from leaderboard import leaderboard, METRICS as LEADERBOARD_METRICS
+from casts import CastIndex
+from http_client import http_client
+from config import BettingConfig, CacheConfig, CastIndexConfig, FeatureFlags, LeaderboardConfig, StreamConfig, SettlementConfig, PaymentPipelineConfig
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+
+# Settling an already settled market just returns its summary
+SETTLEABLE_STATUSES = UNSETTLED_STATUSES + ('settled',)
+# Dry runs are only meaningful before bet outcomes are written
+PREVIEWABLE_STATUSES = ('active', 'closed', 'settling')
 
 # Note: Database initialization is handled in main.py create_app()
 
 # Initialize blockchain handlers
 wallet_manager = WalletManager()
 tx_handler = TransactionHandler()
+settlement_engine = SettlementEngine(tx_handler, TREASURE_WALLET, WIN_FEE_PERCENTAGE, WINNER_POOL_SHARE)
+bet_writer = GroupCommitter(app)
+payment_pipeline = PaymentPipeline(app)
+withdrawal_processor = WithdrawalProcessor(app)
+init_replica_routing(app, db)
 
 
 # ==================== MARKET ENDPOINTS ====================
 
 @app.route('/api/markets', methods=['GET'])
+@cached_response('market_data', tags=lambda: ['markets'])
 def get_markets():
-    """Get all active prediction markets"""
+    """Get prediction markets, keyset-paginated on (end_time, id)"""
     try:
-        markets = MarketEvent.query.filter_by(status='active').all()
+        try:
+            limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            user_fid = request.args.get('user_fid', type=int)
+            end_after = parse_datetime_arg(request.args.get('end_after'))
+            end_before = parse_datetime_arg(request.args.get('end_before'))
+            cursor = decode_market_cursor(request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Invalid query parameter: {e}'}), 400
+        
+        query = MarketEvent.query.filter_by(status=request.args.get('status', 'active'))
+        
+        market_type = request.args.get('market_type')
+        if market_type:
+            query = query.filter(MarketEvent.market_type == market_type)
+        if user_fid is not None:
+            query = query.filter(MarketEvent.user_fid == user_fid)
+        if end_after:
+            query = query.filter(MarketEvent.end_time >= end_after)
+        if end_before:
+            query = query.filter(MarketEvent.end_time < end_before)
+        
+        if cursor:
+            cursor_end_time, cursor_id = cursor
+            query = query.filter(db.or_(
+                MarketEvent.end_time > cursor_end_time,
+                db.and_(MarketEvent.end_time == cursor_end_time, MarketEvent.id > cursor_id)
+            ))
+        
+        # Fetch one extra row to know whether another page exists
+        markets = query.order_by(MarketEvent.end_time, MarketEvent.id).limit(limit + 1).all()
+        has_more = len(markets) > limit
+        markets = markets[:limit]
+        tag_response(*(f'market:{market.id}' for market in markets))
+        
         return jsonify({
             'success': True,
-            'markets': [market.to_dict() for market in markets]
+            'markets': [market.to_dict() for market in markets],
+            'next_cursor': encode_market_cursor(markets[-1]) if has_more else None
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/markets/stream', methods=['GET'])
+def stream_markets():
+    """Stream market pool, odds and status changes as Server-Sent Events"""
+    try:
+        market_ids = [int(i) for i in request.args.get('market_ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid market_ids'}), 400
+    
+    subscription = market_event_bus.subscribe(market_ids)
+    if subscription is None:
+        return jsonify({'success': False, 'error': 'Too many open streams, retry later'}), 503
+    
+    def generate():
+        try:
+            yield f"retry: {StreamConfig.RETRY_MS}\n\n"
+            idle_seconds = 0
+            while True:
+                market_event_bus.poll()
+                event = subscription.get(timeout=StreamConfig.POLL_SECONDS)
+                if subscription.dropped:
+                    yield "event: dropped\ndata: {\"reason\": \"slow consumer\"}\n\n"
+                    return
+                if event is None:
+                    idle_seconds += StreamConfig.POLL_SECONDS
+                    if idle_seconds >= StreamConfig.HEARTBEAT_SECONDS:
+                        idle_seconds = 0
+                        yield ": heartbeat\n\n"
+                    continue
+                idle_seconds = 0
+                yield format_sse(event)
+        finally:
+            market_event_bus.unsubscribe(subscription)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @app.route('/api/markets/create', methods=['POST'])
 def create_market():
     """Create a new prediction market"""
@@ -76,11 +181,15 @@ def create_market():
         
         db.session.add(market)
         db.session.commit()
+        ResponseCache.invalidate('markets')
+        
+        market_data = market.to_dict()
+        market_event_bus.publish('market_created', market.id, market_data)
         
         return jsonify({
             'success': True,
             'market_id': market.id,
-            'market': market.to_dict()
+            'market': market_data
         }), 201
         
     except Exception as e:
@@ -88,74 +197,140 @@ def create_market():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/markets/<int:market_id>/odds', methods=['GET'])
+@cached_response('market_data', tags=lambda market_id: [f'market:{market_id}'])
+def get_market_odds(market_id):
+    """Get live implied odds from the market's running pool totals"""
+    try:
+        market = MarketEvent.query.get(market_id)
+        if not market:
+            return jsonify({'success': False, 'error': 'Market not found'}), 404
+        
+        return jsonify({
+            'success': True,
+            'market_id': market_id,
+            'status': market.status,
+            'total_pool': market.total_pool,
+            'bets_count': market.bets_count,
+            'win_fee_percentage': WIN_FEE_PERCENTAGE,
+            'odds': calculate_odds(market)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ==================== BETTING ENDPOINTS ====================
 
 @app.route('/api/bets/place', methods=['POST'])
+@idempotent('bets')
 def place_bet():
     """Place a bet on a market"""
     try:
         data = request.json
         
-        required_fields = ['market_id', 'user_fid', 'prediction', 'amount', 'user_wallet']
-        if not all(field in data for field in required_fields):
+        if not all(field in data for field in BET_REQUIRED_FIELDS):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        market = MarketEvent.query.get(data['market_id'])
-        if not market:
-            return jsonify({'success': False, 'error': 'Market not found'}), 404
+        market_id = parse_market_id(data['market_id'])
+        if market_id is None:
+            return jsonify({'success': False, 'error': 'market_id must be an integer'}), 400
+        data = {**data, 'market_id': market_id}
         
-        if market.status != 'active':
-            return jsonify({'success': False, 'error': 'Market is not active'}), 400
+        market = MarketEvent.query.get(market_id)
+        now = datetime.utcnow()
+        rejection = check_bet_request(data, market, now)
+        if rejection:
+            error, status_code = rejection
+            return jsonify({'success': False, 'error': error}), status_code
         
-        # Calculate fees
-        bet_amount = float(data['amount'])
-        total_cost = bet_amount + BASE_FEE
+        # Accept the bet; the payment pipeline submits the payment and base fee
+        # and activates it once the payment confirms
+        accepted_bet, = bet_writer.run(lambda: insert_bets([data], now))
+        process_payments_inline([accepted_bet])
+        ResponseCache.invalidate(f'user:{data["user_fid"]}')
         
-        # Create bet record
-        bet = Bet(
-            market_id=data['market_id'],
-            user_fid=data['user_fid'],
-            user_wallet=data['user_wallet'],
-            prediction=data['prediction'],  # 'yes' or 'no'
-            amount=bet_amount,
-            base_fee=BASE_FEE,
-            status='pending',
-            placed_at=datetime.utcnow()
-        )
+        return jsonify({
+            'success': True,
+            **accepted_bet,
+            'message': 'Bet accepted, awaiting payment confirmation'
+        }), 201
         
-        # Process wallet transaction
-        tx_result = wallet_manager.process_bet_payment(
-            from_wallet=data['user_wallet'],
-            amount=total_cost,
-            bet_id=bet.id,
-            market_id=data['market_id']
-        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/bets/batch', methods=['POST'])
+@idempotent('bet_batches')
+def place_bets_batch():
+    """Place many bets across markets with one market query and one commit
+    
+    Items are validated independently; valid ones are accepted even when
+    others are rejected. Base fees of a batch go to the treasury as one
+    transfer once every bet in it has confirmed or failed.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('bets')
         
-        if not tx_result['success']:
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': 'bets must be a non-empty list'}), 400
+        if len(items) > BettingConfig.MAX_BATCH_BETS:
             return jsonify({
                 'success': False,
-                'error': f"Transaction failed: {tx_result['error']}"
+                'error': f'At most {BettingConfig.MAX_BATCH_BETS} bets per batch'
             }), 400
         
-        # Send base fee to treasure wallet
-        fee_tx = tx_handler.send_transaction(
-            to_address=TREASURE_WALLET,
-            amount=BASE_FEE,
-            description=f"Market prediction base fee for bet {bet.id}"
-        )
+        # Reject malformed items up front so the market lookup only sees integer ids
+        results = []
+        parsed_items = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not all(field in item for field in BET_REQUIRED_FIELDS):
+                results.append({'index': index, 'success': False, 'error': 'Missing required fields'})
+                continue
+            
+            market_id = parse_market_id(item['market_id'])
+            if market_id is None:
+                results.append({'index': index, 'success': False, 'error': 'market_id must be an integer'})
+                continue
+            
+            results.append(None)  # Filled in once the item is checked against its market
+            parsed_items.append((index, {**item, 'market_id': market_id}))
         
-        bet.transaction_hash = tx_result['hash']
-        bet.status = 'active'
+        market_ids = {item['market_id'] for _, item in parsed_items}
+        markets = {market.id: market for market in MarketEvent.query.filter(MarketEvent.id.in_(market_ids))}
         
-        db.session.add(bet)
-        db.session.commit()
+        now = datetime.utcnow()
+        batch_id = uuid.uuid4().hex
+        valid_items = []
+        for index, item in parsed_items:
+            rejection = check_bet_request(item, markets.get(item['market_id']), now)
+            if rejection:
+                results[index] = {'index': index, 'success': False, 'error': rejection[0]}
+                continue
+            
+            valid_items.append(item)
+            results[index] = {'index': index, 'success': True}
+        
+        if not valid_items:
+            return jsonify({'success': False, 'error': 'No valid bets in batch', 'results': results}), 400
+        
+        accepted_bets = bet_writer.run(lambda: insert_bets(valid_items, now, batch_id))
+        process_payments_inline(accepted_bets)
+        accepted = iter(accepted_bets)
+        ResponseCache.invalidate(*{f'user:{item["user_fid"]}' for item in valid_items})
+        
+        for result in results:
+            if result['success']:
+                result.update(next(accepted))
         
         return jsonify({
             'success': True,
-            'bet_id': bet.id,
-            'message': 'Bet placed successfully',
-            'transaction': tx_result['hash'],
-            'total_cost': total_cost
+            'batch_id': batch_id,
+            'accepted_count': len(valid_items),
+            'rejected_count': len(results) - len(valid_items),
+            'total_cost': sum(result['total_cost'] for result in results if result['success']),
+            'results': results
         }), 201
         
     except Exception as e:
@@ -163,6 +338,88 @@ def place_bet():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def parse_market_id(value):
+    """Coerce a request's market_id to an int; returns None if it is not one"""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def check_bet_request(data, market, now):
+    """Validate a bet against its market; returns (error, status_code) or None"""
+    if not isinstance(data['prediction'], str) or not Validator.validate_prediction(data['prediction']):
+        return 'Prediction must be "over" or "under"', 400
+    
+    if not Validator.validate_amount(data['amount'], BettingConfig.MIN_BET_AMOUNT, BettingConfig.MAX_BET_AMOUNT):
+        return f'Amount must be between {BettingConfig.MIN_BET_AMOUNT} and {BettingConfig.MAX_BET_AMOUNT}', 400
+    
+    if not market:
+        return 'Market not found', 404
+    
+    if market.status != 'active':
+        return 'Market is not active', 400
+    
+    if market.end_time <= now:
+        return 'Market is closed for betting', 400
+    
+    return None
+
+
+def build_bet(data, now, batch_id=None):
+    """Create a pending bet from a validated request"""
+    return Bet(
+        market_id=data['market_id'],
+        user_fid=data['user_fid'],
+        user_wallet=data['user_wallet'],
+        prediction=data['prediction'].lower(),
+        amount=float(data['amount']),
+        base_fee=BASE_FEE,
+        status='pending',
+        batch_id=batch_id,
+        placed_at=now
+    )
+
+
+def insert_bets(items, now, batch_id=None):
+    """Add pending bets for validated requests; returns their response fields
+    
+    Runs through bet_writer, possibly in the group commit writer's session.
+    """
+    bets = [build_bet(item, now, batch_id) for item in items]
+    db.session.add_all(bets)
+    db.session.flush()
+    return [accepted_bet_response(bet) for bet in bets]
+
+
+def process_payments_inline(accepted_bets):
+    """Activate just-accepted bets on the request thread when no payment pipeline runs
+    
+    Without ENABLE_PAYMENT_PIPELINE nothing else would move the bets out of
+    'pending', and pending bets block settlement. Updates each response's status.
+    """
+    if FeatureFlags.ENABLE_PAYMENT_PIPELINE:
+        return
+    
+    bet_ids = [accepted_bet['bet_id'] for accepted_bet in accepted_bets]
+    payment_pipeline.process(bet_ids)
+    statuses = dict(db.session.query(Bet.id, Bet.status).filter(Bet.id.in_(bet_ids)))
+    for accepted_bet in accepted_bets:
+        accepted_bet['status'] = statuses[accepted_bet['bet_id']]
+
+
+def accepted_bet_response(bet):
+    """Response fields for a bet accepted into the payment pipeline"""
+    return {
+        'bet_id': bet.id,
+        'status': bet.status,
+        'status_url': f'/api/bets/{bet.id}/status',
+        'total_cost': bet.amount + bet.base_fee
+    }
+
+
 @app.route('/api/bets/<int:bet_id>', methods=['GET'])
 def get_bet(bet_id):
     """Get bet details"""
@@ -179,6 +436,30 @@ def get_bet(bet_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/bets/<int:bet_id>/status', methods=['GET'])
+@use_primary
+def get_bet_status(bet_id):
+    """Get a bet's payment status; poll until it is 'active' or 'failed'"""
+    try:
+        bet = db.session.get(Bet, bet_id)
+        if not bet:
+            return jsonify({'success': False, 'error': 'Bet not found'}), 404
+        
+        response = jsonify({
+            'success': True,
+            'bet_id': bet.id,
+            'status': bet.status,
+            'confirmed': bet.status not in UNCONFIRMED_BET_STATUSES and bet.status != 'failed',
+            'transaction_hash': bet.transaction_hash,
+            'failure_reason': bet.failure_reason
+        })
+        if bet.status in UNCONFIRMED_BET_STATUSES:
+            response.headers['Retry-After'] = str(PaymentPipelineConfig.STATUS_RETRY_AFTER_SECONDS)
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/bets/user/<int:fid>', methods=['GET'])
 def get_user_bets(fid):
     """Get all bets for a user"""
@@ -202,69 +483,70 @@ def settle_market(market_id):
         if not market:
             return jsonify({'success': False, 'error': 'Market not found'}), 404
         
-        if market.status != 'active':
+        if market.status not in SETTLEABLE_STATUSES:
             return jsonify({'success': False, 'error': 'Market is not active'}), 400
         
-        # Fetch actual data for the user
-        actual_value = fetch_user_metrics(market.user_fid, market.market_type)
+        if request.args.get('dry_run', '').lower() in ('1', 'true', 'yes'):
+            if market.status not in PREVIEWABLE_STATUSES:
+                return jsonify({'success': False, 'error': 'Market payouts are already computed'}), 400
+            
+            data = request.get_json(silent=True) or {}
+            result_value = data.get('result_value')
+            if result_value is not None:
+                try:
+                    result_value = float(result_value)
+                except (TypeError, ValueError):
+                    result_value = math.nan
+                if not math.isfinite(result_value):
+                    return jsonify({'success': False, 'error': 'result_value must be a number'}), 400
+            return jsonify({'success': True, **preview_settlement(market, result_value)})
+        
+        if market.status in ('active', 'closed'):
+            resume_inline_payments(market_id)
+            if count_unconfirmed_bets(market_id):
+                return jsonify({'success': False, 'error': 'Market has bets awaiting payment confirmation'}), 400
         
-        # Determine winners
-        winners = []
-        losers = []
+        return jsonify({'success': True, **settle_market_record(market)})
         
-        for bet in market.bets:
-            is_winner = determine_winner(
-                bet.prediction,
-                actual_value,
-                market.threshold,
-                market.direction
-            )
-            
-            if is_winner:
-                winners.append(bet)
-                bet.status = 'won'
-            else:
-                losers.append(bet)
-                bet.status = 'lost'
-        
-        # Calculate payouts
-        total_pool = sum(bet.amount for bet in market.bets)
-        
-        for winner_bet in winners:
-            # Calculate win amount based on odds
-            payout = calculate_payout(
-                bet_amount=winner_bet.amount,
-                total_pool=total_pool,
-                winner_count=len(winners)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/markets/settle-batch', methods=['POST'])
+def settle_markets_batch_endpoint():
+    """Settle many markets, fetching each distinct metric once"""
+    try:
+        data = request.get_json(silent=True) or {}
+        market_ids = data.get('market_ids')
+        
+        if market_ids:
+            if len(market_ids) > SettlementConfig.MAX_BATCH_MARKETS:
+                return jsonify({
+                    'success': False,
+                    'error': f'At most {SettlementConfig.MAX_BATCH_MARKETS} markets per batch'
+                }), 400
+            query = MarketEvent.query.filter(
+                MarketEvent.id.in_(market_ids),
+                MarketEvent.status.in_(SETTLEABLE_STATUSES)
             )
-            
-            # Apply 1.5% fee on winnings
-            win_fee = payout * (WIN_FEE_PERCENTAGE / 100)
-            net_payout = payout - win_fee
-            
-            winner_bet.payout = net_payout
-            winner_bet.fee_on_win = win_fee
-            
-            # Send fee to treasure wallet
-            tx_handler.send_transaction(
-                to_address=TREASURE_WALLET,
-                amount=win_fee,
-                description=f"Win fee for bet {winner_bet.id}"
+        else:
+            # Default to unsettled markets that have already ended, soonest first
+            query = MarketEvent.query.filter(
+                MarketEvent.status.in_(UNSETTLED_STATUSES),
+                MarketEvent.end_time <= datetime.utcnow()
             )
         
-        market.status = 'settled'
-        market.settled_at = datetime.utcnow()
-        market.result_value = actual_value
-        
-        db.session.commit()
+        markets = query.order_by(MarketEvent.end_time, MarketEvent.id).limit(
+            SettlementConfig.MAX_BATCH_MARKETS
+        ).all()
+        results, metrics_fetched = settle_markets_batch(markets)
         
         return jsonify({
             'success': True,
-            'market_id': market_id,
-            'result_value': actual_value,
-            'winners_count': len(winners),
-            'losers_count': len(losers),
-            'total_pool': total_pool
+            'settled_count': sum(1 for result in results if result['success']),
+            'metrics_fetched': metrics_fetched,
+            'results': results
         })
         
     except Exception as e:
@@ -272,9 +554,177 @@ def settle_market(market_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def settle_markets_batch(markets):
+    """Settle loaded markets, fetching each distinct (fid, metric, window) once
+    
+    Returns per-market results and the number of metric fetches made.
+    """
+    now = datetime.utcnow()
+    groups = {}
+    for market in markets:
+        groups.setdefault(metric_group_key(market, now), []).append(market)
+    
+    values = fetch_metrics_parallel(key for key in groups if key is not None)
+    
+    results = []
+    for key, group in groups.items():
+        for market in group:
+            market_id = market.id
+            if key is not None and values.get(key) is None:
+                # Left unsettled so the market is retried once the metric is available
+                results.append({'success': False, 'market_id': market_id, 'error': 'Metric unavailable'})
+                continue
+            try:
+                results.append({'success': True, **settle_market_record(market, values.get(key))})
+            except Exception as e:
+                db.session.rollback()
+                results.append({'success': False, 'market_id': market_id, 'error': str(e)})
+    
+    return results, len(groups)
+
+
+def metric_group_key(market, now):
+    """Key identifying the metric a market settles on
+    
+    Markets with equal keys resolve against the same metric value. Markets that
+    already froze their value in an earlier settlement attempt need no fetch.
+    """
+    if market.status not in ('active', 'closed'):
+        return None
+    return (market.user_fid, market.market_type, metric_window(market, now))
+
+
+def metric_window(market, now):
+    """(start, end) a market's metric is measured over, or None for point-in-time totals
+    
+    casts_count markets count the METRIC_WINDOW_HOURS before their own end
+    time, or before now when settled early, however late settlement runs.
+    """
+    if market.market_type != 'casts_count':
+        return None  # likes_total and engagement_score are point-in-time totals
+    end = min(market.end_time, now)
+    return (end - timedelta(hours=SettlementConfig.METRIC_WINDOW_HOURS), end)
+
+
+def fetch_metrics_parallel(keys):
+    """Fetch metric values for group keys through a bounded thread pool
+    
+    Keys whose fetch failed map to None.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    
+    def fetch(key):
+        try:
+            return fetch_user_metrics(*key)
+        except Exception as e:
+            print(f"Error fetching metrics for {key[:2]}: {e}")
+            return None
+    
+    workers = min(SettlementConfig.METRIC_FETCH_WORKERS, len(keys))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        values = executor.map(fetch, keys)
+        return dict(zip(keys, values))
+
+
+def count_unconfirmed_bets(market_id):
+    """Count a market's bets whose payment has not been confirmed or failed"""
+    return Bet.query.filter(
+        Bet.market_id == market_id,
+        Bet.status.in_(UNCONFIRMED_BET_STATUSES)
+    ).count()
+
+
+def resume_inline_payments(market_id):
+    """Re-poll a market's unconfirmed bets when no payment pipeline runs
+    
+    Inline processing handles a bet only during the request that placed it,
+    so a payment still unconfirmed then would leave the bet 'confirming' and
+    block settlement for good. Activation only takes bets still 'paid', so
+    this is safe alongside that request.
+    """
+    if FeatureFlags.ENABLE_PAYMENT_PIPELINE:
+        return
+    
+    bet_ids = [bet_id for (bet_id,) in db.session.query(Bet.id).filter(
+        Bet.market_id == market_id,
+        Bet.status.in_(UNCONFIRMED_BET_STATUSES)
+    )]
+    if bet_ids:
+        payment_pipeline.process(bet_ids)
+
+
+def preview_settlement(market, result_value=None):
+    """Compute a market's settlement without writing or sending anything
+    
+    Uses the given result value, the value frozen by an interrupted settlement,
+    or a fresh metric fetch, in that order.
+    """
+    if result_value is None:
+        if market.status == 'settling':
+            result_value = market.result_value
+        else:
+            result_value = fetch_user_metrics(
+                market.user_fid, market.market_type, metric_window(market, datetime.utcnow())
+            )
+    
+    plan = settlement_engine.plan(market, result_value)
+    return {
+        'dry_run': True,
+        **plan,
+        'win_fee_percentage': WIN_FEE_PERCENTAGE,
+        'treasury_sweep': plan['win_fee_total']
+    }
+
+
+def settle_market_record(market, actual_value=None):
+    """Drive a market through settlement and return the settlement summary
+    
+    Resumes from the market's persisted state (settling -> payouts_computed ->
+    fees_swept -> settled), so calling it again after a crash or on an already
+    settled market neither redoes payouts nor resends fees. Shared by the settle
+    endpoints and the auto-settlement scheduler.
+    """
+    market_id = market.id
+    
+    if market.status in ('active', 'closed'):
+        # Bets still being paid for would miss the pool; retried once they resolve
+        resume_inline_payments(market_id)
+        if count_unconfirmed_bets(market_id):
+            raise ValueError('Market has bets awaiting payment confirmation')
+        
+        # Fetch actual data for the user; frozen on the market from here on
+        if actual_value is None:
+            actual_value = fetch_user_metrics(
+                market.user_fid, market.market_type, metric_window(market, datetime.utcnow())
+            )
+        settlement_engine.begin(market, actual_value)
+    
+    if market.status == 'settling':
+        settlement_engine.compute_payouts(market)
+    
+    if market.status == 'payouts_computed':
+        # One treasury transfer for all winning bets' fees
+        settlement_engine.sweep_fees(market)
+    
+    if market.status == 'fees_swept' and settlement_engine.finish(market):
+        bettor_fids = [fid for (fid,) in db.session.query(Bet.user_fid).filter_by(market_id=market_id).distinct()]
+        ResponseCache.invalidate('markets', f'market:{market_id}', *(f'user:{fid}' for fid in bettor_fids))
+        leaderboard.mark_stale()
+        market_event_bus.publish('status_changed', market_id, {
+            'status': 'settled',
+            'result_value': market.result_value,
+            'settled_at': market.settled_at.isoformat()
+        })
+    
+    return settlement_engine.summary(market)
+
+
 # ==================== WITHDRAWAL ENDPOINTS ====================
 
 @app.route('/api/withdrawals/request', methods=['POST'])
+@idempotent('withdrawals')
 def request_withdrawal():
     """Request withdrawal of winnings"""
     try:
@@ -284,24 +734,33 @@ def request_withdrawal():
         if not all(field in data for field in required_fields):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        # Verify user has enough balance
-        user_balance = calculate_user_balance(data['user_fid'])
-        if user_balance < float(data['amount']):
+        try:
+            amount = float(data['amount'])
+        except (TypeError, ValueError):
+            amount = 0
+        if amount <= 0:
+            return jsonify({'success': False, 'error': 'Amount must be a positive number'}), 400
+        
+        # Check and reserve the balance in one statement; held until the
+        # withdrawal completes or fails
+        if not UserBalance.hold(data['user_fid'], amount):
+            db.session.rollback()
             return jsonify({
                 'success': False,
-                'error': f'Insufficient balance. Available: ${user_balance}'
+                'error': f"Insufficient balance. Available: ${calculate_user_balance(data['user_fid'])}"
             }), 400
         
         withdrawal = Withdrawal(
             user_fid=data['user_fid'],
             user_wallet=data['user_wallet'],
-            amount=float(data['amount']),
+            amount=amount,
             status='pending',
             requested_at=datetime.utcnow()
         )
         
         db.session.add(withdrawal)
         db.session.commit()
+        ResponseCache.invalidate(f'user:{data["user_fid"]}')
         
         return jsonify({
             'success': True,
@@ -318,29 +777,17 @@ def request_withdrawal():
 def process_withdrawal(withdrawal_id):
     """Process a withdrawal"""
     try:
-        withdrawal = Withdrawal.query.get(withdrawal_id)
+        withdrawal = db.session.get(Withdrawal, withdrawal_id)
         if not withdrawal:
             return jsonify({'success': False, 'error': 'Withdrawal not found'}), 404
         
-        if withdrawal.status != 'pending':
+        # Claimed like a batch of one, so the processor cannot pay it as well
+        keys = withdrawal_processor.claim(datetime.utcnow(), ids=[withdrawal_id])
+        if not keys:
             return jsonify({'success': False, 'error': 'Withdrawal is not pending'}), 400
         
-        # Send funds to user wallet
-        tx_result = tx_handler.send_transaction(
-            to_address=withdrawal.user_wallet,
-            amount=withdrawal.amount,
-            description=f"Withdrawal payout for user {withdrawal.user_fid}"
-        )
-        
-        if tx_result['success']:
-            withdrawal.status = 'completed'
-            withdrawal.transaction_hash = tx_result['hash']
-            withdrawal.processed_at = datetime.utcnow()
-        else:
-            withdrawal.status = 'failed'
-            withdrawal.error_message = tx_result['error']
-        
-        db.session.commit()
+        tx_result = withdrawal_processor.pay(keys)[keys[0]]
+        db.session.refresh(withdrawal)
         
         return jsonify({
             'success': tx_result['success'],
@@ -354,51 +801,157 @@ def process_withdrawal(withdrawal_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/withdrawals/process-batch', methods=['POST'])
+def process_withdrawal_batch():
+    """Pay the oldest pending withdrawals, one transfer per wallet"""
+    try:
+        results = withdrawal_processor.run_once()
+        return jsonify({
+            'success': True,
+            'transfers': len(results),
+            'failed_transfers': sum(1 for result in results.values() if not result['success']),
+            'metrics': withdrawal_processor.metrics()
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/withdrawals/metrics', methods=['GET'])
+def get_withdrawal_metrics():
+    """Withdrawal processor throughput and queue depth"""
+    try:
+        return jsonify({'success': True, 'metrics': withdrawal_processor.metrics()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ==================== USER PROFILE ENDPOINTS ====================
 
 @app.route('/api/users/<int:fid>', methods=['GET'])
+@cached_response('user_profile', tags=lambda fid: [f'user:{fid}'])
 def get_user_profile(fid):
     """Get user profile and statistics"""
     try:
-        user = UserProfile.query.filter_by(fid=fid).first()
-        if not user:
-            # Try to fetch from Farcaster and create profile
-            fc_user = fetch_farcaster_user(fid)
-            if not fc_user:
-                return jsonify({'success': False, 'error': 'User not found'}), 404
-            
-            user = UserProfile(
-                fid=fid,
-                username=fc_user.get('username'),
-                display_name=fc_user.get('display_name'),
-                pfp_url=fc_user.get('pfp_url'),
-                wallet_address=fc_user.get('verified_addresses', {}).get('eth_addresses', [None])[0]
-            )
-            db.session.add(user)
-            db.session.commit()
+        profile = load_user_profile(fid)
+        if not profile:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
         
-        # Get user stats
-        total_bets = Bet.query.filter_by(user_fid=fid).count()
-        won_bets = Bet.query.filter_by(user_fid=fid, status='won').count()
-        total_wagered = db.session.query(db.func.sum(Bet.amount)).filter_by(user_fid=fid).scalar() or 0
-        total_winnings = db.session.query(db.func.sum(Bet.payout)).filter_by(user_fid=fid, status='won').scalar() or 0
+        return jsonify({'success': True, 'user': profile})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def load_user_profile(fid):
+    """Profile and stats of a user, creating the profile from Farcaster if needed
+    
+    Returns None when the user is unknown here and on Farcaster. Shared by the
+    profile endpoint and the profile frame.
+    """
+    profile = cached_user_profile(fid)
+    if profile:
+        return profile
+    
+    # A profile created moments ago may not have reached the replica yet
+    switch_to_primary()
+    profile = cached_user_profile(fid)
+    if profile:
+        return profile
+    
+    # Try to fetch from Farcaster and create profile
+    fc_user = fetch_farcaster_user(fid)
+    if not fc_user:
+        return None
+    
+    # A concurrent request may create the same profile; keep whichever lands first
+    db.session.execute(upsert(UserProfile).values(
+        fid=fid,
+        username=fc_user.get('username'),
+        display_name=fc_user.get('display_name'),
+        pfp_url=fc_user.get('pfp_url'),
+        wallet_address=fc_user.get('verified_addresses', {}).get('eth_addresses', [None])[0]
+    ).on_conflict_do_nothing(index_elements=['fid']))
+    db.session.commit()
+    ResponseCache.invalidate(f'user:{fid}')
+    return cached_user_profile(fid)
+
+
+def cached_user_profile(fid):
+    """User profile snapshot, cached until one of the user's writes invalidates it"""
+    return ResponseCache.get_or_compute(
+        f'user_profile:{fid}', [f'user:{fid}'], CacheConfig.TIMEOUTS['user_profile'],
+        lambda: query_user_profile(fid)
+    )
+
+
+def query_user_profile(fid):
+    """Read a user's profile, bet stats and balance in one query; None if unknown"""
+    won = Bet.status == 'won'
+    balance = db.select(
+        UserBalance.credited - UserBalance.debited - UserBalance.held
+    ).where(UserBalance.user_fid == fid).scalar_subquery()
+    
+    row = db.session.query(
+        UserProfile.fid,
+        UserProfile.username,
+        UserProfile.display_name,
+        UserProfile.wallet_address,
+        db.func.count(Bet.id),
+        db.func.coalesce(db.func.sum(db.case((won, 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(Bet.amount), 0),
+        db.func.coalesce(db.func.sum(db.case((won, Bet.payout), else_=0)), 0),
+        balance
+    ).outerjoin(
+        # Bets whose payment failed never entered a market
+        Bet, db.and_(Bet.user_fid == UserProfile.fid, Bet.status != 'failed')
+    ).filter(UserProfile.fid == fid).group_by(UserProfile.fid).first()
+    
+    if row is None:
+        return None
+    
+    fid, username, display_name, wallet, total_bets, won_bets, total_wagered, total_winnings, balance = row
+    return {
+        'fid': fid,
+        'username': username,
+        'display_name': display_name,
+        'wallet': wallet,
+        'stats': {
+            'total_bets': total_bets,
+            'won_bets': int(won_bets),
+            'win_rate': (won_bets / total_bets * 100) if total_bets > 0 else 0,
+            'total_wagered': float(total_wagered),
+            'total_winnings': float(total_winnings),
+            'balance': float(balance or 0)
+        }
+    }
+
+
+# ==================== LEADERBOARD ENDPOINTS ====================
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """Get one page of users ranked by winnings, win rate or volume"""
+    try:
+        metric = request.args.get('by', 'winnings')
+        window = request.args.get('window', LeaderboardConfig.DEFAULT_WINDOW)
+        if metric not in LEADERBOARD_METRICS:
+            return jsonify({'success': False, 'error': f"by must be one of: {', '.join(LEADERBOARD_METRICS)}"}), 400
+        if window not in LeaderboardConfig.WINDOWS:
+            return jsonify({'success': False, 'error': f"window must be one of: {', '.join(LeaderboardConfig.WINDOWS)}"}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            offset = max(int(request.args.get('offset', 0)), 0)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Invalid query parameter: {e}'}), 400
         
+        entries, total = leaderboard.page(metric, window, offset, limit)
         return jsonify({
             'success': True,
-            'user': {
-                'fid': user.fid,
-                'username': user.username,
-                'display_name': user.display_name,
-                'wallet': user.wallet_address,
-                'stats': {
-                    'total_bets': total_bets,
-                    'won_bets': won_bets,
-                    'win_rate': (won_bets / total_bets * 100) if total_bets > 0 else 0,
-                    'total_wagered': float(total_wagered),
-                    'total_winnings': float(total_winnings),
-                    'balance': calculate_user_balance(fid)
-                }
-            }
+            'by': metric,
+            'window': window,
+            'entries': entries,
+            'total': total,
+            'next_offset': offset + limit if offset + limit < total else None
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -406,48 +959,61 @@ def get_user_profile(fid):
 
 # ==================== HELPER FUNCTIONS ====================
 
-def fetch_user_metrics(fid, metric_type):
-    """Fetch user metrics from Farcaster"""
-    try:
-        headers = {'Authorization': f'Bearer {NEYNAR_API_KEY}'}
-        
-        if metric_type == 'casts_count':
-            # Get number of casts in last 24 hours
-            url = f"{FARCASTER_HUB_URL}/api/v1/casts"
-            params = {'fid': fid, 'limit': 1000}
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            if response.status_code == 200:
-                casts = response.json().get('data', {}).get('casts', [])
-                # Filter casts from last 24 hours
-                now = datetime.utcnow()
-                recent_casts = [c for c in casts if datetime.fromisoformat(c.get('created_at', '')) > now - timedelta(hours=24)]
-                return len(recent_casts)
-        
-        elif metric_type == 'likes_total':
-            # Get total likes in last 24 hours
-            url = f"{FARCASTER_HUB_URL}/api/v1/user/likes"
-            params = {'fid': fid}
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            if response.status_code == 200:
-                likes_data = response.json().get('data', {})
-                return likes_data.get('total_likes', 0)
-        
-        elif metric_type == 'engagement_score':
-            # Calculate engagement score
-            url = f"{FARCASTER_HUB_URL}/api/v1/user/stats"
-            params = {'fid': fid}
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            if response.status_code == 200:
-                stats = response.json().get('data', {})
-                engagement = (stats.get('followers_count', 0) * 0.3 + 
-                            stats.get('following_count', 0) * 0.2 +
-                            stats.get('casts_count', 0) * 0.5)
-                return engagement
-        
-        return 0
-    except Exception as e:
-        print(f"Error fetching metrics: {e}")
-        return 0
+def fetch_casts_page(fid, cursor=None):
+    """Fetch one page of a user's casts from the hub, newest first; returns (casts, next cursor)"""
+    headers = {'Authorization': f'Bearer {NEYNAR_API_KEY}'}
+    url = f"{FARCASTER_HUB_URL}/api/v1/casts"
+    params = {'fid': fid, 'limit': CastIndexConfig.PAGE_SIZE}
+    if cursor:
+        params['cursor'] = cursor
+    response = http_client.get(url, params=params, headers=headers)
+    response.raise_for_status()
+    data = response.json().get('data', {})
+    return data.get('casts', []), (data.get('next') or {}).get('cursor')
+
+
+# Cast timestamps per fid, synced incrementally from the hub
+cast_index = CastIndex(fetch_casts_page)
+
+
+def fetch_user_metrics(fid, metric_type, window=None):
+    """Fetch user metrics from Farcaster
+    
+    casts_count counts casts created in window, a (start, end) pair of UTC
+    datetimes defaulting to the last METRIC_WINDOW_HOURS, synced from the hub
+    up to its end. Raises when the metric cannot be fetched, so a failed
+    lookup is never settled as zero.
+    """
+    headers = {'Authorization': f'Bearer {NEYNAR_API_KEY}'}
+    
+    if metric_type == 'casts_count':
+        if window is None:
+            now = datetime.utcnow()
+            window = (now - timedelta(hours=SettlementConfig.METRIC_WINDOW_HOURS), now)
+        return cast_index.count(fid, *window, exact=True)
+    
+    elif metric_type == 'likes_total':
+        # Get total likes in last 24 hours
+        url = f"{FARCASTER_HUB_URL}/api/v1/user/likes"
+        params = {'fid': fid}
+        response = http_client.get(url, params=params, headers=headers)
+        response.raise_for_status()
+        likes_data = response.json().get('data', {})
+        return likes_data.get('total_likes', 0)
+    
+    elif metric_type == 'engagement_score':
+        # Calculate engagement score
+        url = f"{FARCASTER_HUB_URL}/api/v1/user/stats"
+        params = {'fid': fid}
+        response = http_client.get(url, params=params, headers=headers)
+        response.raise_for_status()
+        stats = response.json().get('data', {})
+        engagement = (stats.get('followers_count', 0) * 0.3 + 
+                    stats.get('following_count', 0) * 0.2 +
+                    stats.get('casts_count', 0) * 0.5)
+        return engagement
+    
+    raise ValueError(f'Unknown metric type: {metric_type}')
 
 
 def fetch_farcaster_user(fid):
@@ -456,7 +1022,7 @@ def fetch_farcaster_user(fid):
         headers = {'Authorization': f'Bearer {NEYNAR_API_KEY}'}
         url = f"{FARCASTER_HUB_URL}/api/v1/user"
         params = {'fid': fid}
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        response = http_client.get(url, params=params, headers=headers)
         
         if response.status_code == 200:
             return response.json().get('data', {})
@@ -466,12 +1032,40 @@ def fetch_farcaster_user(fid):
         return None
 
 
+def encode_market_cursor(market):
+    """Encode the (end_time, id) keyset position of a market as an opaque cursor"""
+    raw = f"{market.end_time.isoformat()}|{market.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_market_cursor(cursor):
+    """Decode a cursor produced by encode_market_cursor into (end_time, id)"""
+    if not cursor:
+        return None
+    try:
+        end_time, market_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(end_time), int(market_id)
+    except Exception:
+        raise ValueError('cursor')
+
+
+def parse_datetime_arg(value):
+    """Parse an optional ISO 8601 query argument"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(value)
+    # Stored timestamps are naive UTC
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
 def determine_winner(prediction, actual_value, threshold, direction):
     """Determine if a bet prediction is correct"""
-    if prediction == 'over' or direction == 'over':
-        return actual_value > threshold
-    else:  # 'under'
-        return actual_value < threshold
+    return prediction == winning_side(actual_value, threshold)
 
 
 def calculate_payout(bet_amount, total_pool, winner_count):
@@ -480,29 +1074,74 @@ def calculate_payout(bet_amount, total_pool, winner_count):
         return bet_amount
     
     # Split losing pool among winners, plus return original bet
-    losing_pool = total_pool * 0.7  # 70% of pool goes to winners
+    losing_pool = total_pool * WINNER_POOL_SHARE
     payout_per_winner = losing_pool / winner_count
     return bet_amount + payout_per_winner
 
 
+def calculate_odds(market):
+    """Calculate implied probability and the projected winnings per side
+    
+    Settlement pays every winning bet its stake plus an equal share of
+    WINNER_POOL_SHARE of the whole pool, less the win fee, whatever its size.
+    share_per_winner is that share if the side won now; a winning bet of
+    stake s would be paid (s + share_per_winner) * (1 - win fee).
+    """
+    total_pool = market.total_pool or 0
+    odds = {}
+    for side in ('over', 'under'):
+        side_pool = getattr(market, f'{side}_pool') or 0
+        side_bets = getattr(market, f'{side}_bets') or 0
+        odds[side] = {
+            'pool': side_pool,
+            'bets': side_bets,
+            'implied_probability': side_pool / total_pool if total_pool > 0 else None,
+            'share_per_winner': total_pool * WINNER_POOL_SHARE / side_bets if side_bets else None
+        }
+    return odds
+
+
+def publish_pool_update(market):
+    """Publish a market's current pool totals and odds to stream subscribers"""
+    market_event_bus.publish('pool_updated', market.id, {
+        'bets_count': market.bets_count,
+        'total_pool': market.total_pool,
+        'over_pool': market.over_pool,
+        'under_pool': market.under_pool,
+        'odds': calculate_odds(market)
+    })
+
+
 def calculate_user_balance(fid):
     """Calculate available balance for a user"""
     try:
-        # Sum of payouts from won bets minus withdrawals
-        total_winnings = db.session.query(db.func.sum(Bet.payout)).filter_by(
-            user_fid=fid, status='won'
-        ).scalar() or 0
-        
-        total_withdrawn = db.session.query(db.func.sum(Withdrawal.amount)).filter_by(
-            user_fid=fid, status='completed'
-        ).scalar() or 0
-        
-        return float(total_winnings) - float(total_withdrawn)
+        # Payouts from won bets minus completed and held withdrawals, from the ledger
+        return UserBalance.available_for(fid)
     except Exception as e:
         print(f"Error calculating balance: {e}")
         return 0
 
 
+# ==================== CLI COMMANDS ====================
+
+@app.cli.command('reconcile-balances')
+@click.option('--fix', is_flag=True, help='Rewrite ledger rows that differ from history')
+def reconcile_balances_command(fix):
+    """Verify the user balance ledger against bet and withdrawal history"""
+    mismatches = reconcile_balances(fix=fix)
+    for mismatch in mismatches:
+        click.echo(
+            f"fid {mismatch['user_fid']} {mismatch['column']}: "
+            f"ledger {mismatch['ledger']:.6f}, history {mismatch['expected']:.6f}"
+        )
+    if not mismatches:
+        click.echo('Ledger matches history')
+    elif fix:
+        click.echo(f'Rewrote {len({m["user_fid"] for m in mismatches})} ledger rows')
+    else:
+        raise SystemExit(1)
+
+
 # ==================== HEALTH CHECK ====================
 
 @app.route('/health', methods=['GET'])
@@ -529,4 +1168,6 @@ def internal_error(error):
 if __name__ == '__main__':
     with app.app_context():
         init_db(app)
+    if FeatureFlags.ENABLE_PAYMENT_PIPELINE:
+        payment_pipeline.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
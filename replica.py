@@ -0,0 +1,84 @@
+"""
+Read-replica routing for Farcaster Prediction Market
+Sends reads of GET requests and frame renders to a replica database
+"""
+
+import time
+
+from flask import g, has_request_context, request
+
+from config import ReplicaConfig
+
+REPLICA_BIND = 'replica'
+
+
+def use_primary(f):
+    """Mark a GET view that must read its own or very recent writes"""
+    f.read_from_primary = True
+    return f
+
+
+def use_replica(f):
+    """Mark a read-only non-GET view, such as a frame render, for the replica"""
+    f.read_from_replica = True
+    return f
+
+
+def switch_to_primary():
+    """Send the rest of the current request's reads to the primary
+
+    For a read that decides a write, where replica lag could hide a row a
+    concurrent request just created.
+    """
+    if has_request_context():
+        g.read_replica = False
+
+
+def reads_from_replica():
+    """Whether ORM reads in the current context should go to the replica"""
+    return has_request_context() and g.get('read_replica', False)
+
+
+def recently_wrote():
+    """Whether this client wrote within the read-your-writes window"""
+    if request.headers.get('X-Consistency', '').lower() == 'strong':
+        return True
+    try:
+        return float(request.cookies.get(ReplicaConfig.READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def init_replica_routing(app, db):
+    """Route reads to the replica bind when one is configured
+
+    GET and HEAD requests read from the replica unless the view is marked
+    @use_primary; other requests read from the primary unless marked
+    @use_replica. After a successful write the client gets a cookie that pins
+    its reads to the primary for READ_YOUR_WRITES_SECONDS, longer than the
+    replica is expected to lag, so users always see their own bets and
+    withdrawals. Writes always go to the primary.
+    """
+    @app.before_request
+    def choose_read_database():
+        if REPLICA_BIND not in db.engines:
+            return
+        view = app.view_functions.get(request.endpoint)
+        if request.method in ('GET', 'HEAD'):
+            wants_replica = not getattr(view, 'read_from_primary', False)
+        else:
+            wants_replica = getattr(view, 'read_from_replica', False)
+        g.read_replica = wants_replica and not recently_wrote()
+
+    @app.after_request
+    def mark_recent_write(response):
+        if (REPLICA_BIND in db.engines and request.method not in ('GET', 'HEAD', 'OPTIONS')
+                and not g.get('read_replica', False) and response.status_code < 400):
+            response.set_cookie(
+                ReplicaConfig.READ_YOUR_WRITES_COOKIE,
+                str(time.time() + ReplicaConfig.READ_YOUR_WRITES_SECONDS),
+                max_age=ReplicaConfig.READ_YOUR_WRITES_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
@@ -0,0 +1,175 @@
+"""
+Auto-settlement scheduler for Farcaster Prediction Market
+Closes markets to betting at their end time and settles them in bounded batches
+"""
+
+import heapq
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from config import SchedulerConfig
+from database import db, MarketEvent, SchedulerLease
+from settlement import UNSETTLED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'auto_settlement'
+
+
+class SettlementScheduler:
+    """Time-ordered queue of expiring markets
+
+    The queue is a heap of (end_time, market_id) refilled from the indexed
+    end_time column. Only the process holding the 'auto_settlement' lease
+    closes or settles markets, so running one scheduler per gunicorn worker is
+    safe: the others idle until the lease expires. Markets that fail to settle
+    are requeued at an exponentially backed-off retry time.
+    """
+
+    def __init__(self, app, config=SchedulerConfig):
+        self.app = app
+        self.config = config
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = []
+        self._queued_ids = set()
+        self._failures = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire_lease(self, now):
+        """Take or renew the scheduler lease; returns True when this process leads"""
+        return SchedulerLease.acquire(LEASE_NAME, self.owner, now, self.config.LEASE_SECONDS)
+
+    def refill(self, now):
+        """Load markets ending within the lookahead window into the queue"""
+        horizon = now + timedelta(seconds=self.config.LOOKAHEAD_SECONDS)
+        capacity = self.config.QUEUE_LIMIT - len(self._queue)
+        if capacity <= 0:
+            return
+
+        rows = db.session.query(MarketEvent.end_time, MarketEvent.id).filter(
+            MarketEvent.status.in_(UNSETTLED_STATUSES),
+            MarketEvent.end_time <= horizon
+        ).order_by(MarketEvent.end_time, MarketEvent.id).limit(capacity + len(self._queued_ids)).all()
+
+        for end_time, market_id in rows:
+            if market_id in self._queued_ids:
+                continue
+            heapq.heappush(self._queue, (end_time, market_id))
+            self._queued_ids.add(market_id)
+            capacity -= 1
+            if capacity <= 0:
+                break
+
+    def pop_due(self, now):
+        """Pop up to BATCH_SIZE markets whose end time has passed"""
+        due = []
+        while self._queue and self._queue[0][0] <= now and len(due) < self.config.BATCH_SIZE:
+            _, market_id = heapq.heappop(self._queue)
+            self._queued_ids.discard(market_id)
+            due.append(market_id)
+        return due
+
+    def reset(self):
+        self._queue = []
+        self._queued_ids.clear()
+        self._failures.clear()
+
+    def retry_later(self, market_id, now):
+        """Requeue a failed market after a backoff that doubles per failure"""
+        failures = self._failures.get(market_id, 0) + 1
+        self._failures[market_id] = failures
+        delay = min(self.config.RETRY_BASE_SECONDS * 2 ** (failures - 1), self.config.RETRY_MAX_SECONDS)
+        heapq.heappush(self._queue, (now + timedelta(seconds=delay), market_id))
+        self._queued_ids.add(market_id)
+        return delay
+
+    def close_markets(self, market_ids):
+        """Stop betting on expired markets"""
+        from utils import ResponseCache
+        from events import market_event_bus
+
+        closing_ids = [market_id for (market_id,) in db.session.query(MarketEvent.id).filter(
+            MarketEvent.id.in_(market_ids),
+            MarketEvent.status == 'active'
+        )]
+        if not closing_ids:
+            return 0
+
+        MarketEvent.query.filter(
+            MarketEvent.id.in_(closing_ids),
+            MarketEvent.status == 'active'
+        ).update({'status': 'closed'}, synchronize_session=False)
+        db.session.commit()
+
+        ResponseCache.invalidate('markets', *(f'market:{market_id}' for market_id in closing_ids))
+        for market_id in closing_ids:
+            market_event_bus.publish('status_changed', market_id, {'status': 'closed'})
+        return len(closing_ids)
+
+    def settle_markets(self, market_ids, now):
+        """Settle closed markets as one batch sharing metric fetches"""
+        from project import settle_markets_batch
+
+        markets = MarketEvent.query.filter(
+            MarketEvent.id.in_(market_ids),
+            MarketEvent.status.in_(UNSETTLED_STATUSES)
+        ).all()
+        results, _ = settle_markets_batch(markets)
+
+        failed_ids = set()
+        for result in results:
+            if not result['success']:
+                failed_ids.add(result['market_id'])
+                delay = self.retry_later(result['market_id'], now)
+                logger.error(f"Auto-settlement failed for market {result['market_id']}: "
+                             f"{result['error']}; retrying in {delay}s")
+        for market_id in market_ids:
+            if market_id not in failed_ids:
+                self._failures.pop(market_id, None)
+        return sum(1 for result in results if result['success'])
+
+    def run_once(self, now=None):
+        """Run one scheduler tick; returns the number of markets settled"""
+        now = now or datetime.utcnow()
+
+        if not self.acquire_lease(now):
+            self.reset()
+            return 0
+
+        self.refill(now)
+        due = self.pop_due(now)
+        if not due:
+            return 0
+
+        self.close_markets(due)
+        return self.settle_markets(due, now)
+
+    def start(self):
+        """Start the scheduler loop in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='settlement-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Settlement scheduler tick failed: {e}", exc_info=True)
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.config.POLL_INTERVAL_SECONDS)
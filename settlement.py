@@ -0,0 +1,219 @@
+"""
+Settlement engine for Farcaster Prediction Market
+Computes winners, payouts and fees for a whole market in one set-based pass
+"""
+
+import logging
+from datetime import datetime
+
+from database import db, Bet, LeaderboardBucket, MarketEvent, UserBalance
+
+# Market statuses that still have to be driven to 'settled'; the last three
+# are settlement checkpoints persisted in MarketEvent.status
+UNSETTLED_STATUSES = ('active', 'closed', 'settling', 'payouts_computed', 'fees_swept')
+
+logger = logging.getLogger(__name__)
+
+
+def winning_side(actual_value, threshold):
+    """Prediction that wins for a metric value, or None when it hits the threshold
+
+    A bet wins iff its prediction is this side; the market's direction only
+    names the side it was created for.
+    """
+    if actual_value > threshold:
+        return 'over'
+    if actual_value < threshold:
+        return 'under'
+    return None
+
+
+class SettlementEngine:
+    """Settles markets with aggregate queries and bulk UPDATEs
+
+    Every winner of a market receives the same pool share on top of their
+    stake, so payouts and fees are linear in the bet amount. That lets the
+    engine settle from per-side totals and write all bets with two UPDATE
+    statements instead of loading Bet objects.
+
+    Settlement runs as a persisted state machine. Each step commits its work
+    together with a conditional status transition, so a restarted or
+    concurrent settler resumes from the last checkpoint and a step can never
+    be applied twice.
+    """
+
+    def __init__(self, tx_handler, treasury_wallet, win_fee_percentage, winner_pool_share):
+        self.tx_handler = tx_handler
+        self.treasury_wallet = treasury_wallet
+        self.win_fee_rate = win_fee_percentage / 100
+        self.winner_pool_share = winner_pool_share
+
+    @staticmethod
+    def winning_condition(actual_value, threshold, direction):
+        """SQL condition matching winning bets, the bets whose prediction is the winning side"""
+        side = winning_side(actual_value, threshold)
+        return Bet.prediction == side if side else db.false()
+
+    def plan(self, market, actual_value):
+        """Compute the settlement of a market without writing anything"""
+        winning = self.winning_condition(actual_value, market.threshold, market.direction)
+
+        winner_count, winner_stake, bet_count = db.session.query(
+            db.func.coalesce(db.func.sum(db.case((winning, 1), else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.case((winning, Bet.amount), else_=0)), 0),
+            db.func.count(Bet.id)
+        ).filter(Bet.market_id == market.id, Bet.status == 'active').one()
+
+        total_pool = market.total_pool or 0
+        share_per_winner = total_pool * self.winner_pool_share / winner_count if winner_count else 0
+        gross_payouts = winner_stake + share_per_winner * winner_count
+        win_fee_total = gross_payouts * self.win_fee_rate
+        # Winners get their stake back on top of a share of the whole pool, so
+        # payouts exceed the pool once the winning side holds most of it
+        shortfall = max(gross_payouts - total_pool, 0)
+        if shortfall:
+            logger.warning(f"Market {market.id} payouts exceed its pool by {shortfall:.6f}")
+
+        return {
+            'market_id': market.id,
+            'result_value': actual_value,
+            'winners_count': winner_count,
+            'losers_count': bet_count - winner_count,
+            'total_pool': total_pool,
+            'winning_stake': float(winner_stake),
+            'share_per_winner': share_per_winner,
+            'total_payout': gross_payouts - win_fee_total,
+            'win_fee_total': win_fee_total,
+            'house_take': max(total_pool - gross_payouts, 0),
+            'shortfall': shortfall
+        }
+
+    @staticmethod
+    def transition(market, from_statuses, to_status, **values):
+        """Move a market to the next state if it is still in an expected one
+
+        Returns False when another settler already moved it on.
+        """
+        if isinstance(from_statuses, str):
+            from_statuses = (from_statuses,)
+        values['status'] = to_status
+        moved = MarketEvent.query.filter(
+            MarketEvent.id == market.id,
+            MarketEvent.status.in_(from_statuses)
+        ).update(values, synchronize_session=False)
+        return moved == 1
+
+    def begin(self, market, actual_value):
+        """Freeze the metric value and enter 'settling'"""
+        self.transition(market, ('active', 'closed'), 'settling', result_value=actual_value)
+        db.session.commit()
+        db.session.refresh(market)
+
+    def compute_payouts(self, market, settled_at=None):
+        """Write every bet's outcome and checkpoint the fee total"""
+        plan = self.plan(market, market.result_value)
+        self.apply_payouts(market, market.result_value, plan, settled_at)
+        if self.transition(market, 'settling', 'payouts_computed', win_fee_total=plan['win_fee_total']):
+            db.session.commit()
+        else:
+            db.session.rollback()
+        db.session.refresh(market)
+
+    def sweep_fees(self, market):
+        """Send the market's total win fee to the treasury as one transfer"""
+        if market.win_fee_total and market.win_fee_total > 0:
+            result = self.tx_handler.send_transaction_once(
+                idempotency_key=f"market:{market.id}:win_fees",
+                to_address=self.treasury_wallet,
+                amount=market.win_fee_total,
+                description=f"Win fees for market {market.id}",
+                tx_type='win_fee',
+                related_id=market.id
+            )
+            if not result['success']:
+                raise RuntimeError(f"Win fee sweep failed: {result['error']}")
+
+        self.transition(market, 'payouts_computed', 'fees_swept')
+        db.session.commit()
+        db.session.refresh(market)
+
+    def finish(self, market, settled_at=None):
+        """Mark the market settled; returns True for the settler that did it"""
+        finished = self.transition(market, 'fees_swept', 'settled', settled_at=settled_at or datetime.utcnow())
+        db.session.commit()
+        db.session.refresh(market)
+        return finished
+
+    def apply_payouts(self, market, actual_value, plan, settled_at=None):
+        """Mark every active bet won or lost and write payouts in bulk"""
+        settled_at = settled_at or datetime.utcnow()
+        winning = self.winning_condition(actual_value, market.threshold, market.direction)
+        active_bets = Bet.query.filter(Bet.market_id == market.id, Bet.status == 'active')
+
+        gross_payout = Bet.amount + plan['share_per_winner']
+        active_bets.filter(winning).update({
+            Bet.status: 'won',
+            Bet.payout: gross_payout * (1 - self.win_fee_rate),
+            Bet.fee_on_win: gross_payout * self.win_fee_rate,
+            Bet.settled_at: settled_at
+        }, synchronize_session=False)
+        self.credit_winners(market)
+
+        active_bets.update({
+            Bet.status: 'lost',
+            Bet.settled_at: settled_at
+        }, synchronize_session=False)
+        self.record_results(market, settled_at)
+
+    @staticmethod
+    def credit_winners(market):
+        """Add each winner's payouts from this market to their balance ledger
+
+        Sums payouts per winner once and applies them in a single upsert. Runs
+        in the payouts transaction, so a settler that loses the race to
+        'payouts_computed' rolls its credits back with its bet updates.
+        """
+        UserBalance.credit(db.select(
+            Bet.user_fid,
+            db.func.sum(Bet.payout),
+            db.literal(datetime.utcnow(), db.DateTime)
+        ).where(
+            Bet.market_id == market.id,
+            Bet.status == 'won'
+        ).group_by(Bet.user_fid))
+
+    @staticmethod
+    def record_results(market, settled_at):
+        """Add the market's settled bets to each bettor's leaderboard day"""
+        won = Bet.status == 'won'
+        LeaderboardBucket.add(db.select(
+            Bet.user_fid,
+            db.literal(settled_at.date(), db.Date),
+            db.literal(0.0),
+            db.literal(0),
+            db.func.count(Bet.id),
+            db.func.sum(db.case((won, 1), else_=0)),
+            db.func.coalesce(db.func.sum(db.case((won, Bet.payout), else_=0)), 0),
+            db.literal(datetime.utcnow(), db.DateTime)
+        ).where(
+            Bet.market_id == market.id,
+            Bet.status.in_(('won', 'lost'))
+        ).group_by(Bet.user_fid))
+
+    @staticmethod
+    def summary(market):
+        """Summarize a market's settlement from its persisted state"""
+        counts = dict(db.session.query(Bet.status, db.func.count(Bet.id)).filter(
+            Bet.market_id == market.id,
+            Bet.status.in_(('won', 'lost'))
+        ).group_by(Bet.status).all())
+
+        return {
+            'market_id': market.id,
+            'status': market.status,
+            'result_value': market.result_value,
+            'winners_count': counts.get('won', 0),
+            'losers_count': counts.get('lost', 0),
+            'total_pool': market.total_pool or 0,
+            'win_fee_total': market.win_fee_total or 0
+        }
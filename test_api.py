@@ -8,6 +8,17 @@ import json
 from datetime import datetime, timedelta
 from project import app
 from database import db, init_db, MarketEvent, Bet, UserProfile
+from utils import ResponseCache
+from payments import PaymentPipeline
+from idempotency import idempotency_store
+from leaderboard import leaderboard
+
+payment_pipeline = PaymentPipeline(app)
+
+
+def confirm_payments():
+    """Run one payment pipeline tick so placed bets become active"""
+    return payment_pipeline.run_once()
 
 
 @pytest.fixture
@@ -15,43 +26,45 @@ def client():
     """Create test client"""
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    ResponseCache.clear()
+    idempotency_store.clear()
+    leaderboard.clear()
     
     with app.app_context():
         init_db(app)
         yield app.test_client()
         db.session.remove()
+        db.drop_all()
 
 
 @pytest.fixture
 def sample_user(client):
     """Create sample user"""
-    with app.app_context():
-        user = UserProfile(
-            fid=1,
-            username='alice',
-            display_name='Alice',
-            wallet_address='0x742d35Cc6634C0532925a3b844Bc9e7595f42e24'
-        )
-        db.session.add(user)
-        db.session.commit()
-        return user
+    user = UserProfile(
+        fid=1,
+        username='alice',
+        display_name='Alice',
+        wallet_address='0x742d35Cc6634C0532925a3b844Bc9e7595f42e24'
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
 
 
 @pytest.fixture
 def sample_market(client, sample_user):
     """Create sample market"""
-    with app.app_context():
-        market = MarketEvent(
-            user_fid=sample_user.fid,
-            market_type='casts_count',
-            threshold=5,
-            direction='over',
-            end_time=datetime.utcnow() + timedelta(hours=24),
-            status='active'
-        )
-        db.session.add(market)
-        db.session.commit()
-        return market
+    market = MarketEvent(
+        user_fid=sample_user.fid,
+        market_type='casts_count',
+        threshold=5,
+        direction='over',
+        end_time=datetime.utcnow() + timedelta(hours=24),
+        status='active'
+    )
+    db.session.add(market)
+    db.session.commit()
+    return market
 
 
 class TestHealth:
@@ -76,6 +89,147 @@ class TestMarkets:
         assert data['success'] is True
         assert len(data['markets']) > 0
     
+    def test_get_markets_keyset_pagination(self, client, sample_user):
+        """Test paging through markets with a cursor"""
+        with app.app_context():
+            for hours in range(5):
+                db.session.add(MarketEvent(
+                    user_fid=sample_user.fid,
+                    market_type='casts_count',
+                    threshold=5,
+                    end_time=datetime.utcnow() + timedelta(hours=hours + 1),
+                    status='active'
+                ))
+            db.session.commit()
+        
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            data = json.loads(client.get('/api/markets', query_string=params).data)
+            assert len(data['markets']) <= 2
+            seen.extend(market['id'] for market in data['markets'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        
+        assert len(seen) == 5
+        assert len(set(seen)) == 5
+    
+    def test_get_markets_filters(self, client, sample_market):
+        """Test filtering markets by type and user"""
+        response = client.get('/api/markets?market_type=likes_total')
+        assert json.loads(response.data)['markets'] == []
+        
+        response = client.get('/api/markets?market_type=casts_count&user_fid=1')
+        assert len(json.loads(response.data)['markets']) == 1
+    
+    def test_get_markets_invalid_cursor(self, client):
+        """Test invalid cursor is rejected"""
+        response = client.get('/api/markets?cursor=not-a-cursor')
+        assert response.status_code == 400
+    
+    def test_get_markets_etag_revalidation(self, client, sample_market):
+        """Test unchanged listings revalidate with 304"""
+        response = client.get('/api/markets')
+        etag = response.headers['ETag']
+        
+        response = client.get('/api/markets', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+    
+    def test_get_markets_cache_invalidated_by_bet(self, client, sample_market, sample_user):
+        """Test placing a bet invalidates cached listings of that market"""
+        with app.app_context():
+            etag = client.get('/api/markets').headers['ETag']
+            client.post('/api/bets/place', json={
+                'market_id': sample_market.id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            })
+            confirm_payments()
+            
+            response = client.get('/api/markets', headers={'If-None-Match': etag})
+            assert response.status_code == 200
+            assert json.loads(response.data)['markets'][0]['total_pool'] == 10.0
+
+    def test_response_cache_bounds(self, client, monkeypatch):
+        """Test old invalidation records are pruned and only responses count toward MAX_ENTRIES"""
+        import utils
+        from config import CacheConfig
+        from utils import Cache
+
+        clock = [utils.time.monotonic()]
+        monkeypatch.setattr(utils.time, 'monotonic', lambda: clock[0])
+        ResponseCache.invalidate('user:1')
+        clock[0] += max(CacheConfig.TIMEOUTS.values()) + 60
+        ResponseCache.invalidate('user:2')
+        assert 'user:1' not in ResponseCache._invalidated_at
+        assert 'user:2' in ResponseCache._invalidated_at
+
+        monkeypatch.setattr(ResponseCache, 'MAX_ENTRIES', 2)
+        for index in range(3):
+            Cache.set(f'unrelated:{index}', index)
+        epoch = ResponseCache._epoch
+        ResponseCache.store('response:/a', {}, ['markets'], epoch, 60)
+        ResponseCache.store('response:/b', {}, ['markets'], epoch, 60)
+        assert Cache.get('response:/a') is not None
+        ResponseCache.store('response:/c', {}, ['markets'], epoch, 60)
+        assert Cache.get('response:/a') is None
+        assert Cache.get('response:/c') is not None
+        assert Cache.get('unrelated:0') == 0
+        Cache.clear()
+
+    def test_invalidation_from_another_worker(self, client, sample_market, monkeypatch):
+        """Test an invalidation recorded by another worker drops this worker's cached response"""
+        from config import CacheConfig
+        from database import CacheInvalidation
+        
+        with app.app_context():
+            market_id = sample_market.id
+            assert json.loads(client.get('/api/markets').data)['markets'][0]['total_pool'] == 0
+            
+            # Another worker records a bet and invalidates its own cache
+            MarketEvent.query.filter_by(id=market_id).update({'total_pool': 10.0})
+            db.session.add(CacheInvalidation(tag='markets'))
+            db.session.commit()
+            assert json.loads(client.get('/api/markets').data)['markets'][0]['total_pool'] == 0
+            
+            monkeypatch.setattr(CacheConfig, 'INVALIDATION_POLL_SECONDS', 0)
+            markets = json.loads(client.get('/api/markets').data)['markets']
+            assert markets[0]['id'] == market_id
+            assert markets[0]['total_pool'] == 10.0
+
+    def test_get_market_odds(self, client, sample_market, sample_user):
+        """Test implied odds follow the pool split"""
+        with app.app_context():
+            market_id = sample_market.id
+            for prediction, amount in [('over', 10.0), ('over', 20.0), ('under', 10.0)]:
+                client.post('/api/bets/place', json={
+                    'market_id': market_id,
+                    'user_fid': sample_user.fid,
+                    'prediction': prediction,
+                    'amount': amount,
+                    'user_wallet': sample_user.wallet_address
+                })
+            confirm_payments()
+            
+            response = client.get(f'/api/markets/{market_id}/odds')
+            assert response.status_code == 200
+            odds = json.loads(response.data)['odds']
+            assert odds['over']['implied_probability'] == 0.75
+            assert odds['under']['implied_probability'] == 0.25
+            # Winners split 70% of the pool equally, whatever their stake
+            assert (odds['over']['bets'], odds['under']['bets']) == (2, 1)
+            assert odds['over']['share_per_winner'] == pytest.approx(0.7 * 40.0 / 2)
+            assert odds['under']['share_per_winner'] == pytest.approx(0.7 * 40.0)
+            
+            import project
+            assert project.calculate_payout(20.0, 40.0, 2) == pytest.approx(20.0 + odds['over']['share_per_winner'])
+    
     def test_create_market(self, client, sample_user):
         """Test creating a new market"""
         with app.app_context():
@@ -117,6 +271,65 @@ class TestMarkets:
             assert response.status_code in [201, 400]
 
 
+class TestMarketStream:
+    """Market event stream tests"""
+    
+    def test_stream_receives_pool_update(self, client, sample_market, sample_user):
+        """Test a bet is pushed to stream subscribers of its market"""
+        with app.app_context():
+            market_id = sample_market.id
+            response = client.get(f'/api/markets/stream?market_ids={market_id}', buffered=False)
+            events = iter(response.response)
+            assert next(events).startswith(b'retry:')
+            
+            client.post('/api/bets/place', json={
+                'market_id': market_id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            })
+            confirm_payments()
+            
+            event = next(events)
+            assert b'event: pool_updated' in event
+            assert b'"total_pool": 10.0' in event
+            response.close()
+    
+    def test_stream_receives_events_from_other_workers(self, client, sample_market, monkeypatch):
+        """Test an event published by another process reaches this process's streams, up to the stream limit"""
+        import project
+        from events import MarketEventBus
+        
+        with app.app_context():
+            market_id = sample_market.id
+            response = client.get(f'/api/markets/stream?market_ids={market_id}', buffered=False)
+            events = iter(response.response)
+            assert next(events).startswith(b'retry:')
+            
+            # The scheduler's process has no subscribers of its own
+            MarketEventBus().publish('status_changed', market_id, {'status': 'closed'})
+            event = next(events)
+            assert b'event: status_changed' in event
+            assert b'"status": "closed"' in event
+            
+            monkeypatch.setattr(project.market_event_bus, 'max_subscribers', 1)
+            assert client.get('/api/markets/stream').status_code == 503
+            response.close()
+    
+    def test_slow_subscriber_is_dropped(self):
+        """Test a full subscriber queue drops the subscriber instead of blocking"""
+        from events import MarketEventBus
+        
+        bus = MarketEventBus()
+        subscription = bus.subscribe([1])
+        for event_id in range(subscription.queue.maxsize + 1):
+            bus.deliver({'id': event_id, 'type': 'pool_updated', 'market_id': 1, 'data': {}})
+        
+        assert subscription.dropped is True
+        assert bus.subscriber_count() == 0
+
+
 class TestBetting:
     """Betting endpoint tests"""
     
@@ -141,6 +354,27 @@ class TestBetting:
             # In production, mock the blockchain calls
             assert response.status_code in [201, 400]
     
+    def test_place_bet_updates_market_counters(self, client, sample_market, sample_user):
+        """Test bet placement maintains pool totals and bet count"""
+        with app.app_context():
+            market_id = sample_market.id
+            for prediction, amount in [('over', 10.0), ('under', 4.0)]:
+                response = client.post('/api/bets/place', json={
+                    'market_id': market_id,
+                    'user_fid': sample_user.fid,
+                    'prediction': prediction,
+                    'amount': amount,
+                    'user_wallet': sample_user.wallet_address
+                })
+                assert response.status_code == 201
+            assert confirm_payments() == 2
+            
+            market = db.session.get(MarketEvent, market_id)
+            assert market.bets_count == 2
+            assert market.total_pool == 14.0
+            assert market.over_pool == 10.0
+            assert market.under_pool == 4.0
+    
     def test_place_bet_invalid_prediction(self, client, sample_market, sample_user):
         """Test placing bet with invalid prediction"""
         with app.app_context():
@@ -188,6 +422,431 @@ class TestBetting:
             assert 'bets' in data
 
 
+class TestPaymentPipeline:
+    """Asynchronous bet payment tests"""
+    
+    def test_bet_pending_until_payment_confirmed(self, client, sample_market, sample_user):
+        """Test a bet is acknowledged pending and activated by the pipeline"""
+        from database import Transaction
+        
+        with app.app_context():
+            market_id = sample_market.id
+            response = client.post('/api/bets/place', json={
+                'market_id': market_id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            })
+            assert response.status_code == 201
+            data = json.loads(response.data)
+            assert data['status'] == 'pending'
+            
+            status = client.get(data['status_url'])
+            assert json.loads(status.data)['status'] == 'pending'
+            assert status.headers['Retry-After']
+            assert db.session.get(MarketEvent, market_id).total_pool == 0
+            
+            assert confirm_payments() == 1
+            assert confirm_payments() == 0
+            
+            status = json.loads(client.get(data['status_url']).data)
+            assert status['status'] == 'active'
+            assert status['confirmed'] is True
+            assert status['transaction_hash']
+            assert db.session.get(MarketEvent, market_id).total_pool == 10.0
+            assert Transaction.query.filter_by(idempotency_key=f"bet:{data['bet_id']}:base_fee").count() == 1
+    
+    def test_failed_payment_fails_bet(self, client, sample_market, sample_user, monkeypatch):
+        """Test a rejected payment fails the bet without touching the pool"""
+        import project
+        
+        monkeypatch.setattr(project.tx_handler, 'get_transaction_status',
+                            lambda tx_hash: {'tx_hash': tx_hash, 'status': 'failed'})
+        with app.app_context():
+            market_id = sample_market.id
+            bet_id = json.loads(client.post('/api/bets/place', json={
+                'market_id': market_id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            }).data)['bet_id']
+            
+            assert confirm_payments() == 0
+            status = json.loads(client.get(f'/api/bets/{bet_id}/status').data)
+            assert status['status'] == 'failed'
+            assert status['failure_reason']
+            assert db.session.get(MarketEvent, market_id).bets_count == 0
+    
+    def test_settlement_waits_for_unconfirmed_bets(self, client, sample_market, sample_user, monkeypatch):
+        """Test a market with bets awaiting payment cannot be settled yet"""
+        import project
+        
+        monkeypatch.setattr(project, 'fetch_user_metrics', lambda *args, **kwargs: 10)
+        with app.app_context():
+            market_id = sample_market.id
+            client.post('/api/bets/place', json={
+                'market_id': market_id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            })
+            
+            response = client.post(f'/api/markets/{market_id}/settle')
+            assert response.status_code == 400
+            # A preview writes nothing, so it does not wait for payments
+            response = client.post(f'/api/markets/{market_id}/settle?dry_run=1')
+            assert response.status_code == 200
+            assert json.loads(response.data)['winners_count'] == 0
+            
+            confirm_payments()
+            response = client.post(f'/api/markets/{market_id}/settle')
+            assert response.status_code == 200
+            assert json.loads(response.data)['winners_count'] == 1
+    
+    def test_settlement_repolls_inline_payments(self, client, sample_market, sample_user, monkeypatch):
+        """Test without the pipeline a bet left confirming by its request is re-polled at settlement"""
+        import project
+        from config import FeatureFlags
+        
+        chain_status = ['pending']
+        monkeypatch.setattr(FeatureFlags, 'ENABLE_PAYMENT_PIPELINE', False)
+        monkeypatch.setattr(project.tx_handler, 'get_transaction_status',
+                            lambda tx_hash: {'tx_hash': tx_hash, 'status': chain_status[0]})
+        monkeypatch.setattr(project, 'fetch_user_metrics', lambda *args, **kwargs: 10)
+        with app.app_context():
+            market_id = sample_market.id
+            response = client.post('/api/bets/place', json={
+                'market_id': market_id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            })
+            assert json.loads(response.data)['status'] == 'confirming'
+            assert client.post(f'/api/markets/{market_id}/settle').status_code == 400
+            
+            chain_status[0] = 'confirmed'
+            response = client.post(f'/api/markets/{market_id}/settle')
+            assert response.status_code == 200
+            assert json.loads(response.data)['winners_count'] == 1
+            assert db.session.get(MarketEvent, market_id).total_pool == 10.0
+    
+    def test_bet_on_settling_market_is_refunded(self, client, sample_market, sample_user):
+        """Test a paid bet whose market began settling is refunded, then failed"""
+        from database import Transaction
+        
+        with app.app_context():
+            market_id = sample_market.id
+            bet_id = json.loads(client.post('/api/bets/place', json={
+                'market_id': market_id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            }).data)['bet_id']
+            MarketEvent.query.filter_by(id=market_id).update({'status': 'settling', 'result_value': 3})
+            db.session.commit()
+            
+            assert confirm_payments() == 0
+            status = json.loads(client.get(f'/api/bets/{bet_id}/status').data)
+            assert status['status'] == 'failed'
+            assert 'refunded' in status['failure_reason']
+            refund = Transaction.query.filter_by(idempotency_key=f'bet:{bet_id}:refund').one()
+            assert (refund.to_address, refund.amount) == (sample_user.wallet_address, 10.0)
+            assert db.session.get(MarketEvent, market_id).bets_count == 0
+    
+    def test_bets_activate_inline_without_pipeline(self, client, sample_market, sample_user, monkeypatch):
+        """Test bets are paid for on the request thread when the pipeline is disabled"""
+        from config import FeatureFlags
+        
+        monkeypatch.setattr(FeatureFlags, 'ENABLE_PAYMENT_PIPELINE', False)
+        with app.app_context():
+            market_id = sample_market.id
+            response = client.post('/api/bets/place', json={
+                'market_id': market_id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            })
+            assert response.status_code == 201
+            assert json.loads(response.data)['status'] == 'active'
+            assert db.session.get(MarketEvent, market_id).total_pool == 10.0
+            assert confirm_payments() == 0
+
+
+class TestBatchBetting:
+    """Batch bet placement tests"""
+    
+    def test_batch_bets_single_commit_and_fee_transfer(self, client, sample_market, sample_user, monkeypatch):
+        """Test a batch accepts valid bets, rejects bad ones and sends one base fee transfer"""
+        import project
+        
+        transfers = []
+        monkeypatch.setattr(project.tx_handler, 'send_transaction', lambda **kwargs: transfers.append(kwargs) or {
+            'success': True, 'hash': f"0x{len(transfers)}", 'error': None
+        })
+        with app.app_context():
+            market_id = sample_market.id
+            bet = {'market_id': market_id, 'user_fid': sample_user.fid, 'user_wallet': sample_user.wallet_address}
+            response = client.post('/api/bets/batch', json={'bets': [
+                dict(bet, prediction='over', amount=10.0),
+                dict(bet, market_id=str(market_id), prediction='under', amount=5.0),
+                dict(bet, prediction='sideways', amount=5.0),
+                dict(bet, market_id=9999, prediction='over', amount=5.0),
+                {'market_id': market_id},
+                dict(bet, market_id=[market_id], prediction='over', amount=5.0),
+                dict(bet, market_id='abc', prediction='over', amount=5.0)
+            ]})
+            assert response.status_code == 201
+            data = json.loads(response.data)
+            assert data['accepted_count'] == 2
+            assert [result['success'] for result in data['results']] == [True, True, False, False, False, False, False]
+            assert [result['index'] for result in data['results']] == list(range(7))
+            assert data['results'][3]['error'] == 'Market not found'
+            assert data['results'][5]['error'] == data['results'][6]['error'] == 'market_id must be an integer'
+            
+            assert confirm_payments() == 2
+            market = db.session.get(MarketEvent, market_id)
+            assert market.bets_count == 2
+            assert market.total_pool == 15.0
+            
+            fee_transfers = [t for t in transfers if t['tx_type'] == 'base_fee']
+            assert len(fee_transfers) == 1
+            assert fee_transfers[0]['amount'] == pytest.approx(0.4)
+    
+    def test_batch_bets_size_limit(self, client, sample_market, sample_user):
+        """Test oversized batches are rejected"""
+        from config import BettingConfig
+        
+        bet = {
+            'market_id': sample_market.id,
+            'user_fid': sample_user.fid,
+            'prediction': 'over',
+            'amount': 1.0,
+            'user_wallet': sample_user.wallet_address
+        }
+        response = client.post('/api/bets/batch', json={'bets': [bet] * (BettingConfig.MAX_BATCH_BETS + 1)})
+        assert response.status_code == 400
+
+
+class TestIdempotency:
+    """Idempotency-Key handling tests"""
+    
+    def test_retried_bet_returns_original_response(self, client, sample_market, sample_user):
+        """Test a retry with the same key replays the response without a second bet"""
+        with app.app_context():
+            payload = {
+                'market_id': sample_market.id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            }
+            headers = {'Idempotency-Key': 'bet-retry-1'}
+            
+            first = client.post('/api/bets/place', json=payload, headers=headers)
+            assert first.status_code == 201
+            
+            idempotency_store.clear()  # a retry landing on another worker reads the table
+            for _ in range(2):
+                retry = client.post('/api/bets/place', json=payload, headers=headers)
+                assert retry.status_code == 201
+                assert retry.headers['Idempotent-Replayed'] == 'true'
+                assert json.loads(retry.data)['bet_id'] == json.loads(first.data)['bet_id']
+            
+            assert Bet.query.count() == 1
+    
+    def test_key_reused_with_different_request(self, client, sample_market, sample_user):
+        """Test a key cannot be replayed for a different request body"""
+        with app.app_context():
+            payload = {
+                'market_id': sample_market.id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            }
+            headers = {'Idempotency-Key': 'bet-retry-2'}
+            
+            assert client.post('/api/bets/place', json=payload, headers=headers).status_code == 201
+            response = client.post('/api/bets/place', json=dict(payload, amount=20.0), headers=headers)
+            assert response.status_code == 422
+            assert Bet.query.count() == 1
+
+
+class TestGroupCommit:
+    """Group commit write path tests"""
+    
+    def test_concurrent_writes_share_commits(self, client, sample_user):
+        """Test concurrent writes are committed in groups with per-caller results"""
+        import threading
+        from sqlalchemy.exc import IntegrityError
+        from config import GroupCommitConfig
+        from group_commit import GroupCommitter
+        
+        class EnabledConfig(GroupCommitConfig):
+            ENABLED = True
+            MAX_WAIT_MS = 100
+        
+        committer = GroupCommitter(app, EnabledConfig)
+        outcomes = {}
+        
+        def add_user(fid):
+            def work():
+                db.session.add(UserProfile(fid=fid, username=f'user{fid}'))
+                db.session.flush()
+                return fid
+            try:
+                outcomes[fid] = committer.run(work)
+            except IntegrityError as e:
+                outcomes[fid] = e
+        
+        # fid 1 is sample_user, so that write alone must fail
+        threads = [threading.Thread(target=add_user, args=(fid,)) for fid in range(1, 11)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert isinstance(outcomes[1], IntegrityError)
+        assert all(outcomes[fid] == fid for fid in range(2, 11))
+        assert committer.commits < 9
+        with app.app_context():
+            assert UserProfile.query.count() == 10
+
+
+class TestSQLiteProfile:
+    """SQLite production profile tests"""
+    
+    def test_production_pragmas_applied_per_connection(self, tmp_path):
+        """Test every pooled connection gets WAL, busy timeout and cache settings"""
+        from sqlalchemy import create_engine, event
+        from config import SQLiteConfig
+        from database import apply_sqlite_pragmas
+        
+        engine = create_engine(f"sqlite:///{tmp_path / 'profile.db'}")
+        event.listen(engine, 'connect', apply_sqlite_pragmas)
+        with engine.connect() as connection:
+            pragma = lambda name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+            assert pragma('journal_mode') == 'wal'
+            assert pragma('busy_timeout') == SQLiteConfig.BUSY_TIMEOUT_MS
+            assert pragma('synchronous') == 1
+            assert pragma('cache_size') == -SQLiteConfig.CACHE_SIZE_KB
+        engine.dispose()
+
+
+class TestDatabaseConfig:
+    """Database URL and pool configuration tests"""
+    
+    def test_engine_options_per_database(self):
+        """Test pool settings apply to server databases but not in-memory SQLite"""
+        from config import ProductionConfig
+        from database import engine_options
+        
+        options = engine_options('postgresql://user:pass@db:5432/prediction_market', ProductionConfig)
+        assert options['pool_size'] == ProductionConfig.DB_POOL_SIZE
+        assert options['pool_pre_ping'] is True
+        assert options['connect_args'] == {'options': f"-c statement_timeout={ProductionConfig.DB_STATEMENT_TIMEOUT_MS}"}
+        
+        assert engine_options('sqlite:///:memory:', ProductionConfig) == {}
+        assert 'connect_args' not in engine_options('sqlite:////tmp/markets.db', ProductionConfig)
+
+    def test_upgrade_adds_and_backfills_pool_counters(self, client, sample_market, sample_user):
+        """Test counters missing from an older market_events table are added and computed from bets"""
+        from database import upgrade_schema
+
+        market_id = sample_market.id
+        for prediction, amount, status in [('over', 10.0, 'active'), ('under', 5.0, 'won'), ('over', 100.0, 'pending')]:
+            db.session.add(Bet(
+                market_id=market_id,
+                user_fid=sample_user.fid,
+                user_wallet=sample_user.wallet_address,
+                prediction=prediction,
+                amount=amount,
+                status=status
+            ))
+        db.session.commit()
+        for column in MarketEvent.POOL_COUNTERS:
+            db.session.execute(db.text(f"ALTER TABLE market_events DROP COLUMN {column}"))
+        db.session.commit()
+
+        added = upgrade_schema()
+
+        assert added == {('market_events', column) for column in MarketEvent.POOL_COUNTERS}
+        db.session.expire_all()
+        market = db.session.get(MarketEvent, market_id)
+        assert (market.bets_count, market.total_pool, market.over_pool, market.under_pool) == (2, 15.0, 10.0, 5.0)
+        assert (market.over_bets, market.under_bets) == (1, 1)
+        assert upgrade_schema() == set()
+
+        with pytest.raises(ValueError):
+            market.record_bet('sideways', 1.0)
+
+    def test_upgrade_makes_transaction_hash_nullable(self, client):
+        """Test an older transactions table with NOT NULL tx_hash is rebuilt so intents can be recorded"""
+        import project
+        from database import Transaction, upgrade_schema
+
+        db.session.execute(db.text("DROP TABLE transactions"))
+        db.session.execute(db.text(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY, tx_hash VARCHAR(255) NOT NULL UNIQUE, "
+            "from_address VARCHAR(255) NOT NULL, to_address VARCHAR(255) NOT NULL, amount FLOAT NOT NULL, "
+            "tx_type VARCHAR(50) NOT NULL, related_id INTEGER, status VARCHAR(20), created_at DATETIME, "
+            "confirmed_at DATETIME, error_message TEXT)"
+        ))
+        db.session.execute(db.text(
+            "INSERT INTO transactions (tx_hash, from_address, to_address, amount, tx_type, status) "
+            "VALUES ('0xold', '0xa', '0xb', 1.0, 'payout', 'confirmed')"
+        ))
+        db.session.commit()
+
+        assert ('transactions', 'idempotency_key') in upgrade_schema()
+        assert db.inspect(db.engine).get_columns('transactions')[1]['nullable'] is True
+        assert Transaction.query.filter_by(tx_hash='0xold').one().amount == 1.0
+
+        result = project.tx_handler.send_transaction_once('upgrade:1', '0x' + '1' * 40, 2.0)
+        assert Transaction.query.filter_by(idempotency_key='upgrade:1').one().tx_hash == result['hash']
+        assert upgrade_schema() == set()
+
+
+class TestReadReplica:
+    """Read replica routing tests"""
+    
+    def test_gets_read_replica_until_client_writes(self, client, sample_user, sample_market, tmp_path):
+        """Test GETs read the replica and a client's reads stay on the primary after it writes"""
+        from sqlalchemy import create_engine
+        
+        replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+        db.metadata.create_all(replica)
+        with replica.begin() as conn:
+            conn.execute(UserProfile.__table__.insert(), {'fid': 2, 'username': 'replica-only'})
+        bet = {
+            'market_id': sample_market.id,
+            'user_fid': sample_user.fid,
+            'prediction': 'over',
+            'amount': 10.0,
+            'user_wallet': sample_user.wallet_address
+        }
+        db.session.expunge_all()
+        db.engines['replica'] = replica
+        try:
+            assert client.get('/api/users/2').status_code == 200
+            # Missing on the replica, so rechecked on the primary before creating it
+            assert client.get('/api/users/1').status_code == 200
+            
+            response = client.post('/api/bets/place', json=bet)
+            assert response.status_code == 201
+            assert 'fpm_recent_write=' in response.headers['Set-Cookie']
+            assert len(json.loads(client.get('/api/bets/user/1').data)['bets']) == 1
+        finally:
+            del db.engines['replica']
+            replica.dispose()
+
+
 class TestUserProfile:
     """User profile endpoint tests"""
     
@@ -201,12 +860,362 @@ class TestUserProfile:
             assert data['user']['fid'] == sample_user.fid
             assert 'stats' in data['user']
     
+    def test_profile_stats_single_query_and_cached(self, client, sample_user, sample_market):
+        """Test profile stats come from one query, are cached, and refresh on the user's writes"""
+        from sqlalchemy import event
+        from farcaster_frame import profile_frame
+        
+        with app.app_context():
+            fid, market_id = sample_user.fid, sample_market.id
+            for status, amount, payout in [('won', 10.0, 15.0), ('lost', 5.0, None), ('failed', 50.0, None)]:
+                db.session.add(Bet(market_id=market_id, user_fid=fid, user_wallet='0x1',
+                                   prediction='over', amount=amount, payout=payout, status=status))
+            db.session.commit()
+            
+            statements = []
+            # Cross-worker cache invalidation polls are not part of the profile read
+            listener = lambda *args: 'cache_invalidations' in args[2] or statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                stats = json.loads(client.get(f'/api/users/{fid}').data)['user']['stats']
+                with app.test_request_context(method='POST', json={'interactor': {'fid': fid}}):
+                    frame = profile_frame()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            
+            assert len(statements) == 1
+            assert stats == {'total_bets': 2, 'won_bets': 1, 'win_rate': 50.0,
+                             'total_wagered': 15.0, 'total_winnings': 15.0, 'balance': 0.0}
+            assert 'Total Bets: 2' in json.loads(frame.data)['frames'][0]['description']
+            
+            client.post('/api/bets/place', json={
+                'market_id': market_id, 'user_fid': fid, 'prediction': 'over',
+                'amount': 1.0, 'user_wallet': '0x1'
+            })
+            stats = json.loads(client.get(f'/api/users/{fid}').data)['user']['stats']
+            assert stats['total_bets'] == 3
+    
+    def test_profile_created_concurrently_is_not_duplicated(self, client, monkeypatch):
+        """Test a profile inserted by another request during the Farcaster lookup is reused"""
+        import project
+        
+        def fetch_during_race(fid):
+            db.session.add(UserProfile(fid=fid, username='first'))
+            db.session.commit()
+            return {'username': 'second'}
+        
+        monkeypatch.setattr(project, 'fetch_farcaster_user', fetch_during_race)
+        with app.app_context():
+            response = client.get('/api/users/4242')
+            assert response.status_code == 200
+            assert json.loads(response.data)['user']['username'] == 'first'
+            assert UserProfile.query.filter_by(fid=4242).count() == 1
+    
     def test_get_nonexistent_user(self, client):
         """Test getting non-existent user"""
         response = client.get('/api/users/99999')
         assert response.status_code == 404
 
 
+class TestSettlement:
+    """Market settlement tests"""
+    
+    def test_settle_market_bulk_payouts_single_fee_sweep(self, client, sample_user, monkeypatch):
+        """Test payouts match the payout rules and win fees go out as one transfer"""
+        import project
+        
+        transfers = []
+        
+        def fake_send(**kwargs):
+            transfers.append(kwargs)
+            return {'success': True, 'hash': f'0x{len(transfers)}', 'error': None}
+        
+        monkeypatch.setattr(project, 'fetch_user_metrics', lambda *args, **kwargs: 3)
+        monkeypatch.setattr(project.tx_handler, 'send_transaction', fake_send)
+        
+        with app.app_context():
+            market = MarketEvent(
+                user_fid=sample_user.fid,
+                market_type='casts_count',
+                threshold=5,
+                direction='under',
+                end_time=datetime.utcnow() + timedelta(hours=1),
+                status='active'
+            )
+            db.session.add(market)
+            db.session.commit()
+            
+            for prediction, amount in [('under', 10.0), ('under', 30.0), ('over', 60.0)]:
+                db.session.add(Bet(
+                    market_id=market.id,
+                    user_fid=sample_user.fid,
+                    user_wallet=sample_user.wallet_address,
+                    prediction=prediction,
+                    amount=amount,
+                    status='active'
+                ))
+                market.record_bet(prediction, amount)
+            db.session.commit()
+            
+            response = client.post(f'/api/markets/{market.id}/settle')
+            data = json.loads(response.data)
+            assert data['winners_count'] == 2
+            assert data['losers_count'] == 1
+            
+            winners = Bet.query.filter_by(market_id=market.id, status='won').order_by(Bet.amount).all()
+            expected = [project.calculate_payout(bet.amount, 100.0, 2) for bet in winners]
+            assert [bet.payout for bet in winners] == pytest.approx([p * 0.985 for p in expected])
+            assert len(transfers) == 1
+            assert transfers[0]['amount'] == pytest.approx(sum(expected) * 0.015)
+
+
+    def test_odds_match_payouts_on_over_market(self, client, sample_user, monkeypatch):
+        """Test an 'over' market pays only 'over' bets, exactly as its odds projected"""
+        import project
+        
+        monkeypatch.setattr(project, 'fetch_user_metrics', lambda *args, **kwargs: 9)
+        monkeypatch.setattr(project.tx_handler, 'send_transaction',
+                            lambda **kwargs: {'success': True, 'hash': '0xfee', 'error': None})
+        
+        with app.app_context():
+            market = MarketEvent(
+                user_fid=sample_user.fid,
+                market_type='casts_count',
+                threshold=5,
+                direction='over',
+                end_time=datetime.utcnow() + timedelta(hours=1),
+                status='active'
+            )
+            db.session.add(market)
+            db.session.commit()
+            market_id = market.id
+            
+            for prediction, amount in [('over', 10.0), ('over', 20.0), ('under', 30.0)]:
+                db.session.add(Bet(market_id=market_id, user_fid=sample_user.fid, user_wallet='0x1',
+                                   prediction=prediction, amount=amount, status='active'))
+                market.record_bet(prediction, amount)
+            db.session.commit()
+            
+            odds = json.loads(client.get(f'/api/markets/{market_id}/odds').data)['odds']
+            client.post(f'/api/markets/{market_id}/settle')
+            
+            bets = Bet.query.filter_by(market_id=market_id).order_by(Bet.amount).all()
+            assert [(bet.prediction, bet.status) for bet in bets] == [('over', 'won'), ('over', 'won'), ('under', 'lost')]
+            assert [project.determine_winner(bet.prediction, 9, 5, 'over') for bet in bets] == [True, True, False]
+            share = odds['over']['share_per_winner']
+            assert [bet.payout for bet in bets[:2]] == pytest.approx([(bet.amount + share) * 0.985 for bet in bets[:2]])
+
+    def test_settlement_resumes_from_checkpoint(self, client, sample_user, monkeypatch):
+        """Test an interrupted settlement resumes without refetching or resending"""
+        import project
+        from database import Transaction
+        
+        def fail_fetch(*args, **kwargs):
+            raise AssertionError('metric should not be refetched')
+        
+        monkeypatch.setattr(project, 'fetch_user_metrics', fail_fetch)
+        
+        with app.app_context():
+            market = MarketEvent(
+                user_fid=sample_user.fid,
+                market_type='casts_count',
+                threshold=5,
+                direction='under',
+                end_time=datetime.utcnow() - timedelta(minutes=1),
+                status='settling',
+                result_value=3
+            )
+            db.session.add(market)
+            db.session.commit()
+            db.session.add(Bet(
+                market_id=market.id,
+                user_fid=sample_user.fid,
+                user_wallet=sample_user.wallet_address,
+                prediction='under',
+                amount=10.0,
+                status='active'
+            ))
+            market.record_bet('under', 10.0)
+            db.session.commit()
+            
+            first = json.loads(client.post(f'/api/markets/{market.id}/settle').data)
+            second = json.loads(client.post(f'/api/markets/{market.id}/settle').data)
+            
+            assert first['status'] == 'settled'
+            assert second == first
+            assert first['winners_count'] == 1
+            assert Transaction.query.filter_by(idempotency_key=f'market:{market.id}:win_fees').count() == 1
+    
+    def test_settle_dry_run_writes_nothing(self, client, sample_market, sample_user, monkeypatch):
+        """Test a dry run reports the outcome without settling or sending"""
+        import project
+        
+        monkeypatch.setattr(project.tx_handler, 'send_transaction', None)
+        
+        with app.app_context():
+            market_id = sample_market.id
+            db.session.add(Bet(
+                market_id=market_id,
+                user_fid=sample_user.fid,
+                user_wallet=sample_user.wallet_address,
+                prediction='over',
+                amount=20.0,
+                status='active'
+            ))
+            sample_market.record_bet('over', 20.0)
+            db.session.commit()
+            
+            for invalid in ('lots', [9], 'nan'):
+                response = client.post(f'/api/markets/{market_id}/settle?dry_run=1', json={'result_value': invalid})
+                assert response.status_code == 400
+            
+            response = client.post(f'/api/markets/{market_id}/settle?dry_run=1', json={'result_value': 9})
+            data = json.loads(response.data)
+            assert data['dry_run'] is True
+            assert data['winners_count'] == 1
+            assert data['treasury_sweep'] == pytest.approx((20.0 + 14.0) * 0.015)
+            # The lone winner is owed more than the pool holds
+            assert data['house_take'] == 0
+            assert data['shortfall'] == pytest.approx(14.0)
+            
+            assert db.session.get(MarketEvent, market_id).status == 'active'
+            assert Bet.query.filter_by(market_id=market_id, status='active').count() == 1
+    
+    def test_settle_batch_fetches_each_metric_once(self, client, sample_user, monkeypatch):
+        """Test markets sharing a metric are resolved from a single fetch"""
+        import project
+        
+        fetches = []
+        
+        def fake_fetch(fid, metric_type, window=None):
+            fetches.append((fid, metric_type, window))
+            return 10
+        
+        monkeypatch.setattr(project, 'fetch_user_metrics', fake_fetch)
+        
+        with app.app_context():
+            ended = datetime.utcnow() - timedelta(minutes=1)
+            for market_type, end_time in [('casts_count', ended), ('casts_count', ended), ('casts_count', ended),
+                                          ('likes_total', ended), ('casts_count', ended - timedelta(hours=1))]:
+                db.session.add(MarketEvent(
+                    user_fid=sample_user.fid,
+                    market_type=market_type,
+                    threshold=5,
+                    end_time=end_time,
+                    status='active'
+                ))
+            db.session.commit()
+            
+            response = client.post('/api/markets/settle-batch', json={})
+            data = json.loads(response.data)
+            assert data['settled_count'] == 5
+            assert data['metrics_fetched'] == 3
+            # casts_count is measured over the day before each market's own end time
+            assert sorted(fetches, key=str) == sorted([
+                (1, 'casts_count', (ended - timedelta(hours=24), ended)),
+                (1, 'casts_count', (ended - timedelta(hours=25), ended - timedelta(hours=1))),
+                (1, 'likes_total', None)
+            ], key=str)
+
+
+class TestAutoSettlement:
+    """Expiry-driven settlement tests"""
+    
+    def test_place_bet_after_end_time_rejected(self, client, sample_user):
+        """Test bets are refused once a market has ended"""
+        with app.app_context():
+            market = MarketEvent(
+                user_fid=sample_user.fid,
+                market_type='casts_count',
+                threshold=5,
+                end_time=datetime.utcnow() - timedelta(minutes=1),
+                status='active'
+            )
+            db.session.add(market)
+            db.session.commit()
+            
+            response = client.post('/api/bets/place', json={
+                'market_id': market.id,
+                'user_fid': sample_user.fid,
+                'prediction': 'over',
+                'amount': 10.0,
+                'user_wallet': sample_user.wallet_address
+            })
+            assert response.status_code == 400
+    
+    def test_scheduler_settles_expired_markets(self, client, sample_user, monkeypatch):
+        """Test only the lease holder settles expired markets, in batches"""
+        import project
+        from config import SchedulerConfig
+        from scheduler import SettlementScheduler
+        
+        class SmallBatchConfig(SchedulerConfig):
+            BATCH_SIZE = 2
+        
+        monkeypatch.setattr(project, 'fetch_user_metrics', lambda *args, **kwargs: 10)
+        
+        with app.app_context():
+            now = datetime.utcnow()
+            for minutes in range(3):
+                db.session.add(MarketEvent(
+                    user_fid=sample_user.fid,
+                    market_type='casts_count',
+                    threshold=5,
+                    end_time=now - timedelta(minutes=minutes + 1),
+                    status='active'
+                ))
+            db.session.commit()
+            
+            leader = SettlementScheduler(app, config=SmallBatchConfig)
+            follower = SettlementScheduler(app)
+            
+            assert leader.run_once(now) == 2
+            assert follower.run_once(now) == 0
+            assert leader.run_once(now) == 1
+            assert MarketEvent.query.filter_by(status='settled').count() == 3
+    
+    def test_scheduler_backs_off_when_metric_unavailable(self, client, sample_user, monkeypatch):
+        """Test a failed metric fetch leaves the market closed and retries it later"""
+        import project
+        from config import SchedulerConfig
+        from scheduler import SettlementScheduler
+        
+        fetches = []
+        
+        def flaky_fetch(*args, **kwargs):
+            fetches.append(args)
+            if len(fetches) == 1:
+                raise ConnectionError('hub unreachable')
+            return 10
+        
+        monkeypatch.setattr(project, 'fetch_user_metrics', flaky_fetch)
+        
+        with app.app_context():
+            now = datetime.utcnow()
+            market = MarketEvent(
+                user_fid=sample_user.fid,
+                market_type='casts_count',
+                threshold=5,
+                end_time=now - timedelta(minutes=1),
+                status='active'
+            )
+            db.session.add(market)
+            db.session.commit()
+            market_id = market.id
+            
+            scheduler = SettlementScheduler(app)
+            assert scheduler.run_once(now) == 0
+            assert db.session.get(MarketEvent, market_id).status == 'closed'
+            assert db.session.get(MarketEvent, market_id).result_value is None
+            
+            # Not retried on the next tick, only once the backoff has elapsed
+            assert scheduler.run_once(now + timedelta(seconds=1)) == 0
+            assert len(fetches) == 1
+            retry_at = now + timedelta(seconds=SchedulerConfig.RETRY_BASE_SECONDS)
+            assert scheduler.run_once(retry_at) == 1
+            assert db.session.get(MarketEvent, market_id).status == 'settled'
+
+
 class TestWithdrawals:
     """Withdrawal endpoint tests"""
     
@@ -246,6 +1255,449 @@ class TestWithdrawals:
             assert response.status_code == 400
 
 
+class TestBalanceLedger:
+    """User balance ledger tests"""
+    
+    def test_ledger_follows_settlement_and_withdrawals(self, client, sample_user, monkeypatch):
+        """Test payouts credit, withdrawals hold then debit, and reconcile repairs drift"""
+        import project
+        from database import UserBalance
+        from ledger import reconcile_balances
+        
+        monkeypatch.setattr(project, 'fetch_user_metrics', lambda *args, **kwargs: 3)
+        monkeypatch.setattr(project.tx_handler, 'send_transaction',
+                            lambda **kwargs: {'success': True, 'hash': f"0x{kwargs['idempotency_key']}", 'error': None})
+        
+        with app.app_context():
+            fid, wallet = sample_user.fid, sample_user.wallet_address
+            market = MarketEvent(
+                user_fid=fid,
+                market_type='casts_count',
+                threshold=5,
+                direction='under',
+                end_time=datetime.utcnow() + timedelta(hours=1),
+                status='active'
+            )
+            db.session.add(market)
+            db.session.commit()
+            db.session.add(Bet(market_id=market.id, user_fid=fid, user_wallet=wallet,
+                               prediction='under', amount=10.0, status='active'))
+            market.record_bet('under', 10.0)
+            db.session.commit()
+            client.post(f'/api/markets/{market.id}/settle')
+            
+            winnings = Bet.query.filter_by(user_fid=fid, status='won').one().payout
+            assert UserBalance.available_for(fid) == pytest.approx(winnings)
+            
+            response = client.post('/api/withdrawals/request', json={
+                'user_fid': fid, 'user_wallet': wallet, 'amount': 5.0
+            })
+            assert response.status_code == 201
+            withdrawal_id = json.loads(response.data)['withdrawal_id']
+            assert UserBalance.available_for(fid) == pytest.approx(winnings - 5.0)
+            
+            # The held amount cannot be requested again
+            response = client.post('/api/withdrawals/request', json={
+                'user_fid': fid, 'user_wallet': wallet, 'amount': winnings
+            })
+            assert response.status_code == 400
+            
+            client.post(f'/api/withdrawals/{withdrawal_id}/process')
+            balance = db.session.get(UserBalance, fid)
+            db.session.refresh(balance)
+            assert (balance.debited, balance.held) == (5.0, 0)
+            assert reconcile_balances() == []
+            
+            UserBalance.query.filter_by(user_fid=fid).update({'credited': 0})
+            db.session.commit()
+            assert [m['column'] for m in reconcile_balances(fix=True)] == ['credited']
+            assert reconcile_balances() == []
+    
+    def test_ledger_backfilled_when_table_created(self, client, sample_user, sample_market):
+        """Test a deployment upgrading to the ledger starts with its past winnings in it"""
+        from database import UserBalance
+        
+        with app.app_context():
+            fid = sample_user.fid
+            for payout in (12.0, 3.5):
+                db.session.add(Bet(market_id=sample_market.id, user_fid=fid, user_wallet='0x1',
+                                   prediction='over', amount=1.0, payout=payout, status='won'))
+            db.session.commit()
+            UserBalance.__table__.drop(db.engine)
+            
+            init_db(app)
+            assert UserBalance.available_for(fid) == 15.5
+            
+            # Only a newly created table is backfilled
+            UserBalance.query.filter_by(user_fid=fid).update({'credited': 0})
+            db.session.commit()
+            init_db(app)
+            assert UserBalance.available_for(fid) == 0
+    
+    def test_hold_never_overdraws(self, client, sample_user):
+        """Test holds are checked against the current row and never overdraw it"""
+        from database import UserBalance
+        
+        with app.app_context():
+            fid = sample_user.fid
+            UserBalance.adjust(fid, credited=10.0)
+            db.session.commit()
+            
+            payload = {'user_fid': fid, 'user_wallet': sample_user.wallet_address, 'amount': 8.0}
+            assert client.post('/api/withdrawals/request', json=payload).status_code == 201
+            
+            assert UserBalance.hold(fid, 8.0) is False
+            assert UserBalance.hold(fid, 2.0) is True
+            db.session.commit()
+            response = client.post('/api/withdrawals/request', json=payload)
+            assert response.status_code == 400
+            assert 'Available: $0.0' in json.loads(response.data)['error']
+    
+    def test_reconcile_command_exits_nonzero_on_drift(self, client, sample_user):
+        """Test the reconcile-balances CLI command reports drift"""
+        from database import UserBalance
+        
+        with app.app_context():
+            UserBalance.adjust(sample_user.fid, credited=12.5)
+            db.session.commit()
+        
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['reconcile-balances'])
+        assert result.exit_code == 1
+        assert 'credited: ledger 12.500000, history 0.000000' in result.output
+        
+        assert runner.invoke(args=['reconcile-balances', '--fix']).exit_code == 0
+        assert 'Ledger matches history' in runner.invoke(args=['reconcile-balances']).output
+
+
+class TestLeaderboard:
+    """Leaderboard endpoint tests"""
+    
+    def test_leaderboard_ranks_from_daily_totals(self, client, sample_user, sample_market, monkeypatch):
+        """Test bets and settlements update the boards, which are served without reading bets"""
+        import project
+        from sqlalchemy import event
+        from config import LeaderboardConfig
+        
+        monkeypatch.setattr(LeaderboardConfig, 'MIN_SETTLED_BETS_FOR_WIN_RATE', 1)
+        monkeypatch.setattr(project, 'fetch_user_metrics', lambda *args, **kwargs: 9)
+        
+        with app.app_context():
+            market_id = sample_market.id
+            db.session.add(UserProfile(fid=2, username='bob', wallet_address='0x2'))
+            db.session.commit()
+            for fid, wallet, prediction, amount in [(1, '0x1', 'over', 10.0), (2, '0x2', 'under', 30.0)]:
+                client.post('/api/bets/place', json={
+                    'market_id': market_id, 'user_fid': fid, 'prediction': prediction,
+                    'amount': amount, 'user_wallet': wallet
+                })
+            confirm_payments()
+            
+            volume = json.loads(client.get('/api/leaderboard?by=volume').data)
+            assert [(e['fid'], e['score']) for e in volume['entries']] == [(2, 30.0), (1, 10.0)]
+            
+            client.post(f'/api/markets/{market_id}/settle')
+            
+            statements = []
+            listener = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                winnings = json.loads(client.get('/api/leaderboard?by=winnings&window=1d').data)
+                win_rate = json.loads(client.get('/api/leaderboard?by=win_rate&limit=1&offset=1').data)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            
+            assert not any('FROM bets' in statement for statement in statements)
+            payouts = [(bet.payout, bet.user_fid) for bet in Bet.query.filter_by(status='won')]
+            assert [bet.user_fid for bet in Bet.query.filter_by(status='won')] == [1]
+            assert [(e['score'], e['fid']) for e in winnings['entries']] == payouts
+            assert [(e['rank'], e['fid'], e['score']) for e in win_rate['entries']] == [(2, 2, 0.0)]
+            assert win_rate['total'] == 2 and win_rate['next_offset'] is None
+    
+    def test_leaderboard_windows_and_validation(self, client, sample_user):
+        """Test older days drop out of short windows and bad parameters are rejected"""
+        from database import LeaderboardBucket
+        
+        with app.app_context():
+            today = datetime.utcnow().date()
+            LeaderboardBucket.add([
+                {'user_fid': sample_user.fid, 'day': today - timedelta(days=10), 'wagered': 50.0,
+                 'bets_count': 2, 'settled_count': 0, 'won_count': 0, 'winnings': 0.0}
+            ])
+            db.session.commit()
+            
+            assert json.loads(client.get('/api/leaderboard?by=volume&window=7d').data)['total'] == 0
+            entries = json.loads(client.get('/api/leaderboard?by=volume&window=30d').data)['entries']
+            assert entries[0]['score'] == 50.0 and entries[0]['bets_count'] == 2
+            
+            assert client.get('/api/leaderboard?by=luck').status_code == 400
+            assert client.get('/api/leaderboard?window=3d').status_code == 400
+
+
+class TestWithdrawalProcessor:
+    """Batched withdrawal processor tests"""
+    
+    def test_batch_coalesces_withdrawals_per_wallet(self, client, sample_user, monkeypatch):
+        """Test a batch sends one transfer per wallet and records every outcome"""
+        import project
+        from database import UserBalance, Withdrawal
+        
+        transfers = []
+        
+        def fake_send(**kwargs):
+            transfers.append(kwargs)
+            if kwargs['to_address'] == '0xbad':
+                return {'success': False, 'hash': None, 'error': 'rejected'}
+            return {'success': True, 'hash': f"0x{kwargs['idempotency_key']}", 'error': None}
+        
+        monkeypatch.setattr(project.tx_handler, 'send_transaction', fake_send)
+        
+        with app.app_context():
+            db.session.add(UserProfile(fid=2, username='bob', wallet_address='0xbad'))
+            for fid in (1, 2):
+                UserBalance.adjust(fid, credited=100.0)
+            db.session.commit()
+            
+            wallet = sample_user.wallet_address
+            for fid, user_wallet, amount in [(1, wallet, 10.0), (1, wallet.lower(), 15.0), (2, '0xbad', 20.0)]:
+                response = client.post('/api/withdrawals/request', json={
+                    'user_fid': fid, 'user_wallet': user_wallet, 'amount': amount
+                })
+                assert response.status_code == 201
+            before = json.loads(client.get('/api/withdrawals/metrics').data)['metrics']
+            assert before['queue_depth'] == 3
+            
+            data = json.loads(client.post('/api/withdrawals/process-batch').data)
+            
+            assert (data['transfers'], data['failed_transfers']) == (2, 1)
+            assert sorted(t['amount'] for t in transfers) == [20.0, 25.0]
+            assert [w.status for w in Withdrawal.query.order_by(Withdrawal.id)] == ['completed', 'completed', 'failed']
+            assert data['metrics']['queue_depth'] == 0
+            assert data['metrics']['withdrawals_paid'] - before['withdrawals_paid'] == 2
+            assert data['metrics']['withdrawals_failed'] - before['withdrawals_failed'] == 1
+            assert UserBalance.available_for(1) == 75.0
+            assert UserBalance.available_for(2) == 100.0
+    
+    def test_stale_claim_resumes_under_same_key(self, client, sample_user, monkeypatch):
+        """Test withdrawals abandoned mid-payment are paid again under their original key"""
+        import project
+        from database import Transaction, UserBalance, Withdrawal
+        
+        keys = []
+        monkeypatch.setattr(project.tx_handler, 'send_transaction', lambda **kwargs: keys.append(
+            kwargs['idempotency_key']) or {'success': True, 'hash': '0xresumed', 'error': None})
+        
+        with app.app_context():
+            UserBalance.adjust(sample_user.fid, credited=50.0, held=30.0)
+            db.session.add(Withdrawal(
+                user_fid=sample_user.fid,
+                user_wallet=sample_user.wallet_address,
+                amount=30.0,
+                status='processing',
+                transfer_key='withdrawals:7',
+                claimed_at=datetime.utcnow() - timedelta(hours=1)
+            ))
+            db.session.commit()
+            
+            client.post('/api/withdrawals/process-batch')
+            
+            assert keys == ['withdrawals:7']
+            assert Withdrawal.query.one().status == 'completed'
+            assert Transaction.query.filter_by(idempotency_key='withdrawals:7').one().tx_hash == '0xresumed'
+            assert UserBalance.available_for(sample_user.fid) == 20.0
+
+
+class TestTransferIntents:
+    """Claim-before-send transfer tests"""
+    
+    def test_claimed_intent_is_not_resent(self, client, sample_user, monkeypatch):
+        """Test an intent another process is sending is left alone until its claim is abandoned"""
+        import project
+        from database import Transaction
+        
+        sent = []
+        monkeypatch.setattr(project.tx_handler, 'send_transaction', lambda **kwargs: sent.append(
+            kwargs['idempotency_key']) or {'success': True, 'hash': '0xsent', 'error': None})
+        
+        with app.app_context():
+            db.session.add(Transaction(
+                idempotency_key='market:9:win_fees',
+                from_address='platform',
+                to_address='0xtreasury',
+                amount=1.5,
+                tx_type='win_fee',
+                status='sending',
+                claimed_at=datetime.utcnow()
+            ))
+            db.session.commit()
+            
+            result = project.tx_handler.send_transaction_once('market:9:win_fees', '0xtreasury', 1.5)
+            assert result['success'] is False and result['in_progress'] is True
+            assert sent == []
+            
+            Transaction.query.filter_by(idempotency_key='market:9:win_fees').update(
+                {'claimed_at': datetime.utcnow() - timedelta(hours=1)})
+            db.session.commit()
+            
+            assert project.tx_handler.send_transaction_once('market:9:win_fees', '0xtreasury', 1.5)['success']
+            assert project.tx_handler.send_transaction_once('market:9:win_fees', '0xtreasury', 1.5)['duplicate']
+            assert sent == ['market:9:win_fees']
+            assert Transaction.query.filter_by(idempotency_key='market:9:win_fees').one().tx_hash == '0xsent'
+
+
+class TestCastIndex:
+    """Incremental cast index tests"""
+
+    def test_index_fetches_only_new_casts(self):
+        """Test later lookups page only to the last indexed cast and count windows exactly"""
+        from casts import CastIndex
+
+        class Config:
+            PAGE_SIZE = 2
+            MAX_PAGES = 50
+            REFRESH_SECONDS = 0
+            RETENTION_DAYS = 30
+            MAX_FIDS = 10
+
+        now = datetime.utcnow().replace(microsecond=0)
+        casts = []  # Newest first
+        pages = []
+
+        def post(hours_ago):
+            created = now - timedelta(hours=hours_ago)
+            casts.insert(0, {'hash': f'0x{len(casts)}', 'created_at': created.isoformat() + 'Z'})
+
+        def fetch_page(fid, cursor):
+            start = cursor or 0
+            pages.append(start)
+            end = start + Config.PAGE_SIZE
+            return casts[start:end], end if end < len(casts) else None
+
+        for hours_ago in (40, 30, 20, 10, 5, 1):
+            post(hours_ago)
+        index = CastIndex(fetch_page, Config)
+
+        assert index.count(1, now - timedelta(hours=24), now) == 4
+        assert pages == [0, 2, 4]
+
+        post(0.5)
+        post(0.25)
+        pages.clear()
+        assert index.count(1, now - timedelta(hours=24), now + timedelta(minutes=1)) == 6
+        assert pages == [0, 2]
+
+        pages.clear()
+        assert index.count(1, now - timedelta(hours=12), now - timedelta(hours=2)) == 2
+        assert pages == []
+
+        # A window older than the indexed range is backfilled
+        assert index.count(1, now - timedelta(hours=48), now - timedelta(hours=24)) == 2
+        assert pages == [0, 2, 4, 6]
+
+    def test_exact_count_skips_refresh_interval(self):
+        """Test exact lookups sync a window ending after the last sync, however recent"""
+        from casts import CastIndex
+        from config import CastIndexConfig
+
+        now = datetime.utcnow().replace(microsecond=0)
+        casts = [{'hash': '0x0', 'created_at': (now - timedelta(hours=2)).isoformat() + 'Z'}]
+        fetch_page = lambda fid, cursor: (list(casts), None)
+        index = CastIndex(fetch_page, CastIndexConfig)
+        window = (now - timedelta(hours=24), now + timedelta(minutes=1))
+
+        assert index.count(1, *window) == 1
+        casts.insert(0, {'hash': '0x1', 'created_at': now.isoformat() + 'Z'})
+        assert index.count(1, *window) == 1  # Within REFRESH_SECONDS of the last sync
+        assert index.count(1, *window, exact=True) == 2
+
+
+class TestHTTPClient:
+    """Pooled retrying HTTP client tests"""
+
+    @staticmethod
+    def make_client(outcomes):
+        """Client whose session replays outcomes: status codes, (status, headers) or exceptions"""
+        import io
+        import requests
+        from http_client import HTTPClient
+
+        sleeps = []
+        client = HTTPClient(sleep=sleeps.append)
+        calls = []
+
+        def fake_request(method, url, **kwargs):
+            calls.append((method, kwargs['timeout']))
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            status, headers = outcome if isinstance(outcome, tuple) else (outcome, {})
+            response = requests.Response()
+            response.status_code = status
+            response.headers.update(headers)
+            response.raw = io.BytesIO(b'')
+            return response
+
+        client.session.request = fake_request
+        return client, calls, sleeps
+
+    def test_retries_honor_retry_after_and_backoff(self):
+        """Test 429/5xx and connection errors are retried with Retry-After or capped jittered backoff"""
+        import requests
+        from config import HTTPClientConfig
+
+        client, calls, sleeps = self.make_client([(429, {'Retry-After': '2'}), requests.ConnectionError('reset'), 503, 200])
+
+        response = client.get('https://hub.example/api/v1/user')
+
+        assert response.status_code == 200
+        assert len(calls) == 4
+        assert calls[0][1] == (HTTPClientConfig.CONNECT_TIMEOUT_SECONDS, HTTPClientConfig.READ_TIMEOUT_SECONDS)
+        assert sleeps[0] == 2.0
+        assert 0 <= sleeps[1] <= HTTPClientConfig.BACKOFF_BASE_SECONDS * 2
+        assert 0 <= sleeps[2] <= HTTPClientConfig.BACKOFF_BASE_SECONDS * 4
+
+    def test_retries_are_bounded(self):
+        """Test posts are not retried, long Retry-After is not waited out and retries run out"""
+        import requests
+        from config import HTTPClientConfig
+
+        client, calls, sleeps = self.make_client([503])
+        assert client.request('POST', 'https://hub.example/api', json={}).status_code == 503
+        assert len(calls) == 1
+
+        client, calls, sleeps = self.make_client([(429, {'Retry-After': '3600'})])
+        assert client.get('https://hub.example/api').status_code == 429
+        assert sleeps == []
+
+        retries = HTTPClientConfig.MAX_RETRIES
+        client, calls, sleeps = self.make_client([requests.Timeout('slow')] * (retries + 1))
+        with pytest.raises(requests.Timeout):
+            client.get('https://hub.example/api')
+        assert len(sleeps) == retries
+
+    def test_total_budget_caps_attempts_and_waits(self):
+        """Test a call stops retrying and shortens timeouts once its time budget runs low"""
+        from config import HTTPClientConfig
+
+        client, calls, sleeps = self.make_client([(503, {'Retry-After': '4'})] * 3)
+        now = [0.0]
+        client.clock = lambda: now[0]
+        client.sleep = lambda delay: sleeps.append(delay) or now.__setitem__(0, now[0] + delay)
+
+        assert client.get('https://hub.example/api', budget=10).status_code == 503
+        assert sleeps == [4.0, 4.0]  # A third wait would end past the budget
+        assert calls[0][1] == (HTTPClientConfig.CONNECT_TIMEOUT_SECONDS, HTTPClientConfig.READ_TIMEOUT_SECONDS)
+        assert calls[2][1] == (2.0, 2.0)  # Only 2s of the budget were left
+
+    def test_malformed_host_pool_sizes_are_skipped(self):
+        """Test a bad HTTP_HOST_POOL_SIZES entry is ignored instead of failing at import"""
+        from config import parse_host_pool_sizes
+
+        assert parse_host_pool_sizes('api.neynar.com=20, bad, hub.example=x,=3,hub.io=4') == {
+            'api.neynar.com': 20, 'hub.io': 4
+        }
+
+
 class TestErrorHandling:
     """Error handling tests"""
     
@@ -4,11 +4,17 @@ Utility functions and helpers for Farcaster Prediction Market
 
 import re
 import hashlib
+import time
 import hmac
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request, jsonify
-import requests
+from flask import request, jsonify, g, has_app_context, has_request_context, make_response
+from sqlalchemy import insert, select
+from config import CacheConfig, CastIndexConfig, ReplicaConfig
+from casts import CastIndex, parse_cast_time, to_epoch
+from http_client import http_client
 import logging
 
 logger = logging.getLogger(__name__)
@@ -141,6 +147,7 @@ class FarcasterAPI:
         self.api_key = api_key
         self.base_url = base_url
         self.headers = {'X-API-Key': api_key}
+        self.cast_index = CastIndex(self.get_casts_page)
     
     def get_user(self, fid):
         """Fetch user by FID"""
@@ -148,11 +155,10 @@ class FarcasterAPI:
             url = f"{self.base_url}/user/bulk"
             params = {'fids': str(fid)}
             
-            response = requests.get(
+            response = http_client.get(
                 url,
                 params=params,
-                headers=self.headers,
-                timeout=10
+                headers=self.headers
             )
             
             if response.status_code == 200:
@@ -171,11 +177,10 @@ class FarcasterAPI:
             url = f"{self.base_url}/user/casts"
             params = {'fid': str(fid), 'limit': limit}
             
-            response = requests.get(
+            response = http_client.get(
                 url,
                 params=params,
-                headers=self.headers,
-                timeout=10
+                headers=self.headers
             )
             
             if response.status_code == 200:
@@ -187,21 +192,56 @@ class FarcasterAPI:
             logger.error(f"Error fetching casts for {fid}: {e}")
             return []
     
+    def get_casts_page(self, fid, cursor=None):
+        """Fetch one page of a user's casts, newest first; returns (casts, next cursor)"""
+        url = f"{self.base_url}/user/casts"
+        params = {'fid': str(fid), 'limit': CastIndexConfig.PAGE_SIZE}
+        if cursor:
+            params['cursor'] = cursor
+        
+        response = http_client.get(
+            url,
+            params=params,
+            headers=self.headers
+        )
+        response.raise_for_status()
+        
+        data = response.json()
+        return data.get('casts', []), (data.get('next') or {}).get('cursor')
+    
+    def count_casts(self, fid, start, end):
+        """Count user's casts created between two UTC datetimes, from the cast index"""
+        try:
+            return self.cast_index.count(fid, start, end)
+        except Exception as e:
+            logger.error(f"Error counting casts for {fid}: {e}")
+            return 0
+    
+    def count_recent_casts(self, fid, hours=24):
+        """Count user's casts from last N hours"""
+        now = datetime.utcnow()
+        return self.count_casts(fid, now - timedelta(hours=hours), now)
+    
     def get_recent_casts(self, fid, hours=24):
         """Get user's casts from last N hours"""
         try:
-            casts = self.get_user_casts(fid)
-            now = datetime.utcnow()
-            cutoff = now - timedelta(hours=hours)
-            
-            recent_casts = [
-                cast for cast in casts
-                if self._parse_datetime(cast.get('created_at')) > cutoff
-            ]
+            cutoff = to_epoch(datetime.utcnow() - timedelta(hours=hours))
+            recent_casts = []
+            cursor = None
+            for _ in range(CastIndexConfig.MAX_PAGES):
+                casts, cursor = self.get_casts_page(fid, cursor)
+                times = [parse_cast_time(cast.get('created_at')) for cast in casts]
+                recent_casts.extend(
+                    cast for cast, cast_time in zip(casts, times)
+                    if cast_time is not None and cast_time > cutoff
+                )
+                # Pages are newest first, so stop at the first page reaching the cutoff
+                if not cursor or any(cast_time is not None and cast_time <= cutoff for cast_time in times):
+                    break
             
             return recent_casts
         except Exception as e:
-            logger.error(f"Error filtering recent casts: {e}")
+            logger.error(f"Error fetching recent casts for {fid}: {e}")
             return []
     
     def get_user_stats(self, fid):
@@ -210,11 +250,10 @@ class FarcasterAPI:
             url = f"{self.base_url}/user/stats"
             params = {'fid': str(fid)}
             
-            response = requests.get(
+            response = http_client.get(
                 url,
                 params=params,
-                headers=self.headers,
-                timeout=10
+                headers=self.headers
             )
             
             if response.status_code == 200:
@@ -225,14 +264,6 @@ class FarcasterAPI:
         except Exception as e:
             logger.error(f"Error fetching stats for {fid}: {e}")
             return {}
-    
-    @staticmethod
-    def _parse_datetime(date_string):
-        """Parse ISO format datetime"""
-        try:
-            return datetime.fromisoformat(date_string.replace('Z', '+00:00'))
-        except:
-            return datetime.utcnow()
 
 
 # ==================== CALCULATION UTILITIES ====================
@@ -430,10 +461,11 @@ class Cache:
     @staticmethod
     def get(key):
         """Get cached value"""
-        if key in Cache._cache:
-            value, expires_at = Cache._cache[key]
+        cached = Cache._cache.get(key)
+        if cached is not None:
+            value, expires_at = cached
             if expires_at and datetime.utcnow() > expires_at:
-                del Cache._cache[key]
+                Cache._cache.pop(key, None)
                 return None
             return value
         return None
@@ -447,8 +479,7 @@ class Cache:
     @staticmethod
     def delete(key):
         """Delete cached value"""
-        if key in Cache._cache:
-            del Cache._cache[key]
+        Cache._cache.pop(key, None)
     
     @staticmethod
     def clear():
@@ -456,6 +487,239 @@ class Cache:
         Cache._cache.clear()
 
 
+class ResponseCache:
+    """Cache of rendered GET responses, invalidated by tag
+    
+    Views tag their response (e.g. 'markets', 'market:12', 'user:3') and write
+    paths invalidate exactly the tags they affect. Invalidations are numbered so
+    a response rendered while one of its tags was invalidated is not stored.
+    Invalidation records are kept only as long as the longest TTL, since no
+    render outlives that. State is shared by all request threads and guarded
+    by one lock.
+    
+    Every worker process holds its own cache, so invalidations are also
+    written to the cache_invalidations table and each process applies the
+    ones recorded by the others before serving from its cache.
+    """
+    
+    MAX_ENTRIES = 10000
+    
+    _lock = threading.RLock()
+    _keys = set()
+    _keys_by_tag = {}
+    _invalidated_at = {}
+    _invalidated_time = OrderedDict()  # Oldest invalidation first
+    _epoch = 0
+    _applied = {}  # Shared invalidation id -> created_at, already applied here
+    _synced_at = 0.0  # Monotonic time of the last poll
+    _sync_from = None  # Wall-clock lower bound of the next poll
+    
+    @staticmethod
+    def make_key():
+        """Build a cache key from the request route and query string"""
+        args = sorted(request.args.items(multi=True))
+        query = '&'.join(f"{name}={value}" for name, value in args)
+        return f"response:{request.path}?{query}"
+    
+    @staticmethod
+    def store(key, entry, tags, rendered_at_epoch, ttl_seconds, from_replica=False):
+        """Store an entry unless any of its tags was invalidated while it was rendered
+        
+        Entries read from a replica are also skipped while one of their tags was
+        invalidated recently enough that the replica may not have the write yet.
+        """
+        with ResponseCache._lock:
+            if any(ResponseCache._invalidated_at.get(tag, 0) > rendered_at_epoch for tag in tags):
+                return
+            if from_replica:
+                lag_horizon = time.monotonic() - ReplicaConfig.READ_YOUR_WRITES_SECONDS
+                if any(ResponseCache._invalidated_time.get(tag, lag_horizon) > lag_horizon for tag in tags):
+                    return
+            if len(ResponseCache._keys) >= ResponseCache.MAX_ENTRIES:
+                ResponseCache.clear()
+            Cache.set(key, entry, ttl_seconds)
+            ResponseCache._keys.add(key)
+            for tag in tags:
+                ResponseCache._keys_by_tag.setdefault(tag, set()).add(key)
+    
+    @staticmethod
+    def get_or_compute(key, tags, ttl_seconds, compute):
+        """Cached value for key, computed and stored under tags on a miss
+        
+        For data shared by several views, such as a user's stats snapshot;
+        invalidating any of the tags drops it along with tagged responses.
+        """
+        ResponseCache.sync()
+        value = Cache.get(key)
+        if value is None:
+            rendered_at_epoch = ResponseCache._epoch
+            value = compute()
+            if value is not None and CacheConfig.ENABLED:
+                from_replica = has_request_context() and g.get('read_replica', False)
+                ResponseCache.store(key, value, tags, rendered_at_epoch, ttl_seconds, from_replica=from_replica)
+        return value
+    
+    @staticmethod
+    def invalidate(*tags):
+        """Drop every cached response carrying any of the given tags
+        
+        Within an app context the tags are also recorded for the other worker
+        processes; that commits the session, so call it after the write.
+        """
+        ResponseCache._invalidate_local(tags)
+        if tags and has_app_context():
+            ResponseCache._publish(tags)
+    
+    @staticmethod
+    def _publish(tags):
+        """Record invalidated tags for other workers and prune expired records"""
+        from database import db, CacheInvalidation
+        
+        now = datetime.utcnow()
+        retention = max(CacheConfig.TIMEOUTS.values()) + CacheConfig.INVALIDATION_OVERLAP_SECONDS
+        applied = db.session.scalars(
+            insert(CacheInvalidation).returning(CacheInvalidation.id),
+            [{'tag': tag, 'created_at': now} for tag in tags]
+        ).all()
+        CacheInvalidation.query.filter(
+            CacheInvalidation.created_at < now - timedelta(seconds=retention)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        
+        with ResponseCache._lock:
+            for invalidation_id in applied:
+                ResponseCache._applied[invalidation_id] = now
+    
+    @staticmethod
+    def sync():
+        """Apply invalidations recorded by other workers since the last poll
+        
+        Polls the primary at most every INVALIDATION_POLL_SECONDS and reads back
+        INVALIDATION_OVERLAP_SECONDS before the previous poll; ids already
+        applied are skipped.
+        """
+        if not CacheConfig.ENABLED or not has_app_context():
+            return
+        
+        with ResponseCache._lock:
+            polled = time.monotonic()
+            if polled - ResponseCache._synced_at < CacheConfig.INVALIDATION_POLL_SECONDS:
+                return
+            ResponseCache._synced_at = polled
+        
+        from database import db, CacheInvalidation
+        
+        now = datetime.utcnow()
+        overlap = timedelta(seconds=CacheConfig.INVALIDATION_OVERLAP_SECONDS)
+        since = ResponseCache._sync_from or now - overlap
+        rows = db.session.execute(
+            select(CacheInvalidation.id, CacheInvalidation.tag, CacheInvalidation.created_at)
+            .where(CacheInvalidation.created_at >= since),
+            bind_arguments={'bind': db.engine}
+        ).all()
+        
+        with ResponseCache._lock:
+            tags = {row.tag for row in rows if row.id not in ResponseCache._applied}
+            for row in rows:
+                ResponseCache._applied[row.id] = row.created_at
+            ResponseCache._sync_from = now - overlap
+            for invalidation_id, created_at in list(ResponseCache._applied.items()):
+                if created_at < ResponseCache._sync_from:
+                    del ResponseCache._applied[invalidation_id]
+            if tags:
+                ResponseCache._invalidate_local(tags)
+    
+    @staticmethod
+    def _invalidate_local(tags):
+        """Drop this process's cached responses carrying any of the tags"""
+        now = time.monotonic()
+        with ResponseCache._lock:
+            ResponseCache._epoch += 1
+            for tag in tags:
+                ResponseCache._invalidated_at[tag] = ResponseCache._epoch
+                ResponseCache._invalidated_time[tag] = now
+                ResponseCache._invalidated_time.move_to_end(tag)
+                for key in ResponseCache._keys_by_tag.pop(tag, ()):
+                    Cache.delete(key)
+                    ResponseCache._keys.discard(key)
+            ResponseCache._prune(now)
+    
+    @staticmethod
+    def _prune(now):
+        """Forget invalidations older than any cached entry or replica lag"""
+        horizon = now - max(*CacheConfig.TIMEOUTS.values(), ReplicaConfig.READ_YOUR_WRITES_SECONDS)
+        invalidated = ResponseCache._invalidated_time
+        while invalidated:
+            tag, invalidated_time = next(iter(invalidated.items()))
+            if invalidated_time > horizon:
+                break
+            del invalidated[tag]
+            ResponseCache._invalidated_at.pop(tag, None)
+    
+    @staticmethod
+    def clear():
+        """Drop all cached responses and values"""
+        with ResponseCache._lock:
+            for key in ResponseCache._keys:
+                Cache.delete(key)
+            ResponseCache._keys.clear()
+            ResponseCache._keys_by_tag.clear()
+            ResponseCache._applied.clear()
+            ResponseCache._synced_at = 0.0
+            ResponseCache._sync_from = None
+
+
+def tag_response(*tags):
+    """Attach cache invalidation tags to the response being rendered"""
+    g.setdefault('response_cache_tags', set()).update(tags)
+
+
+def cached_response(timeout_key, tags=None):
+    """Decorator to cache successful GET responses and answer conditional
+    requests with 304 using a strong ETag of the response body
+    
+    ``timeout_key`` selects the TTL from CacheConfig.TIMEOUTS and ``tags`` is an
+    optional callable mapping the view's keyword arguments to invalidation tags.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not CacheConfig.ENABLED:
+                return f(*args, **kwargs)
+            
+            ResponseCache.sync()
+            key = ResponseCache.make_key()
+            entry = Cache.get(key)
+            if entry is None:
+                rendered_at_epoch = ResponseCache._epoch
+                g.response_cache_tags = set(tags(**kwargs)) if tags else set()
+                
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                
+                body = response.get_data()
+                entry = {
+                    'body': body,
+                    'mimetype': response.mimetype,
+                    'etag': hashlib.sha256(body).hexdigest()
+                }
+                ResponseCache.store(
+                    key, entry, g.response_cache_tags, rendered_at_epoch,
+                    CacheConfig.TIMEOUTS[timeout_key], from_replica=g.get('read_replica', False)
+                )
+            
+            response = make_response(entry['body'])
+            response.mimetype = entry['mimetype']
+            response.set_etag(entry['etag'])
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+        
+        return decorated_function
+    
+    return decorator
+
+
 # ==================== LOGGING UTILITIES ====================
 
 def setup_logger(name, log_file=None, level=logging.INFO):
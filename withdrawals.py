@@ -0,0 +1,242 @@
+"""
+Withdrawal processor for Farcaster Prediction Market
+Pays out pending withdrawals in batches, one transfer per wallet
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from blockchain import PLATFORM_WALLET
+from config import WithdrawalProcessorConfig
+from database import db, SchedulerLease, Transaction, UserBalance, Withdrawal
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'withdrawal_processor'
+
+
+class WithdrawalProcessor:
+    """Drains pending withdrawals in batches
+
+    Each tick claims up to BATCH_SIZE pending withdrawals ('pending' ->
+    'processing'), giving the ones for the same wallet a shared transfer key.
+    Every key is paid with one transfer; transfers are submitted with at most
+    MAX_CONCURRENT_TRANSFERS in flight and their outcomes recorded together in
+    one transaction. Transfer intents are committed to the transactions table
+    before submitting, so withdrawals left 'processing' by a crashed tick are
+    resubmitted under the same key once their claim goes stale. As with the
+    settlement scheduler, only the process holding the 'withdrawal_processor'
+    lease runs ticks.
+    """
+
+    def __init__(self, app, config=WithdrawalProcessorConfig):
+        self.app = app
+        self.config = config
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stats = {
+            'batches': 0,
+            'withdrawals_paid': 0,
+            'withdrawals_failed': 0,
+            'transfers': 0,
+            'last_batch_withdrawals': 0,
+            'last_batch_seconds': 0.0,
+            'last_batch_at': None
+        }
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire_lease(self, now):
+        """Take or renew the processor lease; returns True when this process leads"""
+        return SchedulerLease.acquire(LEASE_NAME, self.owner, now, self.config.LEASE_SECONDS)
+
+    def claim(self, now, ids=None):
+        """Mark pending withdrawals 'processing', grouped by wallet; returns their transfer keys
+
+        Claims the oldest BATCH_SIZE pending withdrawals, or only the given ids.
+        """
+        query = db.session.query(Withdrawal.id, Withdrawal.user_wallet).filter(Withdrawal.status == 'pending')
+        if ids is not None:
+            query = query.filter(Withdrawal.id.in_(ids))
+        rows = query.order_by(Withdrawal.id).limit(self.config.BATCH_SIZE).all()
+
+        groups = {}
+        for withdrawal_id, wallet in rows:
+            groups.setdefault(wallet.lower(), []).append(withdrawal_id)
+
+        keys = []
+        for group in groups.values():
+            # A withdrawal is claimed once, so its first id makes the key unique
+            key = f"withdrawals:{group[0]}"
+            claimed = Withdrawal.query.filter(
+                Withdrawal.id.in_(group),
+                Withdrawal.status == 'pending'
+            ).update({'status': 'processing', 'transfer_key': key, 'claimed_at': now}, synchronize_session=False)
+            if claimed != len(group):
+                # Some were claimed concurrently; leave the batch to the next tick
+                db.session.rollback()
+                return []
+            keys.append(key)
+        db.session.commit()
+        return keys
+
+    def stale_keys(self, now):
+        """Transfer keys of withdrawals abandoned mid-payment"""
+        cutoff = now - timedelta(seconds=self.config.STALE_CLAIM_SECONDS)
+        return [key for (key,) in db.session.query(Withdrawal.transfer_key).filter(
+            Withdrawal.status == 'processing',
+            Withdrawal.claimed_at < cutoff
+        ).distinct()]
+
+    def pay(self, keys, now=None):
+        """Send one transfer per key and record the outcomes; returns {key: result}"""
+        from project import tx_handler
+        from utils import ResponseCache
+
+        if not keys:
+            return {}
+        started = time.monotonic()
+
+        withdrawals = db.session.query(
+            Withdrawal.id, Withdrawal.transfer_key, Withdrawal.user_fid, Withdrawal.user_wallet, Withdrawal.amount
+        ).filter(
+            Withdrawal.transfer_key.in_(keys),
+            Withdrawal.status == 'processing'
+        ).order_by(Withdrawal.id).all()
+        groups = {}
+        for withdrawal in withdrawals:
+            groups.setdefault(withdrawal.transfer_key, []).append(withdrawal)
+
+        # Record every intent before anything is sent; a resumed key reuses its intent
+        intents = {tx.idempotency_key: tx for tx in Transaction.query.filter(Transaction.idempotency_key.in_(list(groups)))}
+        for key, group in groups.items():
+            if key not in intents:
+                intents[key] = Transaction(
+                    idempotency_key=key,
+                    from_address=PLATFORM_WALLET,
+                    to_address=group[0].user_wallet,
+                    amount=sum(withdrawal.amount for withdrawal in group),
+                    tx_type='withdrawal',
+                    related_id=group[0].id,
+                    status='pending'
+                )
+                db.session.add(intents[key])
+        transfers = [
+            (key, intents[key].to_address, intents[key].amount, [withdrawal.id for withdrawal in group])
+            for key, group in groups.items()
+        ]
+        db.session.commit()
+
+        def send(transfer):
+            key, to_address, amount, withdrawal_ids = transfer
+            return tx_handler.send_transaction(
+                to_address=to_address,
+                amount=amount,
+                description=f"Withdrawal payout for withdrawals {', '.join(map(str, withdrawal_ids))}",
+                tx_type='withdrawal',
+                idempotency_key=key
+            )
+
+        workers = min(self.config.MAX_CONCURRENT_TRANSFERS, len(transfers)) or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = dict(zip(groups, executor.map(send, transfers)))
+
+        self.record(groups, intents, results, now or datetime.utcnow())
+
+        paid = sum(len(groups[key]) for key, result in results.items() if result['success'])
+        self.stats['batches'] += 1
+        self.stats['transfers'] += len(results)
+        self.stats['withdrawals_paid'] += paid
+        self.stats['withdrawals_failed'] += len(withdrawals) - paid
+        self.stats['last_batch_withdrawals'] = len(withdrawals)
+        self.stats['last_batch_seconds'] = time.monotonic() - started
+        self.stats['last_batch_at'] = datetime.utcnow().isoformat()
+
+        ResponseCache.invalidate(*{f'user:{withdrawal.user_fid}' for withdrawal in withdrawals})
+        return results
+
+    def record(self, groups, intents, results, now):
+        """Write transfer outcomes to withdrawals, intents and the ledger in one transaction"""
+        adjustments = {}
+        for key, result in results.items():
+            succeeded = result['success']
+            values = {
+                'status': 'completed' if succeeded else 'failed',
+                'transaction_hash': result.get('hash'),
+                'error_message': None if succeeded else result['error'],
+                'processed_at': now
+            }
+            # Conditional, so outcomes recorded by another payer are not applied twice
+            if not Withdrawal.query.filter(
+                Withdrawal.transfer_key == key,
+                Withdrawal.status == 'processing'
+            ).update(values, synchronize_session=False):
+                continue
+
+            intent = intents[key]
+            intent.tx_hash = result.get('hash')
+            intent.status = 'pending' if succeeded else 'failed'
+            intent.error_message = None if succeeded else result['error']
+
+            for withdrawal in groups[key]:
+                debited, held = adjustments.get(withdrawal.user_fid, (0.0, 0.0))
+                adjustments[withdrawal.user_fid] = (
+                    debited + (withdrawal.amount if succeeded else 0), held - withdrawal.amount
+                )
+
+        for fid, (debited, held) in adjustments.items():
+            UserBalance.adjust(fid, debited=debited, held=held)
+        db.session.commit()
+
+    def run_once(self, now=None):
+        """Run one processor tick; returns {key: result} for the transfers sent"""
+        now = now or datetime.utcnow()
+
+        if not self.acquire_lease(now):
+            return {}
+
+        keys = self.stale_keys(now) + self.claim(now)
+        return self.pay(keys, now)
+
+    def metrics(self):
+        """Processor counters with the current queue depth"""
+        depth = dict(db.session.query(Withdrawal.status, db.func.count(Withdrawal.id)).filter(
+            Withdrawal.status.in_(('pending', 'processing'))
+        ).group_by(Withdrawal.status).all())
+        seconds = self.stats['last_batch_seconds']
+        return {
+            **self.stats,
+            'last_batch_per_second': self.stats['last_batch_withdrawals'] / seconds if seconds else 0.0,
+            'queue_depth': depth.get('pending', 0),
+            'processing': depth.get('processing', 0)
+        }
+
+    def start(self):
+        """Start the processor loop in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='withdrawal-processor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Withdrawal processor tick failed: {e}", exc_info=True)
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.config.POLL_INTERVAL_SECONDS)